@@ -1,20 +1,38 @@
 import os
+import threading
 from typing import Optional
 
 import numpy as np
 import zwoasi as asi
 
+from camera_backend import CameraBackend
+from frame_pool import FramePool
+from geometry import SensorGeometry
 
-class ASICamera:
-    def __init__(self, camera_index: int = 0, sdk_path: Optional[str] = None):
+
+# zwoasi.init() may only run once per process, cameras open from several workers
+_sdk_lock = threading.Lock()
+_sdk_loaded = False
+
+
+class ASICamera(CameraBackend):
+    def __init__(self, camera_index: int = 0, sdk_path: Optional[str] = None, pool_size: int = 6):
         self._init_sdk(sdk_path)
         self._open_camera(camera_index)
 
+        props = self.cam.get_camera_property()
+        w, h, _bins, _img_type = self.cam.get_roi_format()
+        self.geometry = SensorGeometry(int(props["MaxWidth"]), int(props["MaxHeight"]), 0, 0, w, h, 1)
+        self.pool = FramePool((h, w), dtype=np.uint16, size=pool_size)
+
     def _init_sdk(self, sdk_path: Optional[str]) -> None:
+        global _sdk_loaded
         env_path = os.environ.get("ASI_SDK_PATH")
         chosen = sdk_path or env_path
-        if chosen:
-            asi.init(chosen)
+        with _sdk_lock:
+            if chosen and not _sdk_loaded:
+                asi.init(chosen)
+                _sdk_loaded = True
 
     def _open_camera(self, camera_index: int) -> None:
         num = asi.get_num_cameras()
@@ -37,18 +55,43 @@ class ASICamera:
     def set_gain(self, gain: int) -> None:
         self.cam.set_control_value(asi.ASI_GAIN, int(gain))
 
-    def get_frame(self) -> np.ndarray:
-        frame = self.cam.capture_video_frame()
-        if not isinstance(frame, np.ndarray):
-            frame = np.array(frame)
+    def get_frame(self, timeout_ms: Optional[int] = None) -> Optional[np.ndarray]:
+        # RAW16 straight into a pooled buffer: no per-frame allocation, no
+        # get_roi_format round trip and no dtype or channel conversion needed
+        frame = self.pool.acquire()
+        try:
+            self.cam.get_video_data(timeout=timeout_ms, buffer_=self.pool.backing(frame))
+        except asi.ZWO_IOError as e:
+            self.pool.release(frame)
+            if getattr(e, "error_code", None) == asi.ASI_ERROR_TIMEOUT and timeout_ms is not None:
+                return None
+            raise
+        except Exception:
+            self.pool.release(frame)
+            raise
+        return frame
 
-        if frame.dtype != np.uint16:
-            frame = frame.astype(np.uint16, copy=False)
+    def set_geometry(self, geometry: SensorGeometry) -> None:
+        # set_roi takes the start position and size in binned pixels
+        b = geometry.bin
+        self.cam.stop_video_capture()
+        self.cam.set_roi(
+            start_x=geometry.x // b,
+            start_y=geometry.y // b,
+            width=geometry.w // b,
+            height=geometry.h // b,
+            bins=b,
+            image_type=asi.ASI_IMG_RAW16,
+        )
+        self.cam.start_video_capture()
 
-        if frame.ndim == 3:
-            frame = frame[:, :, 0]
+        self.geometry = geometry
+        self.pool = FramePool(geometry.frame_shape, dtype=np.uint16, size=self.pool.size)
 
-        return frame
+    def abort_exposure(self) -> None:
+        # Restarting video mode discards the frame currently being exposed
+        self.cam.stop_video_capture()
+        self.cam.start_video_capture()
 
     def close(self) -> None:
         try:
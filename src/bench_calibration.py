@@ -0,0 +1,66 @@
+"""
+Per-frame calibration cost: the old snapshot loop against CalibrationKernel.
+
+    python src/bench_calibration.py [width height frames workers]
+"""
+import sys
+import time
+
+import numpy as np
+
+from calibration_frames import CalibrationKernel
+
+
+def loop_calibrate(frames, master_dark, master_flat):
+    # what take_snapshot used to do for every frame
+    out = []
+    for f in frames:
+        img = f.astype(np.float32)
+        img = img - master_dark.astype(np.float32)
+        denom = np.clip(master_flat, 1e-6, None)
+        img = img / denom
+        out.append(np.clip(img, 0, 65535).astype(np.uint16))
+    return out
+
+
+def kernel_calibrate(kernel, frames, dark, flat_inv):
+    return [kernel.apply(f, dark, flat_inv) for f in frames]
+
+
+def best_of(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = fn()
+        dt = time.perf_counter() - t
+        best = dt if best is None else min(best, dt)
+    return best, result
+
+
+def main():
+    args = [int(a) for a in sys.argv[1:]]
+    w, h, n, workers = (args + [4144, 2822, 10, 0][len(args):])[:4]
+
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(500, 60000, (h, w), dtype=np.uint16) for _ in range(n)]
+    master_dark = rng.integers(0, 800, (h, w), dtype=np.uint16)
+    master_flat = rng.uniform(0.7, 1.3, (h, w)).astype(np.float32)
+
+    # operands as CalibrationMasters keeps them
+    dark = master_dark.astype(np.float32)
+    flat_inv = (1.0 / np.clip(master_flat, 1e-6, None)).astype(np.float32)
+    kernel = CalibrationKernel(workers=workers)
+
+    t_loop, ref = best_of(lambda: loop_calibrate(frames, master_dark, master_flat))
+    t_kernel, out = best_of(lambda: kernel_calibrate(kernel, frames, dark, flat_inv))
+    kernel.close()
+
+    diff = max(int(np.abs(a.astype(np.int32) - b).max()) for a, b in zip(ref, out))
+    print(f"{w}x{h}, {n} frames, {kernel.workers} workers")
+    print(f"loop:   {t_loop / n * 1000:7.1f} ms/frame")
+    print(f"kernel: {t_kernel / n * 1000:7.1f} ms/frame  ({t_loop / t_kernel:.1f}x)")
+    print(f"max difference: {diff} ADU (reciprocal flat rounding)")
+
+
+if __name__ == "__main__":
+    main()
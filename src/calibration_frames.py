@@ -1,5 +1,8 @@
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
 import numpy as np
 import cv2
 
@@ -11,10 +14,167 @@ def save_tiff16(path: str, img16: np.ndarray):
     cv2.imwrite(path, img16)
 
 
+# Per pixel these stacks commute with subtracting a dark and scaling by a
+# positive flat, so raw frames can be stacked first and calibrated once.
+# sigma_clip and winsorized do not: their sigma floor is one ADU value for the
+# whole frame, which the flat would scale differently in every pixel.
+CALIBRATE_AFTER_STACKING = ("median", "mean", "minmax")
+
+
+# up to this many frames the median runs on a sorting network
+NETWORK_MAX_FRAMES = 256
+
+
+@lru_cache(maxsize=None)
+def _median_network(n: int) -> tuple:
+    """
+    Compare-exchange pairs of Batcher's odd-even merge sort for n inputs, cut
+    down to those the middle one or two outputs depend on.
+    """
+    p2 = 1
+    while p2 < n:
+        p2 *= 2
+    pairs = []
+    p = 1
+    while p < p2:
+        k = p
+        while k >= 1:
+            for j in range(k % p, p2 - k, 2 * k):
+                for i in range(min(k, p2 - j - k)):
+                    if (i + j) // (2 * p) == (i + j + k) // (2 * p):
+                        pairs.append((i + j, i + j + k))
+            k //= 2
+        p *= 2
+
+    # inputs past n are +inf and never move, later pairs only matter if they feed the middle
+    needed = {(n - 1) // 2, n // 2}
+    kept = []
+    for a, b in reversed(pairs):
+        if b < n and (a in needed or b in needed):
+            kept.append((a, b))
+            needed.update((a, b))
+    return tuple(reversed(kept))
+
+
+def run_tiles(h: int, rows: int, fn, workers: int = 0, name: str = "stack"):
+    """Calls fn(slice) for bands of rows rows covering h, on a thread pool of workers (0: up to 4)."""
+    tiles = [slice(y, min(y + rows, h)) for y in range(0, h, rows)]
+    workers = workers or max(1, min(4, os.cpu_count() or 1))
+    if workers == 1 or len(tiles) == 1:
+        for r in tiles:
+            fn(r)
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name) as pool:
+            list(pool.map(fn, tiles))
+
+
+def tile_rows(stack: np.ndarray, tile_bytes: int = 1 << 20) -> int:
+    """Rows per tile so an (N, rows, W) piece of stack takes about tile_bytes."""
+    n, _, w = stack.shape
+    return max(1, int(tile_bytes) // max(1, n * w * stack.itemsize))
+
+
+def _middle(tile: np.ndarray):
+    """
+    The (N-1)//2-th and N//2-th smallest values of every pixel of an (N, rows,
+    W) tile, which may be reordered. A sorting network up to
+    NETWORK_MAX_FRAMES, a pixel-major partition beyond.
+    """
+    n = len(tile)
+    lo, hi = (n - 1) // 2, n // 2
+    if n <= NETWORK_MAX_FRAMES:
+        planes = list(tile)
+        spare = np.empty_like(planes[0])
+        for a, b in _median_network(n):
+            np.minimum(planes[a], planes[b], out=spare)
+            np.maximum(planes[a], planes[b], out=planes[b])
+            planes[a], spare = spare, planes[a]
+        return planes[lo], planes[hi]
+    t = np.ascontiguousarray(tile.transpose(1, 2, 0))
+    t.partition((lo, hi), axis=-1)
+    return t[..., lo], t[..., hi]
+
+
+def _median_into(out: np.ndarray, low: np.ndarray, high: np.ndarray):
+    if low is high:
+        np.copyto(out, low, casting="unsafe")
+    else:
+        # the mean of the middle pair, as np.median takes it
+        np.add(low, high, out=out, dtype=np.float32)
+        out *= 0.5
+
+
+def median_stack(stack: np.ndarray, out: np.ndarray = None, workers: int = 0,
+                 tile_bytes: int = 1 << 20) -> np.ndarray:
+    """
+    Per-pixel median of an (N, H, W) stack into a float32 (H, W) out, the
+    same values np.median gives. Works in the stack's own dtype on tiles of
+    whole rows of about tile_bytes, which stay in cache. Up to
+    NETWORK_MAX_FRAMES frames a tile goes through a sorting network of
+    whole-row min/max operations, beyond that it is copied pixel-major and
+    partitioned. Tiles are spread over a thread pool, numpy releases the GIL
+    in both.
+    """
+    n, h, w = stack.shape
+    if out is None:
+        out = np.empty((h, w), dtype=np.float32)
+
+    def run(r):
+        _median_into(out[r], *_middle(np.array(stack[:, r, :])))
+
+    run_tiles(h, tile_rows(stack, tile_bytes), run, workers, name="median")
+    return out
+
+
+def winsorized_stack(stack: np.ndarray, kappa: float = 3.0, out: np.ndarray = None, workers: int = 0,
+                     tile_bytes: int = 1 << 20, iterations: int = 5) -> np.ndarray:
+    """
+    Winsorized sigma clipping of an (N, H, W) stack into a float32 (H, W) out.
+    Per pixel the centre is the median, which winsorizing around it never
+    moves. Sigma starts from the median absolute deviation and is refined by
+    winsorizing the values at centre +- 1.5 sigma and taking 1.134 times their
+    standard deviation, until it changes by less than 1% or for at most
+    iterations rounds. Values beyond kappa sigma are then rejected and the
+    rest averaged. Tiled and threaded like median_stack.
+    """
+    n, h, w = stack.shape
+    if out is None:
+        out = np.empty((h, w), dtype=np.float32)
+
+    def run(r):
+        x = stack[:, r, :].astype(np.float32)
+        if n < 3:
+            np.mean(x, axis=0, out=out[r])
+            return
+        centre = np.empty(x.shape[1:], dtype=np.float32)
+        _median_into(centre, *_middle(x.copy()))
+        win = np.abs(x - centre)
+        sigma = np.empty_like(centre)
+        _median_into(sigma, *_middle(win))
+        sigma *= 1.4826
+        # quantised data can have no spread at all, a pixel still gets 1 ADU
+        np.maximum(sigma, 1.0, out=sigma)
+        for _ in range(iterations):
+            np.clip(x, centre - 1.5 * sigma, centre + 1.5 * sigma, out=win)
+            prev, sigma = sigma, win.std(axis=0) * np.float32(1.134)
+            if np.all(np.abs(sigma - prev) <= 0.01 * np.maximum(prev, 1e-3)):
+                break
+
+        keep = np.abs(x - centre) <= kappa * np.maximum(sigma, 1.0)
+        kept = keep.sum(axis=0)
+        total = np.where(keep, x, 0.0).sum(axis=0, dtype=np.float32)
+        np.copyto(out[r], np.where(kept > 0, total / np.maximum(kept, 1), centre), casting="unsafe")
+
+    run_tiles(h, tile_rows(stack, tile_bytes), run, workers, name="winsorized")
+    return out
+
+
 def build_master_stack(frames: list[np.ndarray], method: str = "median") -> np.ndarray:
     stack = np.stack(frames, axis=0)  # (N, H, W)
     if method == "mean":
         out = np.mean(stack, axis=0)
+    elif np.issubdtype(stack.dtype, np.integer):
+        out = median_stack(stack)
     else:
         out = np.median(stack, axis=0)
     return np.clip(out, 0, 65535).astype(np.uint16)
@@ -26,7 +186,12 @@ def make_master_dark(frames: list[np.ndarray], method: str = "median") -> np.nda
 
 def make_master_flat(flat_frames: list[np.ndarray], master_dark: np.ndarray, method: str = "median") -> np.ndarray:
     # Stack the raw flats first
-    flat = build_master_stack(flat_frames, method=method).astype(np.int32)
+    return normalize_flat(build_master_stack(flat_frames, method=method), master_dark)
+
+
+def normalize_flat(flat16: np.ndarray, master_dark: np.ndarray) -> np.ndarray:
+    """Master flat from a stack of raw flats."""
+    flat = flat16.astype(np.int32)
 
     # Dark-correct the flat (classic: flats must be bias/darkflat/dark corrected or they overcorrect)
     dark = master_dark.astype(np.int32)
@@ -43,6 +208,70 @@ def make_master_flat(flat_frames: list[np.ndarray], master_dark: np.ndarray, met
     return flat_norm.astype(np.float32)  # keep float flat for later application
 
 
+class CalibrationKernel:
+    """
+    Dark subtraction and flat correction without per-frame temporaries.
+
+    Works in place on a float32 scratch buffer that is kept while the frame
+    shape stays the same, with the dark as float32 and the reciprocal of the
+    clipped flat as CalibrationMasters.operands() hands them out. The frame is
+    split into bands of band_rows rows, small enough to stay in cache through
+    all steps, which run on a thread pool; numpy releases the GIL inside the
+    ufuncs. One kernel per calling thread, its bands share the scratch buffer.
+    """
+
+    def __init__(self, workers: int = 0, band_rows: int = 64):
+        self.workers = workers or max(1, min(4, os.cpu_count() or 1))
+        self.band_rows = max(1, int(band_rows))
+        self._pool = None
+        if self.workers > 1:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="calibration")
+        self._scratch = None
+        self._out = None
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+    @staticmethod
+    def _reuse(buf, shape, dtype):
+        if buf is None or buf.shape != shape:
+            buf = np.empty(shape, dtype=dtype)
+        return buf
+
+    def apply(self, frame16: np.ndarray, dark=None, flat_inv=None, reuse_output: bool = False) -> np.ndarray:
+        """
+        Calibrated uint16 copy of frame16, clipped to 0..65535. dark and flat_inv
+        are the shape of the frame or None. With reuse_output the result lives
+        in the kernel's own buffer and is only valid until the next call.
+        """
+        shape = frame16.shape
+        self._scratch = self._reuse(self._scratch, shape, np.float32)
+        if reuse_output:
+            out = self._out = self._reuse(self._out, shape, np.uint16)
+        else:
+            out = np.empty(shape, dtype=np.uint16)
+
+        bands = [slice(y, min(y + self.band_rows, shape[0])) for y in range(0, shape[0], self.band_rows)]
+        if self._pool is None or len(bands) == 1:
+            for rows in bands:
+                self._band(frame16, dark, flat_inv, out, rows)
+        else:
+            list(self._pool.map(lambda rows: self._band(frame16, dark, flat_inv, out, rows), bands))
+        return out
+
+    def _band(self, frame16, dark, flat_inv, out, rows):
+        s = self._scratch[rows]
+        if dark is not None:
+            np.subtract(frame16[rows], dark[rows], out=s, dtype=np.float32)
+        else:
+            np.copyto(s, frame16[rows])
+        if flat_inv is not None:
+            np.multiply(s, flat_inv[rows], out=s)
+        np.clip(s, 0, 65535, out=s)
+        np.copyto(out[rows], s, casting="unsafe")
+
+
 def save_flat_float(path: str, flat_norm: np.ndarray):
     # store float flat as 32 bit tiff so we keep precision
     os.makedirs(os.path.dirname(path), exist_ok=True)
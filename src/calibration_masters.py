@@ -0,0 +1,356 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from defects import DefectIndex, DefectMap, defects_path
+from geometry import SensorGeometry, full_geometry, master_for_geometry
+
+
+# what a library entry records about its master
+LIBRARY_FIELDS = ("path", "exposure_us", "gain", "bin", "stack_method", "frames")
+
+
+def library_entries(cfg: dict) -> list[dict]:
+    """
+    Masters of a dark or flat settings dict. Settings from before the library
+    describe a single master in their top-level fields.
+    """
+    entries = cfg.get("library")
+    if entries is None:
+        entries = [cfg]
+    return [e for e in entries if e.get("path")]
+
+
+def _library_key(entry: dict):
+    return entry.get("exposure_us"), entry.get("gain"), int(entry.get("bin", 1))
+
+
+def add_to_library(cfg: dict, entry: dict):
+    """
+    Adds a master to a dark or flat settings dict in place, replacing the one
+    of the same exposure, gain and binning. The top-level fields then describe
+    the newest master.
+    """
+    entries = [
+        {k: e[k] for k in LIBRARY_FIELDS if k in e}
+        for e in library_entries(cfg) if _library_key(e) != _library_key(entry)
+    ]
+    entries.append({k: entry[k] for k in LIBRARY_FIELDS if k in entry})
+    cfg.update(entry)
+    cfg["library"] = entries
+
+
+def library_path(directory: str, kind: str, exposure_us: int, gain: int, bin: int) -> str:
+    """Where the kind master for exposure_us, gain and bin lives under directory."""
+    return os.path.join(directory, f"{kind}s", f"{kind}_{int(exposure_us)}us_gain{int(gain)}_bin{int(bin)}.tiff")
+
+
+class CalibrationMasters:
+    """
+    Dark and flat masters of one camera, kept in memory.
+
+    Each kind is a library of masters, one per exposure, gain and binning
+    (see library_entries). A frame gets the master captured with its exposure
+    and gain. Without one, its dark is modelled as bias plus dark current
+    scaled by exposure time, from a per-pixel straight line through the darks
+    of the same gain at two or more exposures, or else the dark of the same
+    gain closest in exposure is used as it is. A normalised flat barely
+    depends on exposure, so without an exact one the closest flat is used,
+    preferably of the same gain. notes() says when a frame got a substitute.
+
+    defects() combines the defect maps stored next to the masters a frame
+    gets (see defects.DefectMap), from the flat too unless the "defects"
+    settings say use_flat false. Masters without one have it found on load.
+
+    Masters are stored in raw sensor coordinates: the whole sensor, at the
+    binning they were captured with, before any distortion correction or crop.
+    view() cuts them down to a frame's readout window, so changing the crop or
+    the distortion model never invalidates them. Views are cached per geometry
+    together with the operands calibration needs: the dark as float32 and the
+    reciprocal of the clipped flat. Loaded files and views are both kept in
+    LRU caches, so switching between a few exposure and gain pairs costs
+    neither disk reads nor rebuilt operands.
+
+    Files are read once. refresh() checks their modification times and is
+    meant to be called before a capture, the frame path itself never touches
+    the disk unless the exposure, gain or library changed.
+    """
+
+    KINDS = ("dark", "flat")
+
+    def __init__(self, settings, max_masters: int = 8, max_views: int = 8):
+        self.settings = settings
+        self.max_masters = max(1, int(max_masters))
+        self.max_views = max(1, int(max_views))
+        self._masters = OrderedDict()  # path -> (mtime, array)
+        self._defect_maps = OrderedDict()  # path -> DefectMap
+        # (kind, library, geometry, exposure_us, gain) -> source, see _select
+        self._selected = OrderedDict()
+        self._views = OrderedDict()  # (kind, source, geometry) -> (view, operand)
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Call after a master was written."""
+        with self._lock:
+            self._masters.clear()
+            self._defect_maps.clear()
+            self._selected.clear()
+            self._views.clear()
+
+    def _config(self, kind: str):
+        """The library of an enabled kind as ((path, exposure_us, gain, bin), ...), None if switched off or empty."""
+        cfg = self.settings.data.get(kind, {})
+        if not bool(cfg.get("enabled", False)):
+            return None
+        library = tuple(
+            (e["path"], e.get("exposure_us"), e.get("gain"), int(e.get("bin", 1))) for e in library_entries(cfg)
+        )
+        return library or None
+
+    @staticmethod
+    def _mtime(path: str):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _master(self, kind: str, path: str):
+        """(mtime, array) of the master file at path, array is None if it can't be read."""
+        with self._lock:
+            entry = self._masters.get(path)
+            if entry is not None:
+                self._masters.move_to_end(path)
+                return entry
+
+        mtime = self._mtime(path)
+        img = cv2.imread(path, cv2.IMREAD_UNCHANGED) if mtime is not None else None
+        if img is not None:
+            if img.ndim == 3:
+                img = img[:, :, 0]
+            dtype = np.uint16 if kind == "dark" else np.float32
+            if img.dtype != dtype:
+                img = img.astype(dtype, copy=False)
+
+        entry = (mtime, img)
+        with self._lock:
+            self._masters[path] = entry
+            while len(self._masters) > self.max_masters:
+                self._masters.popitem(last=False)
+        return entry
+
+    def refresh(self):
+        """Reloads masters whose file changed on disk since it was read."""
+        with self._lock:
+            loaded = list(self._masters.items())
+        changed = {path for path, (mtime, _) in loaded if self._mtime(path) != mtime}
+        if not changed:
+            return
+        with self._lock:
+            for path in changed:
+                self._masters.pop(path, None)
+                self._defect_maps.pop(path, None)
+            self._selected.clear()
+            for key in [k for k in self._views if any(part[0] in changed for part in k[1])]:
+                del self._views[key]
+
+    def _fits(self, kind: str, entry, geometry: SensorGeometry) -> bool:
+        path, _, _, master_bin = entry
+        if geometry.bin % master_bin:
+            return False
+        img = self._master(kind, path)[1]
+        return img is not None and img.shape == full_geometry(geometry.sensor_w, geometry.sensor_h, master_bin).frame_shape
+
+    def _part(self, kind: str, entry, weight: float = 1.0):
+        path, exposure_us, gain, master_bin = entry
+        return path, self._master(kind, path)[0], master_bin, exposure_us, gain, weight
+
+    def _select(self, kind: str, library, geometry: SensorGeometry, exposure_us, gain):
+        """
+        The master for frames of exposure_us and gain read out with geometry as
+        a weighted sum of library masters, ((path, mtime, bin, exposure_us,
+        gain, weight), ...), or None.
+        """
+        fits = [e for e in library if self._fits(kind, e, geometry)]
+        if kind == "flat":
+            def distance(e):
+                exposure = max(1, e[1] or 1)
+                return e[2] != gain, abs(math.log(exposure / max(1, exposure_us or 1))), -e[3]
+            return (self._part(kind, min(fits, key=distance)),) if fits else None
+
+        exact = [e for e in fits if e[1] == exposure_us and e[2] == gain]
+        if exact:
+            return (self._part(kind, max(exact, key=lambda e: e[3])),)
+
+        # one dark per exposure, the least binned-down one
+        same_gain = {}
+        for e in sorted((e for e in fits if e[2] == gain and e[1] is not None), key=lambda e: (e[1], e[3])):
+            same_gain[e[1]] = e
+        if len(same_gain) >= 2 and exposure_us is not None:
+            # least squares line through the darks, evaluated at exposure_us, as weights on them
+            t = np.array(list(same_gain), dtype=np.float64)
+            k = len(t)
+            dt = t - t.mean()
+            weights = 1.0 / k + dt * (exposure_us - t.mean()) / float((dt * dt).sum())
+            return tuple(self._part(kind, e, float(w)) for e, w in zip(same_gain.values(), weights))
+        if same_gain:
+            nearest = min(same_gain.values(), key=lambda e: abs(e[1] - (exposure_us or 0)))
+            return (self._part(kind, nearest),)
+
+        # settings from before exposure and gain were recorded
+        unknown = [e for e in fits if e[1] is None or e[2] is None]
+        return (self._part(kind, unknown[-1]),) if unknown else None
+
+    def _source(self, kind: str, geometry: SensorGeometry, exposure_us, gain):
+        library = self._config(kind)
+        if library is None:
+            return None
+        key = (kind, library, geometry, exposure_us, gain)
+        with self._lock:
+            if key in self._selected:
+                self._selected.move_to_end(key)
+                return self._selected[key]
+
+        source = self._select(kind, library, geometry, exposure_us, gain)
+        with self._lock:
+            self._selected[key] = source
+            while len(self._selected) > 64:
+                self._selected.popitem(last=False)
+        return source
+
+    def _entry(self, kind: str, geometry: SensorGeometry, exposure_us, gain):
+        source = self._source(kind, geometry, exposure_us, gain)
+        if source is None:
+            return None
+
+        key = (kind, source, geometry)
+        with self._lock:
+            if key in self._views:
+                self._views.move_to_end(key)
+                return self._views[key]
+
+        parts = []
+        for path, _, master_bin, _, _, weight in source:
+            img = self._master(kind, path)[1]
+            parts.append((master_for_geometry(img, master_bin, geometry) if img is not None else None, weight))
+
+        view = operand = None
+        if any(v is None for v, _ in parts):
+            pass
+        elif len(parts) > 1:
+            # modelled dark
+            operand = sum(np.float32(w) * v.astype(np.float32) for v, w in parts)
+            np.maximum(operand, 0, out=operand)
+            view = np.clip(np.rint(operand), 0, 65535).astype(np.uint16)
+        else:
+            view = parts[0][0]
+            if kind == "dark":
+                operand = view.astype(np.float32)
+            else:
+                operand = (1.0 / np.clip(view, 1e-6, None)).astype(np.float32)
+
+        with self._lock:
+            self._views[key] = (view, operand)
+            while len(self._views) > self.max_views:
+                self._views.popitem(last=False)
+        return view, operand
+
+    def view(self, kind: str, geometry: SensorGeometry, exposure_us=None, gain=None):
+        """
+        The kind master for frames exposed with exposure_us and gain and read
+        out with geometry, None if it is switched off or there is none for them.
+        """
+        entry = self._entry(kind, geometry, exposure_us, gain)
+        return entry[0] if entry is not None else None
+
+    def operands(self, geometry: SensorGeometry, exposure_us=None, gain=None):
+        """(dark as float32, 1 / flat) for frames of exposure_us and gain read out with geometry, None where not applied."""
+        dark = self._entry("dark", geometry, exposure_us, gain)
+        flat = self._entry("flat", geometry, exposure_us, gain)
+        return dark[1] if dark is not None else None, flat[1] if flat is not None else None
+
+    def _defect_map(self, kind: str, path: str) -> DefectMap:
+        with self._lock:
+            if path in self._defect_maps:
+                self._defect_maps.move_to_end(path)
+                return self._defect_maps[path]
+
+        mtime, img = self._master(kind, path)
+        dmap = None
+        stored = defects_path(path)
+        stored_mtime = self._mtime(stored)
+        if stored_mtime is not None and mtime is not None and stored_mtime >= mtime:
+            try:
+                dmap = DefectMap.load(stored)
+            except (OSError, ValueError, KeyError):
+                dmap = None
+        if dmap is None or img is None or dmap.shape != img.shape:
+            # masters from before defect maps, or one that was replaced since
+            dmap = DefectMap.find(img, kind) if img is not None else None
+
+        with self._lock:
+            self._defect_maps[path] = dmap
+            while len(self._defect_maps) > self.max_masters:
+                self._defect_maps.popitem(last=False)
+        return dmap
+
+    def defects(self, geometry: SensorGeometry, exposure_us=None, gain=None):
+        """
+        DefectIndex for frames of exposure_us and gain read out with geometry,
+        None if defect correction is off or their masters show no defects.
+        """
+        cfg = self.settings.data.get("defects", {})
+        if not bool(cfg.get("enabled", True)):
+            return None
+        kinds = self.KINDS if bool(cfg.get("use_flat", True)) else ("dark",)
+        sources = [(kind, self._source(kind, geometry, exposure_us, gain)) for kind in kinds]
+        sources = [(kind, source) for kind, source in sources if source is not None]
+        if not sources:
+            return None
+
+        key = ("defects", tuple(part for _, source in sources for part in source), geometry)
+        with self._lock:
+            if key in self._views:
+                self._views.move_to_end(key)
+                return self._views[key][0]
+
+        parts = []
+        for kind, source in sources:
+            for path, _, master_bin, _, _, _ in source:
+                dmap = self._defect_map(kind, path)
+                if dmap is not None and len(dmap):
+                    parts.append(dmap.in_frame(master_bin, geometry))
+        index = DefectIndex.merge(geometry.frame_shape, parts) if parts else None
+        if index is not None and not len(index):
+            index = None
+
+        with self._lock:
+            self._views[key] = (index, None)
+            while len(self._views) > self.max_views:
+                self._views.popitem(last=False)
+        return index
+
+    def notes(self, geometry: SensorGeometry, exposure_us=None, gain=None) -> list[str]:
+        """What frames of exposure_us and gain read out with geometry got instead of a master made for them."""
+        out = []
+        for kind in self.KINDS:
+            if self._config(kind) is None:
+                continue
+            source = self._source(kind, geometry, exposure_us, gain)
+            if source is None or self.view(kind, geometry, exposure_us, gain) is None:
+                out.append(f"No master {kind} fits this exposure, gain and sensor, it was not applied")
+            elif len(source) > 1:
+                ms = ", ".join(f"{part[3] / 1000:g}" for part in source)
+                out.append(f"Master dark scaled from the darks at {ms} ms")
+            elif source[0][3] is not None and (source[0][3], source[0][4]) != (exposure_us, gain):
+                _, _, _, e, g, _ = source[0]
+                if kind == "dark":
+                    # one dark of this gain gives no dark current to scale
+                    out.append(f"No master dark for this exposure, used the one at {e / 1000:g} ms unscaled, "
+                               f"darks at two exposures of gain {g} would be scaled")
+                else:
+                    out.append(f"No master {kind} for this exposure and gain, used the one at {e / 1000:g} ms, gain {g}")
+        return out
@@ -0,0 +1,50 @@
+from typing import Optional
+
+import numpy as np
+
+from frame_pool import FramePool
+from geometry import SensorGeometry
+
+
+class CameraBackend:
+    """
+    Common surface for every frame source driven by CaptureWorker.
+    get_frame blocks until the next 2D uint16 frame is read out, or returns None
+    once timeout_ms expires (None waits forever) so the caller can service
+    control requests during long exposures.
+
+    Frames returned by get_frame live in the backend's FramePool and must be
+    handed back with release_frame once every consumer is done with them.
+    geometry describes the readout window and binning of those frames.
+    """
+    pool: Optional[FramePool] = None
+    geometry: Optional[SensorGeometry] = None
+
+    def set_exposure_us(self, exposure_us: int) -> None:
+        raise NotImplementedError
+
+    def set_gain(self, gain: int) -> None:
+        raise NotImplementedError
+
+    def get_frame(self, timeout_ms: Optional[int] = None) -> Optional[np.ndarray]:
+        raise NotImplementedError
+
+    def set_geometry(self, geometry: SensorGeometry) -> None:
+        """Changes the readout window and binning. Reallocates the frame pool."""
+        raise NotImplementedError
+
+    def abort_exposure(self) -> None:
+        """Drops the exposure in flight so the next frame starts from now."""
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def release_frame(self, frame: np.ndarray) -> None:
+        if self.pool is not None:
+            self.pool.release(frame)
+
+    def pool_stats(self) -> dict:
+        if self.pool is None:
+            return {}
+        return self.pool.stats()
@@ -0,0 +1,97 @@
+from PyQt5 import QtCore, QtWidgets
+
+from calibration_masters import CalibrationMasters
+from capture_worker import CaptureWorker
+from distortion_calibration import ChessboardCollector
+from frame_pipeline import FramePipeline
+from frame_processor import FrameProcessor
+from frame_ring import RING_CAPACITY, FrameRing
+from snapshot import SnapshotManager
+
+
+class CameraChannel(QtCore.QObject):
+    """
+    One camera and everything that belongs to it: its settings, capture thread,
+    frame ring, processing pipeline, calibration masters and snapshot manager.
+
+    Capture and frame processing each run on their own thread. Every channel
+    feeds its science stream, only the one with processor.previewing set
+    produces preview images.
+    """
+    preview_ready = QtCore.pyqtSignal()  # a new image waits in processor.preview_box
+    error = QtCore.pyqtSignal(str)
+    status = QtCore.pyqtSignal(str)
+
+    def __init__(self, camera_id: str, settings, camera_index: int, parent_widget: QtWidgets.QWidget,
+                 own_folders: bool = False, map_cache=None):
+        super().__init__(parent_widget)
+        self.camera_id = camera_id
+        self.settings = settings
+
+        self.masters = CalibrationMasters(settings)
+        self.pipeline = FramePipeline(settings, map_cache=map_cache, masters=self.masters)
+
+        self.thread = QtCore.QThread(self)
+        self.worker = CaptureWorker(settings, camera_index=camera_index)
+        self.worker.moveToThread(self.thread)
+        self.thread.started.connect(self.worker.start)
+
+        self.frame_ring = FrameRing(
+            capacity=RING_CAPACITY,
+            retain_fn=self.worker.retain_frame,
+            release_fn=self.worker.release_frame,
+        )
+
+        self.processor_thread = QtCore.QThread(self)
+        self.processor = FrameProcessor(settings, self.worker, self.frame_ring, self.pipeline)
+        self.processor.moveToThread(self.processor_thread)
+
+        # submit() only hands the frame over, processing happens on processor_thread
+        self.worker.frame_ready.connect(self.processor.submit, QtCore.Qt.DirectConnection)
+        self.worker.opened.connect(self.processor.prewarm)
+        self.processor.preview_ready.connect(self.preview_ready)
+        self.processor.error.connect(self.error)
+        self.worker.error.connect(self.error)
+        self.worker.status.connect(self.status)
+
+        self.snapshot_manager = SnapshotManager(
+            settings=settings,
+            parent_widget=parent_widget,
+            frame_ring=self.frame_ring,
+            settings_epoch_fn=self.worker.settings_epoch,
+            masters=self.masters,
+            camera_id=camera_id,
+            own_folders=own_folders,
+        )
+
+    def start_chessboard(self) -> ChessboardCollector:
+        """Starts offering live frames to a new chessboard collector."""
+        old = self.stop_chessboard()
+        if old is not None:
+            old.cancel()
+        collector = ChessboardCollector()
+        self.processor.calibration = collector
+        return collector
+
+    def stop_chessboard(self):
+        """Stops offering frames, returns the collector that had them (or None)."""
+        collector = self.processor.calibration
+        self.processor.calibration = None
+        return collector
+
+    def start(self):
+        self.processor_thread.start()
+        self.thread.start()
+
+    def stop(self):
+        collector = self.stop_chessboard()
+        if collector is not None:
+            collector.cancel()
+        self.worker.stop()
+        self.thread.quit()
+        self.thread.wait(2000)
+        self.processor_thread.quit()
+        self.processor_thread.wait(2000)
+        self.processor.clear()
+        self.frame_ring.clear()
+        self.pipeline.close()
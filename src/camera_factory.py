@@ -0,0 +1,64 @@
+import os
+
+from camera_backend import CameraBackend
+from frame_ring import RING_CAPACITY
+
+
+# Overrides settings["camera"]["backend"], handy for CI and headless benchmarks
+BACKEND_ENV = "ASI_CAMERA_BACKEND"
+REPLAY_PATH_ENV = "ASI_REPLAY_PATH"
+
+BACKENDS = ("asi", "sim", "replay")
+
+# pool buffers out besides the ring: the frame being read out, the newest
+# preview frame, the one being processed and one handed to a collector
+FRAMES_IN_FLIGHT = 4
+# frames queued for science while a remap catches up, a stack that falls
+# further behind allocates
+SCIENCE_QUEUED = 2
+POOL_SIZE = RING_CAPACITY + SCIENCE_QUEUED + FRAMES_IN_FLIGHT
+
+
+def get_backend_name(settings) -> str:
+    name = os.environ.get(BACKEND_ENV) or settings.data.get("camera", {}).get("backend", "asi")
+    name = str(name).strip().lower()
+    if name == "simulated":
+        name = "sim"
+    return name
+
+
+def open_camera(settings, camera_index: int = 0) -> CameraBackend:
+    cfg = settings.data.get("camera", {})
+    name = get_backend_name(settings)
+    pool_size = int(cfg.get("pool_size", POOL_SIZE))
+
+    if name == "asi":
+        # imported lazily so sim and replay work on machines without zwoasi
+        from asi_camera import ASICamera
+        return ASICamera(camera_index=camera_index, sdk_path=cfg.get("sdk_path", None), pool_size=pool_size)
+
+    if name == "sim":
+        from sim_camera import SimulatedCamera
+        sim = cfg.get("sim", {})
+        return SimulatedCamera(
+            width=int(sim.get("width", 4144)),
+            height=int(sim.get("height", 2822)),
+            realtime=bool(sim.get("realtime", True)),
+            hot_pixel_fraction=float(sim.get("hot_pixel_fraction", 2e-4)),
+            seed=sim.get("seed", None),
+            pool_size=pool_size,
+            fresh_noise=bool(sim.get("fresh_noise", False)),
+        )
+
+    if name == "replay":
+        from replay_camera import ReplayCamera
+        replay = cfg.get("replay", {})
+        path = os.environ.get(REPLAY_PATH_ENV) or replay.get("path", None)
+        return ReplayCamera(
+            path=path,
+            fps=float(replay.get("fps", 0.0)),
+            loop=bool(replay.get("loop", True)),
+            pool_size=pool_size,
+        )
+
+    raise RuntimeError(f"Unknown camera backend '{name}'. Expected one of {', '.join(BACKENDS)}.")
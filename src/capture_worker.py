@@ -1,51 +1,161 @@
+import queue
+import threading
+import time
+
 from PyQt5 import QtCore
-from asi_camera import ASICamera
+from camera_factory import open_camera
+from frames import Frame
 from settings_manager import SettingsManager
 
 
 class CaptureWorker(QtCore.QObject):
+    """
+    Runs a blocking acquisition loop on its own thread.
+
+    The loop never returns to the Qt event loop while the camera is open, so
+    control requests (exposure, gain, geometry, stop) go through a thread-safe queue that
+    is drained between short frame waits. A settings change aborts the exposure
+    in flight, so it takes effect within one poll interval instead of one exposure.
+
+    Every exposure/gain/geometry request bumps a settings epoch when it is made. Frames
+    carry the epoch the worker had applied when their exposure started, so
+    consumers can tell stale-settings frames apart without sleeping.
+    """
     frame_ready = QtCore.pyqtSignal(object)
+    opened = QtCore.pyqtSignal(object)  # SensorGeometry of the first frames
     error = QtCore.pyqtSignal(str)
     status = QtCore.pyqtSignal(str)
 
-    def __init__(self, settings: SettingsManager):
+    # upper bound for how long a control command waits behind a frame read
+    POLL_MS = 20
+
+    def __init__(self, settings: SettingsManager, camera_index: int = 0):
         super().__init__()
         self.settings = settings
+        self.camera_index = int(camera_index)
         self.camera = None
-        self._timer = None
-        self._running = False
+        self._pool = None
+        self._control = queue.Queue()
+        self._seq = 0
+
+        self._epoch_lock = threading.Lock()
+        self._requested_epoch = 0
+        self._applied_epoch = 0
+        # earliest possible start of the exposure in flight, and of the current epoch
+        self._exposure_origin = time.monotonic()
+        self._epoch_origin = self._exposure_origin
 
-        self._pending_exposure_us = int(self.settings.data.get("exposure_us", 5000))
-        self._pending_gain = int(self.settings.data.get("gain", 50))
+        self._exposure_us = int(self.settings.data.get("exposure_us", 5000))
+        self._gain = int(self.settings.data.get("gain", 50))
 
     @QtCore.pyqtSlot()
     def start(self):
-        self._running = True
         try:
-            self.camera = ASICamera(camera_index=0, sdk_path=None)
+            self.camera = open_camera(self.settings, camera_index=self.camera_index)
+            self._pool = self.camera.pool
             self.status.emit("Camera connected.")
-            self.camera.set_exposure_us(self._pending_exposure_us)
-            self.camera.set_gain(self._pending_gain)
+            self.camera.set_exposure_us(self._exposure_us)
+            self.camera.set_gain(self._gain)
+            self.opened.emit(self.camera.geometry)
         except Exception as e:
             self.error.emit(f"Camera init failed:\n{e}")
-            self._running = False
+            self._close_camera()
             return
 
-        self._timer = QtCore.QTimer()
-        self._timer.setTimerType(QtCore.Qt.PreciseTimer)
-        self._timer.timeout.connect(self._grab_one_frame)
-        self._timer.start(0)
+        self._exposure_origin = time.monotonic()
+        self._epoch_origin = self._exposure_origin
+        try:
+            self._run_loop()
+        finally:
+            self._close_camera()
 
-    @QtCore.pyqtSlot()
-    def stop(self):
-        self._running = False
+    def _run_loop(self):
+        while True:
+            if not self._service_control():
+                return
+
+            try:
+                data = self.camera.get_frame(timeout_ms=self.POLL_MS)
+            except Exception as e:
+                self.error.emit(f"Capture failed:\n{e}")
+                return
+
+            if data is None:
+                continue
+
+            now = time.monotonic()
+            # Earliest possible exposure start: one exposure before readout, or
+            # the previous readout if that came earlier. Exposures restart after
+            # a settings change, so nothing can predate the current epoch.
+            start = min(now - self._exposure_us / 1e6, self._exposure_origin)
+            start = max(start, self._epoch_origin)
+            self._exposure_origin = now
+
+            self._seq += 1
+            self.frame_ready.emit(Frame(
+                data=data,
+                buffer=data,
+                seq=self._seq,
+                timestamp=now,
+                exposure_us=self._exposure_us,
+                gain=self._gain,
+                epoch=self._applied_epoch,
+                exposure_start=start,
+                geometry=self.camera.geometry,
+            ))
+
+    def _service_control(self) -> bool:
+        """
+        Applies every queued command. Repeated exposure, gain or geometry
+        requests are coalesced so dragging a slider costs one camera update.
+        The epoch only advances when the camera took the settings. Returns
+        False once stop has been requested.
+        """
+        pending = {}
+        epoch = self._applied_epoch
+        while True:
+            try:
+                cmd, value, cmd_epoch = self._control.get_nowait()
+            except queue.Empty:
+                break
+            if cmd == "stop":
+                return False
+            pending[cmd] = value
+            epoch = max(epoch, cmd_epoch)
+
+        if not pending:
+            return True
+
+        if "geometry" in pending:
+            try:
+                self.camera.set_geometry(pending["geometry"])
+                self._pool = self.camera.pool
+            except NotImplementedError:
+                self.status.emit("Camera backend does not support ROI/binning.")
+            except Exception as e:
+                self.error.emit(f"Setting ROI failed:\n{e}")
 
         try:
-            if self._timer:
-                self._timer.stop()
-        except Exception:
-            pass
+            if "exposure_us" in pending:
+                self.camera.set_exposure_us(int(pending["exposure_us"]))
+                self._exposure_us = int(pending["exposure_us"])
+            if "gain" in pending:
+                self.camera.set_gain(int(pending["gain"]))
+                self._gain = int(pending["gain"])
+            # the frame in flight was exposed under the old settings
+            self.camera.abort_exposure()
+        except Exception as e:
+            # frames keep the epoch that was last applied, so nobody waiting
+            # for the requested settings takes them for it
+            self.error.emit(f"Applying camera settings failed:\n{e}")
+            return True
 
+        self._applied_epoch = epoch
+        self._epoch_origin = time.monotonic()
+        self._exposure_origin = self._epoch_origin
+        return True
+
+    def _close_camera(self):
         try:
             if self.camera:
                 self.camera.close()
@@ -53,33 +163,42 @@ class CaptureWorker(QtCore.QObject):
             pass
         self.camera = None
 
-    @QtCore.pyqtSlot()
-    def _grab_one_frame(self):
-        if not self._running or not self.camera:
-            return
-        try:
-            frame = self.camera.get_frame()
-            self.frame_ready.emit(frame)
-        except Exception as e:
-            self.error.emit(f"Capture failed:\n{e}")
-            self.stop()
+    # The methods below are called directly from other threads.
+
+    def stop(self):
+        self._control.put(("stop", None, 0))
+
+    def settings_epoch(self) -> int:
+        """Epoch of the most recent exposure/gain request, applied or not."""
+        with self._epoch_lock:
+            return self._requested_epoch
+
+    def _request(self, cmd: str, value: int):
+        with self._epoch_lock:
+            self._requested_epoch += 1
+            self._control.put((cmd, value, self._requested_epoch))
+
+    def retain_frame(self, frame):
+        # FramePool does its own locking
+        if self._pool is not None:
+            self._pool.retain(frame)
+
+    def release_frame(self, frame):
+        if self._pool is not None:
+            self._pool.release(frame)
+
+    def pool_stats(self) -> dict:
+        if self._pool is None:
+            return {}
+        return self._pool.stats()
 
-    @QtCore.pyqtSlot(int)
     def set_exposure_us(self, exposure_us: int):
-        self._pending_exposure_us = int(exposure_us)
         self.settings.set("exposure_us", int(exposure_us))
-        try:
-            if self.camera:
-                self.camera.set_exposure_us(int(exposure_us))
-        except Exception:
-            pass
+        self._request("exposure_us", int(exposure_us))
 
-    @QtCore.pyqtSlot(int)
     def set_gain(self, gain: int):
-        self._pending_gain = int(gain)
         self.settings.set("gain", int(gain))
-        try:
-            if self.camera:
-                self.camera.set_gain(int(gain))
-        except Exception:
-            pass
+        self._request("gain", int(gain))
+
+    def set_geometry(self, geometry):
+        self._request("geometry", geometry)
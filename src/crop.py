@@ -13,16 +13,9 @@ def get_crop_params(settings):
     return enabled, (x0, y0, x1, y1)
 
 
-def apply_crop_if_enabled(frame, settings, selecting=False):
-    if selecting:
-        return frame
-
-    enabled, rect = get_crop_params(settings)
-    if not enabled or rect is None:
-        return frame
-
+def clamp_crop_rect(rect, w: int, h: int):
+    """Clamps a rect in frame pixels to a w x h frame, None if nothing is left."""
     x0, y0, x1, y1 = rect
-    h, w = frame.shape
 
     x0 = max(0, min(w - 2, x0))
     x1 = max(1, min(w - 1, x1))
@@ -30,6 +23,31 @@ def apply_crop_if_enabled(frame, settings, selecting=False):
     y1 = max(1, min(h - 1, y1))
 
     if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1, y1
+
+
+def crop_rect_if_enabled(shape, settings, selecting=False, geometry=None):
+    """The rect apply_crop_if_enabled cuts from a frame of shape, None if it leaves the frame whole."""
+    if selecting:
+        return None
+
+    enabled, rect = get_crop_params(settings)
+    if not enabled or rect is None:
+        return None
+
+    # the rect is stored in full-sensor pixels, frames may be a binned window
+    if geometry is not None:
+        rect = geometry.rect_to_frame(rect)
+
+    h, w = shape
+    return clamp_crop_rect(rect, w, h)
+
+
+def apply_crop_if_enabled(frame, settings, selecting=False, geometry=None):
+    rect = crop_rect_if_enabled(frame.shape, settings, selecting=selecting, geometry=geometry)
+    if rect is None:
         return frame
 
+    x0, y0, x1, y1 = rect
     return frame[y0:y1, x0:x1]
@@ -0,0 +1,193 @@
+import os
+
+import cv2
+import numpy as np
+
+from geometry import SensorGeometry
+
+
+# a pixel is a defect when it is this many noise sigmas off its 5x5 median
+DEFECT_SIGMA = 8.0
+# flats vary a little from pixel to pixel anyway, a defect is off by at least this much
+FLAT_MIN_DEVIATION = 0.1
+# a master where more pixels stand out shows structure, not defects
+MAX_DEFECT_FRACTION = 0.01
+# replacement values are averaged from up to this many neighbours
+NEIGHBOURS = 4
+
+# candidate neighbour offsets within two pixels, nearest first
+_OFFSETS = sorted(
+    ((dy, dx) for dy in range(-2, 3) for dx in range(-2, 3) if (dy, dx) != (0, 0)),
+    key=lambda o: (o[0] * o[0] + o[1] * o[1], o),
+)
+
+
+class DefectMap:
+    """
+    Hot and dead pixels of a master, in the master's own pixels: their
+    coordinates and, for each, the offsets of up to NEIGHBOURS nearby pixels
+    that are not defects themselves (rows padded with (0, 0), count says how
+    many are real). A few bytes per defect, stored next to the master.
+    """
+
+    def __init__(self, shape, ys: np.ndarray, xs: np.ndarray, offsets: np.ndarray, count: np.ndarray):
+        self.shape = tuple(int(v) for v in shape)
+        self.ys = ys.astype(np.uint16)
+        self.xs = xs.astype(np.uint16)
+        self.offsets = offsets.astype(np.int8)  # (D, NEIGHBOURS, 2) as (dy, dx)
+        self.count = count.astype(np.uint8)
+        self.flagged = len(self.ys)  # pixels that stood out, find() drops them all when too many did
+
+    def __len__(self):
+        return len(self.ys)
+
+    @classmethod
+    def find(cls, master: np.ndarray, kind: str, sigma: float = DEFECT_SIGMA) -> "DefectMap":
+        """
+        Defects of a dark (uint16) or normalised flat (float32) master: pixels
+        whose difference to the median of their 5x5 neighbourhood is more than
+        sigma times the typical one. Local medians follow gradients and glow,
+        so only isolated pixels and thin lines stand out. If more than
+        MAX_DEFECT_FRACTION of the pixels do, the master is not uniform enough
+        to tell and the map is empty.
+        """
+        img = np.ascontiguousarray(master)
+        local = cv2.medianBlur(img, 5).astype(np.float32)
+        if kind == "flat":
+            resid = img.astype(np.float32) / np.maximum(local, 1e-6) - 1.0
+            floor = FLAT_MIN_DEVIATION
+        else:
+            resid = img.astype(np.float32) - local
+            floor = 1.0
+        # noise from a subsample, the defects themselves barely move it
+        sample = resid[::4, ::4]
+        noise = 1.4826 * float(np.median(np.abs(sample - np.median(sample))))
+        ys, xs = np.nonzero(np.abs(resid) > max(sigma * noise, floor))
+        if len(ys) > MAX_DEFECT_FRACTION * img.size:
+            dmap = cls.from_pixels(img.shape, ys[:0], xs[:0])
+            dmap.flagged = len(ys)
+            return dmap
+        return cls.from_pixels(img.shape, ys, xs)
+
+    @classmethod
+    def from_pixels(cls, shape, ys: np.ndarray, xs: np.ndarray) -> "DefectMap":
+        """Picks the replacement neighbours of defects at ys, xs in an image of shape."""
+        h, w = shape
+        ys = np.asarray(ys, dtype=np.int64)
+        xs = np.asarray(xs, dtype=np.int64)
+        bad = np.zeros(shape, dtype=bool)
+        bad[ys, xs] = True
+
+        cand = np.array(_OFFSETS, dtype=np.int64)  # (C, 2)
+        ny = ys[:, None] + cand[None, :, 0]
+        nx = xs[:, None] + cand[None, :, 1]
+        ok = (ny >= 0) & (ny < h) & (nx >= 0) & (nx < w)
+        ok[ok] = ~bad[ny[ok], nx[ok]]
+
+        # the first NEIGHBOURS usable candidates of every defect
+        rank = np.cumsum(ok, axis=1) - 1
+        take = ok & (rank < NEIGHBOURS)
+        offsets = np.zeros((len(ys), NEIGHBOURS, 2), dtype=np.int8)
+        rows, cols = np.nonzero(take)
+        offsets[rows, rank[rows, cols]] = cand[cols]
+        return cls(shape, ys, xs, offsets, take.sum(axis=1))
+
+    def save(self, path: str):
+        np.savez_compressed(path, shape=np.array(self.shape), ys=self.ys, xs=self.xs,
+                            offsets=self.offsets, count=self.count)
+
+    @classmethod
+    def load(cls, path: str) -> "DefectMap":
+        with np.load(path) as z:
+            return cls(z["shape"], z["ys"], z["xs"], z["offsets"], z["count"])
+
+    def in_frame(self, master_bin: int, g: SensorGeometry):
+        """
+        (ys, xs, neighbour ys, neighbour xs, neighbour count) in the pixels of
+        frames read out with g, for a map of a whole-sensor master at
+        master_bin. Nothing is dropped, DefectIndex sorts that out.
+        """
+        mb = int(master_bin)
+        b = g.bin
+        ys = (self.ys.astype(np.int64) * mb - g.y) // b
+        xs = (self.xs.astype(np.int64) * mb - g.x) // b
+        ny = ((self.ys[:, None] + self.offsets[:, :, 0]).astype(np.int64) * mb - g.y) // b
+        nx = ((self.xs[:, None] + self.offsets[:, :, 1]).astype(np.int64) * mb - g.x) // b
+        return ys, xs, ny, nx, self.count
+
+
+def defects_path(master_path: str) -> str:
+    return os.path.splitext(master_path)[0] + "_defects.npz"
+
+
+class DefectIndex:
+    """
+    Defects of one frame shape, ready to fix: flat indices of the defects and
+    of their neighbours, with averaging weights. apply() is a single gather
+    and scatter, its cost follows the number of defects, not the image size.
+
+    Built from frame coordinates that may lie outside the frame or overlap:
+    defects outside are dropped, neighbours that are outside or defects
+    themselves get no weight, and defects left without neighbours stay as
+    they are. crop() gives the index of a cropped frame and returns the same
+    object for the same rect, so frames can be told apart by their index.
+    """
+
+    def __init__(self, shape, ys, xs, ny, nx, count):
+        h, w = self.shape = tuple(int(v) for v in shape)
+        self._source = (ys, xs, ny, nx, count)
+        self._crops = {}
+
+        inside = (ys >= 0) & (ys < h) & (xs >= 0) & (xs < w)
+        targets, first = np.unique(ys[inside] * w + xs[inside], return_index=True)
+        ny, nx, count = ny[inside][first], nx[inside][first], count[inside][first]
+
+        used = np.arange(ny.shape[1])[None, :] < count[:, None]
+        ok = used & (ny >= 0) & (ny < h) & (nx >= 0) & (nx < w)
+        neighbours = np.where(ok, ny * w + nx, 0)
+        ok &= ~np.isin(neighbours, targets)
+
+        n = ok.sum(axis=1)
+        keep = n > 0
+        self.targets = targets[keep]
+        self.neighbours = neighbours[keep]
+        self.weights = (ok[keep] / n[keep, None]).astype(np.float32)
+
+    def __len__(self):
+        return len(self.targets)
+
+    @classmethod
+    def merge(cls, shape, parts: list) -> "DefectIndex":
+        """Index of the union of several DefectMap.in_frame() results."""
+        k = max(p[2].shape[1] for p in parts)
+
+        def pad(a):
+            return np.pad(a, ((0, 0), (0, k - a.shape[1])))
+
+        return cls(shape, *(np.concatenate(arrays) for arrays in zip(*(
+            (ys, xs, pad(ny), pad(nx), count) for ys, xs, ny, nx, count in parts
+        ))))
+
+    def crop(self, rect) -> "DefectIndex":
+        """Index of frames cropped to rect (x0, y0, x1, y1), self for None."""
+        if rect is None:
+            return self
+        rect = tuple(int(v) for v in rect)
+        if rect not in self._crops:
+            x0, y0, x1, y1 = rect
+            ys, xs, ny, nx, count = self._source
+            self._crops[rect] = DefectIndex((y1 - y0, x1 - x0), ys - y0, xs - x0, ny - y0, nx - x0, count)
+        return self._crops[rect]
+
+    def apply(self, img: np.ndarray) -> np.ndarray:
+        """Replaces the defects of a C-contiguous img of this shape in place."""
+        if not len(self.targets):
+            return img
+        if not img.flags.c_contiguous or img.shape != self.shape:
+            raise ValueError(f"defects of a {self.shape} frame can't be fixed in place in a {img.shape} one")
+        flat = img.reshape(-1)
+        values = (flat[self.neighbours] * self.weights).sum(axis=1)
+        if np.issubdtype(img.dtype, np.integer):
+            values = np.clip(np.rint(values), 0, np.iinfo(img.dtype).max)
+        flat[self.targets] = values
+        return img
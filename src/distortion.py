@@ -1,12 +1,16 @@
 import numpy as np
 import cv2
 
+from distortion_calibration import calibrated_camera_model
+
 
 class DistortionCorrector:
-    def __init__(self):
+    def __init__(self, cache=None):
         self._map1 = None
         self._map2 = None
         self._cache_key = None
+        # optional MapCache shared across runs
+        self.cache = cache
 
     def invalidate(self):
         self._map1 = None
@@ -14,26 +18,37 @@ class DistortionCorrector:
         self._cache_key = None
 
     def _get_params_from_settings(self, settings):
+        """
+        (enabled, params). params is ("chessboard", image_size, camera matrix, dist
+        coeffs) when a chessboard calibration is switched on, otherwise ("manual",
+        k1, k2, k3, zoom) from the sliders. Hashable, it goes into the map keys.
+        """
+        c = settings.data.get("distortion_calibration", {})
+        if c.get("distortion_enabled") and c.get("camera_matrix") and c.get("dist_coeffs") and c.get("image_size"):
+            size = tuple(int(v) for v in c["image_size"])
+            mtx = tuple(round(float(v), 6) for row in c["camera_matrix"] for v in row)
+            dist = tuple(round(float(v), 9) for v in c["dist_coeffs"])
+            return True, ("chessboard", size, mtx, dist)
+
         d = settings.data.get("distortion_manual", {})
         enabled = bool(d.get("enabled", False))
-        k1 = float(d.get("k1", 0.0))
-        k2 = float(d.get("k2", 0.0))
-        k3 = float(d.get("k3", 0.0))
+        k1 = round(float(d.get("k1", 0.0)), 6)
+        k2 = round(float(d.get("k2", 0.0)), 6)
+        k3 = round(float(d.get("k3", 0.0)), 6)
         zoom = float(d.get("zoom", 1.0))
-        zoom = max(0.2, min(3.0, zoom))
-        return enabled, k1, k2, k3, zoom
-
-    def ensure_maps(self, w: int, h: int, settings):
-        enabled, k1, k2, k3, zoom = self._get_params_from_settings(settings)
+        zoom = round(max(0.2, min(3.0, zoom)), 6)
+        return enabled, ("manual", k1, k2, k3, zoom)
 
-        if not enabled:
-            self.invalidate()
-            return False
-
-        key = (w, h, round(k1, 6), round(k2, 6), round(k3, 6), round(zoom, 6))
-        if self._cache_key == key and self._map1 is not None and self._map2 is not None:
-            return True
+    def _model(self, w: int, h: int, params):
+        """(camera_matrix, dist, new_camera_matrix) of a w x h image for params."""
+        if params[0] == "chessboard":
+            _, size, mtx, dist = params
+            calib = {"image_size": size, "camera_matrix": np.reshape(mtx, (3, 3)), "dist_coeffs": dist}
+            return calibrated_camera_model(calib, w, h)
+        return self._camera_model(w, h, *params[1:])
 
+    @staticmethod
+    def _camera_model(w: int, h: int, k1: float, k2: float, k3: float, zoom: float):
         cx = w / 2.0
         cy = h / 2.0
 
@@ -51,16 +66,162 @@ class DistortionCorrector:
         dist = np.array([k1, k2, 0.0, 0.0, k3], dtype=np.float64)
 
         new_camera_matrix, _ = cv2.getOptimalNewCameraMatrix(camera_matrix, dist, (w, h), 0.0, (w, h))
-        map1, map2 = cv2.initUndistortRectifyMap(
-            camera_matrix, dist, None, new_camera_matrix, (w, h), cv2.CV_16SC2
-        )
+        return camera_matrix, dist, new_camera_matrix
+
+    def _build_maps(self, model_w: int, model_h: int, ox: int, oy: int, region, step: int, params):
+        """
+        CV_16SC2 maps whose output is region (x0, y0, x1, y1) of the corrected
+        model image, decimated by step, reading from a window at (ox, oy).
+        params comes from _get_params_from_settings, None means no correction.
+        """
+        if params is None:
+            camera_matrix = np.eye(3, dtype=np.float64)
+            new_camera_matrix = camera_matrix
+            dist = np.zeros(5, dtype=np.float64)
+        else:
+            camera_matrix, dist, new_camera_matrix = self._model(model_w, model_h, params)
 
-        self._map1 = map1
-        self._map2 = map2
+        x0, y0, x1, y1 = region
+        out_w = max(1, (x1 - x0) // step)
+        out_h = max(1, (y1 - y0) // step)
+
+        # Moving and scaling the output camera makes OpenCV evaluate only the
+        # region (at block centres), moving the source camera shifts the maps
+        # into the readout window
+        out_matrix = new_camera_matrix.copy()
+        out_matrix[0, 0] /= step
+        out_matrix[1, 1] /= step
+        out_matrix[0, 2] = (new_camera_matrix[0, 2] - x0 - (step - 1) / 2.0) / step
+        out_matrix[1, 2] = (new_camera_matrix[1, 2] - y0 - (step - 1) / 2.0) / step
+
+        src_matrix = camera_matrix.copy()
+        src_matrix[0, 2] -= ox
+        src_matrix[1, 2] -= oy
+
+        return cv2.initUndistortRectifyMap(src_matrix, dist, None, out_matrix, (out_w, out_h), cv2.CV_16SC2)
+
+    def plan_maps(self, w: int, h: int, settings, geometry=None, region=None):
+        """
+        (key, build args) of the maps ensure_maps would use, None when correction
+        is off. Cheap and side effect free, so it is safe on any thread.
+        """
+        enabled, params = self._get_params_from_settings(settings)
+        if not enabled:
+            return None
+
+        if geometry is not None:
+            b = geometry.bin
+            model_w, model_h = geometry.sensor_w // b, geometry.sensor_h // b
+            ox, oy = geometry.x // b, geometry.y // b
+        else:
+            model_w, model_h, ox, oy = w, h, 0, 0
+
+        if region is None:
+            region = (0, 0, model_w, model_h)
+        region = tuple(int(v) for v in region)
+
+        key = (model_w, model_h, ox, oy, w, h, region, params)
+        return key, (model_w, model_h, ox, oy, region, 1, params)
+
+    def load_or_build(self, plan):
+        """Maps for a plan_maps() result, from the cache if there is one. Doesn't touch the active maps."""
+        key, args = plan
+        maps = self.cache.load(key) if self.cache is not None else None
+        if maps is None:
+            maps = self._build_maps(*args)
+            if self.cache is not None:
+                self.cache.store(key, *maps)
+        return maps
+
+    def adopt(self, key, maps):
+        """Makes maps built elsewhere the active ones."""
+        self._map1, self._map2 = maps
         self._cache_key = key
+
+    def ensure_maps(self, w: int, h: int, settings, geometry=None, region=None):
+        """
+        Builds maps for a (w, h) source frame. Without a geometry the frame is the
+        whole image. With a SensorGeometry the frame is a (possibly binned) window
+        of the sensor and the model is built for the whole binned sensor.
+
+        The output is region (x0, y0, x1, y1) of the corrected image, in binned
+        full-sensor pixels, so a crop costs nothing extra. None means all of it.
+        """
+        plan = self.plan_maps(w, h, settings, geometry=geometry, region=region)
+        if plan is None:
+            self.invalidate()
+            return False
+
+        key = plan[0]
+        if self._cache_key == key and self._map1 is not None and self._map2 is not None:
+            return True
+
+        self.adopt(key, self.load_or_build(plan))
         return True
 
+    def source_footprint(self, rect, w: int, h: int, settings):
+        """
+        Bounding box (x0, y0, x1, y1) of the source pixels that the remap reads to
+        produce output rect, for a w x h image. Identity when correction is off.
+        """
+        enabled, params = self._get_params_from_settings(settings)
+        x0, y0, x1, y1 = rect
+        if not enabled:
+            return x0, y0, x1, y1
+
+        camera_matrix, dist, new_camera_matrix = self._model(w, h, params)
+
+        # The remap of a rectangle is bounded by the remap of its border
+        n = 64
+        xs = np.linspace(x0, x1, n)
+        ys = np.linspace(y0, y1, n)
+        u = np.concatenate([xs, xs, np.full(n, x0), np.full(n, x1)])
+        v = np.concatenate([np.full(n, y0), np.full(n, y1), ys, ys])
+
+        fx, fy = new_camera_matrix[0, 0], new_camera_matrix[1, 1]
+        cx, cy = new_camera_matrix[0, 2], new_camera_matrix[1, 2]
+        obj = np.stack([(u - cx) / fx, (v - cy) / fy, np.ones_like(u)], axis=1)
+
+        src, _ = cv2.projectPoints(obj, np.zeros(3), np.zeros(3), camera_matrix, dist)
+        src = src.reshape(-1, 2)
+
+        sx0 = int(np.floor(src[:, 0].min()))
+        sy0 = int(np.floor(src[:, 1].min()))
+        sx1 = int(np.ceil(src[:, 0].max())) + 1
+        sy1 = int(np.ceil(src[:, 1].max())) + 1
+        return max(0, sx0), max(0, sy0), min(w, sx1), min(h, sy1)
+
     def apply(self, frame16: np.ndarray) -> np.ndarray:
         if self._map1 is None or self._map2 is None:
             return frame16
         return cv2.remap(frame16, self._map1, self._map2, interpolation=cv2.INTER_LINEAR)
+
+
+class PreviewCorrector(DistortionCorrector):
+    """
+    Distortion correction, crop and decimation for the live preview in a single
+    cv2.remap. Output pixel (u, v) samples the centre of block (u, v) of
+    step x step pixels in the output region, so the maps are built at display
+    resolution and the per-frame cost follows the window size, not the sensor.
+    """
+
+    def ensure_region_maps(self, geometry, region, step: int, settings):
+        """
+        geometry is the SensorGeometry of the source frames, region (x0, y0, x1, y1)
+        the output area in binned full-sensor pixels. Returns the output (w, h).
+        """
+        enabled, params = self._get_params_from_settings(settings)
+        if not enabled:
+            params = None
+
+        b = geometry.bin
+        model_w, model_h = geometry.sensor_w // b, geometry.sensor_h // b
+        ox, oy = geometry.x // b, geometry.y // b
+        region = tuple(int(v) for v in region)
+
+        key = (model_w, model_h, ox, oy, region, step, params)
+        if self._cache_key != key or self._map1 is None or self._map2 is None:
+            self._map1, self._map2 = self._build_maps(model_w, model_h, ox, oy, region, step, params)
+            self._cache_key = key
+
+        return self._map1.shape[1], self._map1.shape[0]
@@ -1,5 +1,40 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import cv2
 import numpy as np
+from PyQt5 import QtCore
+
+FIND_FLAGS = cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_NORMALIZE_IMAGE
+SUBPIX_TERM = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+
+
+def find_chessboard_corners(img_u8: np.ndarray, pattern):
+    """Corners of the chessboard in img_u8, or None. Top level so a process pool can run it."""
+    found, corners = cv2.findChessboardCorners(img_u8, pattern, flags=FIND_FLAGS)
+    return corners if found else None
+
+
+def refine_corners(img_u8: np.ndarray, corners: np.ndarray, sx: float = 1.0, sy: float = 1.0) -> np.ndarray:
+    """
+    Sub-pixel corners on img_u8, starting from corners found on a copy that was
+    downscaled by (sx, sy). The search window grows with the scale so it still
+    covers the coarse error.
+    """
+    corners = corners.astype(np.float32).copy()
+    corners[..., 0] = (corners[..., 0] + 0.5) * sx - 0.5
+    corners[..., 1] = (corners[..., 1] + 0.5) * sy - 0.5
+    half = max(11, int(np.ceil(2 * max(sx, sy))))
+    return cv2.cornerSubPix(img_u8, corners, (half, half), (-1, -1), SUBPIX_TERM)
+
+
+def to_gray_u8(img: np.ndarray) -> np.ndarray:
+    if img.dtype == np.uint8:
+        return img
+    return cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
 
 
 class DistortionCalibrator:
@@ -35,27 +70,27 @@ class DistortionCalibrator:
         if frame_gray_u8.ndim != 2:
             raise ValueError("Expected 2D grayscale image")
 
-        self.image_size = (frame_gray_u8.shape[1], frame_gray_u8.shape[0])
-
-        found, corners = cv2.findChessboardCorners(
-            frame_gray_u8,
-            self.CHESSBOARD_SIZE,
-            flags=cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_NORMALIZE_IMAGE
-        )
+        corners = find_chessboard_corners(frame_gray_u8, self.CHESSBOARD_SIZE)
 
         debug = cv2.cvtColor(frame_gray_u8, cv2.COLOR_GRAY2BGR)
 
-        if not found:
+        if corners is None:
             return False, debug
 
-        term = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
-        corners2 = cv2.cornerSubPix(frame_gray_u8, corners, (11, 11), (-1, -1), term)
+        corners2 = refine_corners(frame_gray_u8, corners)
+        self.add_corners(corners2, (frame_gray_u8.shape[1], frame_gray_u8.shape[0]))
 
+        cv2.drawChessboardCorners(debug, self.CHESSBOARD_SIZE, corners2, True)
+        return True, debug
+
+    def add_corners(self, corners: np.ndarray, image_size) -> None:
+        """Adds refined corners found in an image of image_size (w, h)."""
+        self.image_size = (int(image_size[0]), int(image_size[1]))
         self.objpoints.append(self._objp_template.copy())
-        self.imgpoints.append(corners2)
+        self.imgpoints.append(corners)
 
-        cv2.drawChessboardCorners(debug, self.CHESSBOARD_SIZE, corners2, found)
-        return True, debug
+    def board_count(self) -> int:
+        return len(self.objpoints)
 
     def can_calibrate(self) -> bool:
         return len(self.objpoints) >= 8 and self.image_size is not None
@@ -84,14 +119,136 @@ class DistortionCalibrator:
         }
 
 
-def build_undistort_maps(calib: dict):
+def calibrated_camera_model(calib: dict, w: int, h: int):
     """
-    Precompute remap matrices for fast undistortion.
+    (camera_matrix, dist, new_camera_matrix) of a calibrate() result for a w x h
+    image. The matrix is scaled from the calibration image size, so a calibration
+    taken at one binning serves the others.
     """
-    w, h = calib["image_size"]
+    cw, ch = calib["image_size"]
     mtx = np.array(calib["camera_matrix"], dtype=np.float64)
+    mtx[0] *= w / float(cw)
+    mtx[1] *= h / float(ch)
     dist = np.array(calib["dist_coeffs"], dtype=np.float64).reshape(-1, 1)
 
     new_mtx, _ = cv2.getOptimalNewCameraMatrix(mtx, dist, (w, h), 0)
+    return mtx, dist, new_mtx
+
+
+def build_undistort_maps(calib: dict):
+    """
+    Precompute remap matrices for fast undistortion.
+    """
+    w, h = calib["image_size"]
+    mtx, dist, new_mtx = calibrated_camera_model(calib, w, h)
     map1, map2 = cv2.initUndistortRectifyMap(mtx, dist, None, new_mtx, (w, h), cv2.CV_16SC2)
     return map1, map2
+
+
+class ChessboardCollector(QtCore.QObject):
+    """
+    Feeds a DistortionCalibrator from live frames without holding them up.
+
+    offer() is called on the processing thread and never waits: a frame is only
+    taken when a pool worker is free and min_interval_s has passed, every other
+    frame streams past. findChessboardCorners runs on a downscaled copy in a
+    process pool, the corners are refined with cornerSubPix on the full frame
+    when the detection comes back. finish() calibrates on a background thread.
+    """
+    progress = QtCore.pyqtSignal(int, int)  # boards found, frames tried
+    calibrated = QtCore.pyqtSignal(dict)
+    error = QtCore.pyqtSignal(str)
+
+    DETECT_MAX_SIDE = 1024
+
+    def __init__(self, workers: int = 0, min_interval_s: float = 0.5):
+        super().__init__()
+        self.workers = workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.min_interval_s = float(min_interval_s)
+        self.calibrator = DistortionCalibrator()
+
+        # spawn, forking a process that runs Qt and capture threads is asking for trouble
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._last_t = 0.0
+        self._accepting = True
+        self._cancelled = False
+        self.tried = 0
+
+    def offer(self, frame: np.ndarray, geometry=None) -> bool:
+        """Takes frame for detection if a worker is free. Returns True if it was taken."""
+        if geometry is not None and not geometry.is_full:
+            # a calibration describes the whole sensor, binned full frames are aligned down (full_geometry)
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            size = self.calibrator.image_size
+            if (
+                not self._accepting
+                or self._in_flight >= self.workers
+                or now - self._last_t < self.min_interval_s
+                or (size is not None and size != (frame.shape[1], frame.shape[0]))
+            ):
+                return False
+            self._in_flight += 1
+            self._last_t = now
+
+        full = to_gray_u8(frame)
+        h, w = full.shape
+        scale = max(1.0, max(w, h) / float(self.DETECT_MAX_SIDE))
+        small_w, small_h = max(1, int(round(w / scale))), max(1, int(round(h / scale)))
+        small = full if scale == 1.0 else cv2.resize(full, (small_w, small_h), interpolation=cv2.INTER_AREA)
+
+        try:
+            future = self._pool.submit(find_chessboard_corners, small, self.calibrator.CHESSBOARD_SIZE)
+        except RuntimeError:
+            # pool already shut down
+            with self._lock:
+                self._in_flight -= 1
+            return False
+        future.add_done_callback(lambda f: self._detected(f, full, w / small_w, h / small_h))
+        return True
+
+    def _detected(self, future, full: np.ndarray, sx: float, sy: float):
+        # runs on the pool's result thread
+        corners = None
+        try:
+            corners = future.result()
+            if corners is not None:
+                corners = refine_corners(full, corners, sx, sy)
+        except Exception:
+            corners = None
+
+        with self._lock:
+            self._in_flight -= 1
+            self.tried += 1
+            if corners is not None and not self._cancelled:
+                self.calibrator.add_corners(corners, (full.shape[1], full.shape[0]))
+            found = self.calibrator.board_count()
+            tried = self.tried
+        self.progress.emit(found, tried)
+
+    def finish(self):
+        """Stops taking frames, then calibrated or error is emitted once detections in flight are done."""
+        with self._lock:
+            self._accepting = False
+        threading.Thread(target=self._calibrate, name="chessboard-calibration", daemon=True).start()
+
+    def _calibrate(self):
+        self._pool.shutdown(wait=True)
+        try:
+            with self._lock:
+                result = self.calibrator.calibrate()
+        except Exception as e:
+            self.error.emit(str(e))
+            return
+        result["boards"] = self.calibrator.board_count()
+        self.calibrated.emit(result)
+
+    def cancel(self):
+        with self._lock:
+            self._accepting = False
+            self._cancelled = True
+        self._pool.shutdown(wait=False, cancel_futures=True)
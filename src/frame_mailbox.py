@@ -0,0 +1,41 @@
+import threading
+from typing import Any, Callable, Optional
+
+
+class FrameMailbox:
+    """
+    Latest-item-wins hand-off between two threads.
+
+    put() replaces an item the consumer has not taken yet; the replaced item is
+    counted as dropped and passed to discard_fn (e.g. to return its buffer).
+    put() returns True when the box was empty, which is when the consumer needs
+    waking, so a slow consumer has at most one wake-up queued.
+    """
+
+    def __init__(self, discard_fn: Optional[Callable[[Any], None]] = None):
+        self._discard = discard_fn
+        self._lock = threading.Lock()
+        self._item = None
+        self.dropped = 0
+
+    def put(self, item) -> bool:
+        with self._lock:
+            old = self._item
+            self._item = item
+            if old is not None:
+                self.dropped += 1
+
+        if old is not None and self._discard is not None:
+            self._discard(old)
+        return old is None
+
+    def take(self):
+        with self._lock:
+            item = self._item
+            self._item = None
+            return item
+
+    def clear(self) -> None:
+        item = self.take()
+        if item is not None and self._discard is not None:
+            self._discard(item)
@@ -0,0 +1,217 @@
+import dataclasses
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from calibration_frames import CalibrationKernel
+from crop import clamp_crop_rect, crop_rect_if_enabled, get_crop_params
+from distortion import DistortionCorrector, PreviewCorrector
+from frame_mailbox import FrameMailbox
+from frames import Frame
+from geometry import SensorGeometry, plan_sensor_geometry
+
+
+class FramePipeline:
+    """
+    Turns raw camera frames into the two streams the app consumes.
+
+    science: full resolution, dark/flat calibrated on the raw readout, then
+    distortion corrected and cropped in one remap. Only worth computing while
+    a snapshot is collecting frames.
+
+    preview: corrected, cropped and decimated by an integer factor to roughly
+    the display size in one remap, so its cost follows the window size rather
+    than the sensor.
+
+    Frames are processed on one thread, settings_changed() is called from the
+    GUI thread. While a distortion slider is dragged the preview runs on coarse
+    maps; once it settles the science maps are built on a builder thread and
+    swapped in by the processing thread, so neither thread waits for a rebuild.
+    """
+
+    # preview decimation is multiplied by this while settings are being adjusted
+    COARSE_STEP = 4
+
+    def __init__(self, settings, map_cache=None, masters=None):
+        self.settings = settings
+        # CalibrationMasters, applied to science frames
+        self.masters = masters
+        self._calibration = CalibrationKernel()
+        self.science_distortion = DistortionCorrector(cache=map_cache)
+        self.preview_distortion = PreviewCorrector()
+
+        self._adjusting = False
+        self._source = None  # (geometry, w, h) of the last frame
+        self._generation = 0
+        self._builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="distortion-maps")
+        self._built = FrameMailbox()  # (key, maps) waiting to be swapped in
+
+    def settings_changed(self, adjusting: bool = False):
+        """
+        Distortion or crop settings changed. adjusting means more changes follow
+        right away (a slider is held), the science maps are only rebuilt once a
+        call without it comes in. Requests overtaken by a newer one are dropped.
+        """
+        self._adjusting = adjusting
+        if adjusting:
+            return
+        self._generation += 1
+        self._builder.submit(self._build_science_maps, self._generation)
+
+    def close(self):
+        self._generation += 1
+        self._builder.shutdown(wait=False)
+        self._calibration.close()
+
+    def _build_science_maps(self, generation: int):
+        # builder thread, the active maps stay with the processing thread
+        if generation != self._generation or self._source is None:
+            return
+        view, w, h = self._source
+        try:
+            if view is not None:
+                view = plan_sensor_geometry(self.settings, view.sensor_w, view.sensor_h, self.science_distortion)
+                h, w = view.frame_shape
+            plan = self._science_plan(view, w, h, selecting=False)
+            if plan is None or plan[0] == self.science_distortion._cache_key:
+                return
+            maps = self.science_distortion.load_or_build(plan)
+        except Exception:
+            # the processing thread builds them on demand instead
+            return
+        if generation == self._generation:
+            self._built.put((plan[0], maps))
+
+    def _adopt_built_maps(self):
+        built = self._built.take()
+        if built is not None:
+            self.science_distortion.adopt(*built)
+
+    def _crop_region(self, out_view, out_w: int, out_h: int, selecting: bool):
+        """Crop rect in the pixels of an out_w x out_h output described by out_view, None for no crop."""
+        if selecting:
+            return None
+        enabled, rect = get_crop_params(self.settings)
+        if not enabled or rect is None:
+            return None
+        if out_view is not None:
+            rect = out_view.rect_to_frame(rect)
+        return clamp_crop_rect(rect, out_w, out_h)
+
+    def _science_region(self, view, w: int, h: int, selecting: bool):
+        # remapped output covers the whole (binned) sensor, the maps produce just the crop of it
+        out_view = view.full() if view is not None else None
+        out_h, out_w = out_view.frame_shape if out_view is not None else (h, w)
+        return self._crop_region(out_view, out_w, out_h, selecting)
+
+    def _science_plan(self, view, w: int, h: int, selecting: bool):
+        region = self._science_region(view, w, h, selecting)
+        return self.science_distortion.plan_maps(w, h, self.settings, geometry=view, region=region)
+
+    def _ensure_science_maps(self, view, w: int, h: int, selecting: bool) -> bool:
+        self._source = (view, w, h)
+        region = self._science_region(view, w, h, selecting)
+        return self.science_distortion.ensure_maps(w, h, self.settings, geometry=view, region=region)
+
+    def prewarm(self, geometry: SensorGeometry):
+        """Loads or builds the science maps for frames of geometry before the first one arrives."""
+        self._adopt_built_maps()
+        h, w = geometry.frame_shape
+        self._ensure_science_maps(geometry, w, h, selecting=False)
+
+    def science(self, frame: Frame, selecting: bool = False, defer_calibration: bool = False) -> Frame:
+        """
+        Full resolution calibrated and corrected frame. The masters are applied
+        to the raw readout, so they never depend on the crop or distortion
+        settings, and defect pixels are replaced after them. The returned Frame
+        keeps frame.buffer only if its data is still a view of that buffer.
+
+        With defer_calibration, a frame that is only cropped comes back
+        uncalibrated with the cropped masters and defect index in
+        Frame.calibration, for a consumer that applies them once to its stack.
+        A remap interpolates between pixels, so remapped frames are always
+        calibrated and fixed here.
+        """
+        self._adopt_built_maps()
+        data = frame.data
+        view = frame.geometry
+        h, w = data.shape
+
+        dark = flat_inv = defects = pending = None
+        if self.masters is not None:
+            g = view or SensorGeometry(w, h, 0, 0, w, h, 1)
+            dark, flat_inv = self.masters.operands(g, frame.exposure_us, frame.gain)
+            defects = self.masters.defects(g, frame.exposure_us, frame.gain)
+
+        if self._ensure_science_maps(view, w, h, selecting):
+            if dark is not None or flat_inv is not None or defects is not None:
+                # the remap copies it straight away, so the kernel's buffer will do
+                data = self._calibration.apply(data, dark, flat_inv, reuse_output=True)
+                if defects is not None:
+                    defects.apply(data)
+            data = self.science_distortion.apply(data)
+        else:
+            # a crop is only slicing, so calibrate just what is left of the frame
+            rect = crop_rect_if_enabled(data.shape, self.settings, selecting=selecting, geometry=view)
+
+            def crop(img):
+                if img is None or rect is None:
+                    return img
+                x0, y0, x1, y1 = rect
+                return img[y0:y1, x0:x1]
+
+            data = crop(data)
+            if defects is not None:
+                defects = defects.crop(rect)
+            if dark is not None or flat_inv is not None or defects is not None:
+                if defer_calibration:
+                    pending = (crop(dark), crop(flat_inv), defects)
+                else:
+                    data = self._calibration.apply(data, crop(dark), crop(flat_inv))
+                    if defects is not None:
+                        defects.apply(data)
+
+        buffer = frame.buffer if np.may_share_memory(data, frame.data) else None
+        return dataclasses.replace(frame, data=data, buffer=buffer, raw=False, calibration=pending)
+
+    def _preview_region(self, g: SensorGeometry, selecting: bool):
+        """Area the preview shows, in binned full-sensor pixels."""
+        b = g.bin
+        full = g.full()
+        model_h, model_w = full.frame_shape
+
+        region = self._crop_region(full, model_w, model_h, selecting)
+        if region is not None:
+            return region
+
+        if self.preview_distortion._get_params_from_settings(self.settings)[0]:
+            # the remap fills the whole sensor
+            return 0, 0, model_w, model_h
+        return g.x // b, g.y // b, (g.x + g.w) // b, (g.y + g.h) // b
+
+    def preview(self, frame: Frame, target_w: int, target_h: int, selecting: bool = False):
+        """
+        Returns (img16, view): a display sized corrected frame, and the geometry
+        that maps its pixels back to sensor pixels.
+        """
+        self._adopt_built_maps()
+        data = frame.data
+        h, w = data.shape
+        g = frame.geometry or SensorGeometry(w, h, 0, 0, w, h, 1)
+        self._source = (frame.geometry, w, h)
+
+        region = self._preview_region(g, selecting)
+        x0, y0, x1, y1 = region
+        # never below the display size, Qt only scales the rest down a little
+        step = max(1, min((x1 - x0) // max(1, target_w), (y1 - y0) // max(1, target_h)))
+        if self._adjusting:
+            # cheap enough to rebuild for every slider position, Qt scales it up
+            step *= self.COARSE_STEP
+
+        out_w, out_h = self.preview_distortion.ensure_region_maps(g, region, step, self.settings)
+        img = self.preview_distortion.apply(data)
+
+        # decimation is just more binning as far as coordinates go
+        b = g.bin
+        view = SensorGeometry(g.sensor_w, g.sensor_h, x0 * b, y0 * b, out_w * step * b, out_h * step * b, b * step)
+        return img, view
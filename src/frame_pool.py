@@ -0,0 +1,85 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class FramePool:
+    """
+    Fixed set of preallocated, C-contiguous frame buffers with reference counts.
+
+    Each buffer is a numpy view over a bytearray so zwoasi can fill it in place
+    (capture_video_frame / get_video_data only accept a bytearray as buffer_).
+    acquire() hands a buffer out with one reference, consumers that keep it
+    longer call retain(), and every holder calls release() when done. When the
+    pool runs dry a one-off buffer is allocated instead and counted as a miss,
+    so a slow consumer degrades into allocations rather than stalling capture.
+    """
+
+    def __init__(self, shape: tuple[int, int], dtype=np.uint16, size: int = 4):
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.dtype = np.dtype(dtype)
+        self.size = max(1, int(size))
+
+        self._lock = threading.Lock()
+        self._backing = {}   # id(array) -> bytearray
+        self._refs = {}      # id(array) -> refcount, pooled buffers only
+        self._free = deque()
+        self._misses = 0
+
+        for _ in range(self.size):
+            arr, raw = self._new_buffer()
+            self._backing[id(arr)] = raw
+            self._refs[id(arr)] = 0
+            self._free.append(arr)
+
+    def _new_buffer(self):
+        raw = bytearray(self.shape[0] * self.shape[1] * self.dtype.itemsize)
+        arr = np.frombuffer(raw, dtype=self.dtype).reshape(self.shape)
+        return arr, raw
+
+    def acquire(self) -> np.ndarray:
+        with self._lock:
+            if self._free:
+                arr = self._free.popleft()
+                self._refs[id(arr)] = 1
+                return arr
+
+            self._misses += 1
+            arr, raw = self._new_buffer()
+            self._backing[id(arr)] = raw
+            return arr
+
+    def backing(self, arr: np.ndarray) -> bytearray:
+        return self._backing[id(arr)]
+
+    def owns(self, arr) -> bool:
+        return id(arr) in self._refs
+
+    def retain(self, arr: np.ndarray) -> None:
+        with self._lock:
+            key = id(arr)
+            if key in self._refs:
+                self._refs[key] += 1
+
+    def release(self, arr: np.ndarray) -> None:
+        with self._lock:
+            key = id(arr)
+            if key not in self._refs:
+                # one-off buffer from a miss, just forget it
+                self._backing.pop(key, None)
+                return
+
+            if self._refs[key] <= 0:
+                return
+            self._refs[key] -= 1
+            if self._refs[key] == 0:
+                self._free.append(arr)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "in_use": self.size - len(self._free),
+                "misses": self._misses,
+            }
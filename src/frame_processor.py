@@ -0,0 +1,210 @@
+import dataclasses
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from PyQt5 import QtCore
+
+from frame_mailbox import FrameMailbox
+from frame_pipeline import FramePipeline
+from frame_ring import FrameRing
+from geometry import plan_sensor_geometry
+from image_display import gray16_to_display_qimage
+
+
+class FrameProcessor(QtCore.QObject):
+    """
+    Processing stage between a CaptureWorker and the UI, run on its own thread.
+
+    Feeds the science stream into the frame ring and turns preview frames into
+    display-sized, ready-to-paint QImages, so the GUI thread does no per-pixel
+    work. previewing, selecting, preview_size and calibration (a
+    ChessboardCollector offered every frame) are set from the GUI thread.
+    While a master capture collects, the ring gets raw whole-sensor frames.
+
+    Frames come in through submit() on the capture thread. While a science
+    consumer is collecting, every frame is queued, as many as the consumers
+    still need (FrameRing.frames_needed); frames past that are no use to them.
+    Otherwise only the newest frame waits in a mailbox, so a slow processor or
+    GUI drops preview frames instead of falling behind. Finished previews go through a second mailbox;
+    preview_ready only says one is waiting in preview_box.
+    """
+    preview_ready = QtCore.pyqtSignal()
+    error = QtCore.pyqtSignal(str)
+    _wake = QtCore.pyqtSignal()
+
+    def __init__(self, settings, worker, frame_ring: FrameRing, pipeline: FramePipeline):
+        super().__init__()
+        self.settings = settings
+        self.worker = worker
+        self.frame_ring = frame_ring
+        self.pipeline = pipeline
+
+        self.previewing = False
+        self.selecting = False  # crop selection in progress, shows the full frame
+        self.calibration = None
+        self.preview_size = (640, 480)
+        self._last_preview_t = 0.0
+        self._geometry_key = None
+
+        self._lock = threading.Lock()
+        self._science = deque()
+        self._wake_pending = False
+        self._inbox = FrameMailbox(discard_fn=lambda f: self.worker.release_frame(f.data))
+        # (QImage, frame w, frame h, SensorGeometry) for the GUI thread
+        self.preview_box = FrameMailbox()
+
+        self._wake.connect(self._drain)
+
+    def submit(self, captured):
+        """Called on the capture thread for every frame, never blocks on processing."""
+        queued = False
+        if self.frame_ring.wanted():
+            # a pool miss allocates, queued frames are never dropped
+            with self._lock:
+                if len(self._science) < self.frame_ring.frames_needed():
+                    self._science.append(captured)
+                    queued = True
+        if not queued:
+            self._inbox.put(captured)
+
+        with self._lock:
+            if self._wake_pending:
+                return
+            self._wake_pending = True
+        self._wake.emit()
+
+    def dropped_preview_frames(self) -> int:
+        return self._inbox.dropped + self.preview_box.dropped
+
+    def clear(self):
+        """Returns the buffers of frames that were never processed, after the thread stopped."""
+        with self._lock:
+            pending = list(self._science)
+            self._science.clear()
+        for f in pending:
+            self.worker.release_frame(f.data)
+        self._inbox.clear()
+        self.preview_box.clear()
+
+    @QtCore.pyqtSlot()
+    def _drain(self):
+        with self._lock:
+            self._wake_pending = False
+            science = list(self._science)
+            self._science.clear()
+
+        for captured in science:
+            if self.frame_ring.wanted():
+                self.process(captured, science=True)
+            else:
+                # the consumer is gone, the backlog is only good for a preview
+                self._inbox.put(captured)
+
+        captured = self._inbox.take()
+        if captured is not None:
+            self.process(captured, science=False)
+
+    def _full_frame(self) -> bool:
+        # crop selection, chessboard calibration and master captures need the whole sensor
+        return self.selecting or self.calibration is not None or self.frame_ring.wants_raw()
+
+    def _sync_sensor_geometry(self, geometry):
+        """Asks the worker for a new readout window when crop, distortion or camera settings change."""
+        full_frame = self._full_frame()
+        key = (
+            geometry.sensor_w,
+            geometry.sensor_h,
+            full_frame,
+            repr(self.settings.data.get("camera", {})),
+            repr(self.settings.data.get("crop", {})),
+            repr(self.settings.data.get("distortion_manual", {})),
+            repr(self.settings.data.get("distortion_calibration", {})),
+        )
+        if key == self._geometry_key:
+            return
+        self._geometry_key = key
+
+        want = plan_sensor_geometry(
+            self.settings, geometry.sensor_w, geometry.sensor_h, self.pipeline.science_distortion,
+            selecting=full_frame,
+        )
+        if want != geometry:
+            self.worker.set_geometry(want)
+
+    @QtCore.pyqtSlot(object)
+    def prewarm(self, geometry):
+        """Gets the science maps for the readout window the settings ask for ready early."""
+        if geometry is None:
+            return
+        try:
+            want = plan_sensor_geometry(
+                self.settings, geometry.sensor_w, geometry.sensor_h, self.pipeline.science_distortion
+            )
+            self.pipeline.prewarm(want)
+        except Exception:
+            pass
+
+    def _preview_due(self, now: float) -> bool:
+        if not self.previewing:
+            return False
+        max_fps = float(self.settings.data.get("preview", {}).get("max_fps", 15))
+        if max_fps > 0 and now - self._last_preview_t < 1.0 / max_fps:
+            return False
+        self._last_preview_t = now
+        return True
+
+    def process(self, captured, science: bool):
+        raw = captured.data
+        try:
+            frame = raw if isinstance(raw, np.ndarray) else np.array(raw)
+
+            if frame.dtype != np.uint16:
+                frame = frame.astype(np.uint16, copy=False)
+
+            if frame.ndim == 3:
+                frame = frame[:, :, 0]
+
+            captured = dataclasses.replace(captured, data=frame)
+            if captured.geometry is not None:
+                self._sync_sensor_geometry(captured.geometry)
+
+            calibration = self.calibration
+            if calibration is not None:
+                calibration.offer(frame, captured.geometry)
+
+            # Full resolution processing only for frames queued while someone collects
+            if science:
+                if self.frame_ring.wants_raw():
+                    # master captures take the readout as it is
+                    buffer = captured.buffer if np.may_share_memory(frame, raw) else None
+                    out = dataclasses.replace(captured, buffer=buffer)
+                else:
+                    out = self.pipeline.science(
+                        captured, selecting=self.selecting, defer_calibration=self.frame_ring.defers_calibration()
+                    )
+                if out.buffer is not None:
+                    # Without distortion the science frame is still a view of the pooled
+                    # raw buffer, the ring then keeps that buffer until it evicts the frame
+                    out = dataclasses.replace(out, buffer=raw)
+                    self.worker.retain_frame(raw)
+                # the preview below still reads raw, our reference goes in finally
+                self.frame_ring.push(out)
+            else:
+                self.frame_ring.skip(captured.seq)
+
+            if not self._preview_due(time.monotonic()):
+                return
+
+            target_w, target_h = self.preview_size
+            img16, view = self.pipeline.preview(captured, target_w, target_h, selecting=self._full_frame())
+            image = gray16_to_display_qimage(img16, target_w, target_h)
+            if self.preview_box.put((image, img16.shape[1], img16.shape[0], view)):
+                self.preview_ready.emit()
+
+        except Exception as e:
+            self.error.emit(f"Display failed:\n{e}")
+        finally:
+            if raw is not None:
+                self.worker.release_frame(raw)
@@ -0,0 +1,182 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+import numpy as np
+
+from frames import Frame
+
+
+# frames kept for consumers that fall a little behind
+RING_CAPACITY = 4
+
+class FrameRing:
+    """
+    Thread-safe ring of the last `capacity` processed frames.
+
+    Producers push frames in sequence order, consumers block on a condition
+    variable until frames newer than a given sequence number arrive, so nothing
+    is missed or delivered twice. Frames whose data still lives in a pooled
+    camera buffer keep that buffer checked out while they are in the ring, and
+    frames handed to a consumer are retained for it until release() or detach().
+
+    Producing a full resolution frame is expensive, so consumers register with
+    add_consumer() while they collect. With nobody registered the producer
+    should skip() frames instead of processing and pushing them, and the ring
+    holds no frames, so their buffers go back to the pool when the last
+    consumer leaves. Consumers that
+    register with raw=True (master captures) get unprocessed frames, and while
+    any of them is collecting every consumer does. Consumers that register with
+    deferred=True stack before calibrating; while all processed-frame consumers
+    do, the producer may leave the dark and flat to them (Frame.calibration).
+    Consumers say how many frames they need and report each one they keep
+    with consumed(), so the producer never queues more than frames_needed().
+    """
+
+    def __init__(
+        self,
+        capacity: int = RING_CAPACITY,
+        retain_fn: Optional[Callable[[np.ndarray], None]] = None,
+        release_fn: Optional[Callable[[np.ndarray], None]] = None,
+    ):
+        self.capacity = max(1, int(capacity))
+        self._retain = retain_fn
+        self._release = release_fn
+
+        self._frames = deque()
+        self._cond = threading.Condition()
+        self._latest_seq = 0
+        self._consumers = 0
+        self._raw_consumers = 0
+        self._deferred_consumers = 0
+        self._needed = 0
+
+    def push(self, frame: Frame) -> None:
+        """Takes over the caller's reference on frame.buffer."""
+        evicted = None
+        with self._cond:
+            self._latest_seq = frame.seq
+            if not self._consumers:
+                # the consumer left while the frame was being produced
+                evicted = frame
+            else:
+                self._frames.append(frame)
+                if len(self._frames) > self.capacity:
+                    evicted = self._frames.popleft()
+                self._cond.notify_all()
+
+        if evicted is not None:
+            self._release_buffer(evicted)
+
+    def skip(self, seq: int) -> None:
+        """Records that frame seq was produced but not pushed."""
+        with self._cond:
+            self._latest_seq = max(self._latest_seq, seq)
+
+    def add_consumer(self, raw: bool = False, deferred: bool = False, need: int = 0) -> None:
+        with self._cond:
+            self._consumers += 1
+            self._needed += max(0, int(need))
+            if raw:
+                self._raw_consumers += 1
+            elif deferred:
+                self._deferred_consumers += 1
+
+    def remove_consumer(self, raw: bool = False, deferred: bool = False, need: int = 0) -> None:
+        """need is what the consumer still needed of what it registered with."""
+        frames = []
+        with self._cond:
+            self._consumers = max(0, self._consumers - 1)
+            self._needed = max(0, self._needed - max(0, int(need)))
+            if raw:
+                self._raw_consumers = max(0, self._raw_consumers - 1)
+            elif deferred:
+                self._deferred_consumers = max(0, self._deferred_consumers - 1)
+            if not self._consumers:
+                frames = list(self._frames)
+                self._frames.clear()
+        self.release(frames)
+
+    def consumed(self, n: int = 1) -> None:
+        """A consumer kept n more of the frames it registered for."""
+        with self._cond:
+            self._needed = max(0, self._needed - int(n))
+
+    def frames_needed(self) -> int:
+        """Frames the consumers still need between them."""
+        with self._cond:
+            return self._needed if self._consumers else 0
+
+    def wanted(self) -> bool:
+        with self._cond:
+            return self._consumers > 0
+
+    def wants_raw(self) -> bool:
+        with self._cond:
+            return self._raw_consumers > 0
+
+    def defers_calibration(self) -> bool:
+        with self._cond:
+            return 0 < self._deferred_consumers == self._consumers - self._raw_consumers
+
+    def latest_seq(self) -> int:
+        with self._cond:
+            return self._latest_seq
+
+    def latest(self) -> Optional[Frame]:
+        """Newest frame without retaining it, only safe for metadata and shape."""
+        with self._cond:
+            return self._frames[-1] if self._frames else None
+
+    def wait_for_frames(self, after_seq: int, n: int = 1, timeout_s: Optional[float] = None) -> list[Frame]:
+        """
+        Blocks until n frames newer than after_seq are buffered, or until the
+        timeout expires, and returns the ones available (oldest first, at most n).
+        Frames that were already evicted are skipped. Returned frames are
+        retained for the caller.
+        """
+        n = max(1, int(n))
+        deadline = None if timeout_s is None else time.monotonic() + timeout_s
+
+        with self._cond:
+            while True:
+                newer = [f for f in self._frames if f.seq > after_seq]
+                if len(newer) >= n:
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            out = newer[:n]
+            for f in out:
+                if f.buffer is not None and self._retain is not None:
+                    self._retain(f.buffer)
+            return out
+
+    def release(self, frames: list[Frame]) -> None:
+        for f in frames:
+            self._release_buffer(f)
+
+    def detach(self, frame: Frame) -> np.ndarray:
+        """
+        Returns data the caller can keep after the ring moves on. Frames that
+        already own their memory are returned as-is, pooled ones are copied and
+        their buffer is handed back.
+        """
+        if frame.buffer is None:
+            return frame.data
+        data = frame.data.copy()
+        self._release_buffer(frame)
+        return data
+
+    def clear(self) -> None:
+        with self._cond:
+            frames = list(self._frames)
+            self._frames.clear()
+        self.release(frames)
+
+    def _release_buffer(self, frame: Frame) -> None:
+        if frame.buffer is not None and self._release is not None:
+            self._release(frame.buffer)
@@ -0,0 +1,38 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from geometry import SensorGeometry
+
+
+@dataclass
+class Frame:
+    """
+    One camera frame plus the acquisition state it was exposed under.
+    Timestamps come from time.monotonic().
+
+    epoch counts exposure/gain change requests, a frame carries the epoch that
+    was in effect for its whole exposure. exposure_start is the earliest time
+    the exposure can have started, so a frame with exposure_start >= t is known
+    to be exposed entirely after t.
+
+    geometry is the sensor window and binning the frame was read out with.
+    raw is False once data was calibrated, distortion corrected and cropped.
+    calibration is the (dark, flat_inv, defects) still to be applied to such
+    a frame when that was left for after stacking, None otherwise.
+
+    buffer is the pooled camera buffer that data lives in (data may be a view of
+    it), or None once data owns its memory.
+    """
+    data: np.ndarray
+    seq: int
+    timestamp: float
+    exposure_us: int
+    gain: int
+    epoch: int = 0
+    exposure_start: float = 0.0
+    geometry: Optional[SensorGeometry] = None
+    buffer: Optional[np.ndarray] = None
+    raw: bool = True
+    calibration: Optional[tuple] = None
@@ -0,0 +1,134 @@
+from dataclasses import dataclass, replace
+
+import numpy as np
+
+from crop import get_crop_params
+
+
+# ZWO SDK constraints on the binned ROI: width multiple of 8, height multiple of 2
+ROI_W_ALIGN = 8
+ROI_H_ALIGN = 2
+
+SUPPORTED_BINS = (1, 2, 4)
+
+
+@dataclass(frozen=True)
+class SensorGeometry:
+    """
+    Readout window of a frame. x, y, w, h are in unbinned full-sensor pixels,
+    the frame itself is (h // bin, w // bin) pixels.
+    """
+    sensor_w: int
+    sensor_h: int
+    x: int
+    y: int
+    w: int
+    h: int
+    bin: int = 1
+
+    @property
+    def frame_shape(self) -> tuple[int, int]:
+        return (self.h // self.bin, self.w // self.bin)
+
+    @property
+    def is_full(self) -> bool:
+        """Whole sensor as far as the camera can read it out at this binning (see full_geometry)."""
+        return self == full_geometry(self.sensor_w, self.sensor_h, self.bin)
+
+    def full(self) -> "SensorGeometry":
+        """Same binning, whole sensor. Describes a frame remapped to sensor coordinates."""
+        return replace(self, x=0, y=0, w=self.sensor_w, h=self.sensor_h)
+
+    def rect_to_frame(self, rect):
+        """Maps an unbinned full-sensor rect (x0, y0, x1, y1) into frame pixels."""
+        x0, y0, x1, y1 = rect
+        b = self.bin
+        return ((x0 - self.x) // b, (y0 - self.y) // b, (x1 - self.x) // b, (y1 - self.y) // b)
+
+    def point_to_sensor(self, x: int, y: int) -> tuple[int, int]:
+        return (self.x + x * self.bin, self.y + y * self.bin)
+
+
+def _align_down(v: int, a: int) -> int:
+    return (v // a) * a
+
+
+def full_geometry(sensor_w: int, sensor_h: int, bin: int = 1) -> SensorGeometry:
+    b = int(bin)
+    w = _align_down(sensor_w // b, ROI_W_ALIGN) * b
+    h = _align_down(sensor_h // b, ROI_H_ALIGN) * b
+    return SensorGeometry(sensor_w, sensor_h, 0, 0, w, h, b)
+
+
+def roi_geometry(x0: int, y0: int, x1: int, y1: int, sensor_w: int, sensor_h: int, bin: int = 1) -> SensorGeometry:
+    """Smallest camera-legal window covering [x0, x1) x [y0, y1)."""
+    b = int(bin)
+    full = full_geometry(sensor_w, sensor_h, b)
+
+    x0 = max(0, _align_down(int(x0), b))
+    y0 = max(0, _align_down(int(y0), b))
+    w = -(-(min(int(x1), full.w) - x0) // (ROI_W_ALIGN * b)) * ROI_W_ALIGN * b
+    h = -(-(min(int(y1), full.h) - y0) // (ROI_H_ALIGN * b)) * ROI_H_ALIGN * b
+    w = max(ROI_W_ALIGN * b, min(full.w, w))
+    h = max(ROI_H_ALIGN * b, min(full.h, h))
+
+    # growing to the alignment may run past the sensor edge, slide back instead
+    x0 = min(x0, full.w - w)
+    y0 = min(y0, full.h - h)
+    return SensorGeometry(sensor_w, sensor_h, x0, y0, w, h, b)
+
+
+def plan_sensor_geometry(settings, sensor_w: int, sensor_h: int, distortion, selecting: bool = False) -> SensorGeometry:
+    """
+    Readout window for the current settings. With camera.hw_roi enabled only the
+    part of the sensor feeding the crop rect (through the distortion remap) is
+    read out, padded by camera.roi_pad pixels. camera.bin selects 1x1, 2x2 or 4x4.
+    """
+    cam = settings.data.get("camera", {})
+    b = int(cam.get("bin", 1))
+    if b not in SUPPORTED_BINS:
+        b = 1
+
+    full = full_geometry(sensor_w, sensor_h, b)
+    if selecting or not bool(cam.get("hw_roi", False)):
+        return full
+
+    enabled, rect = get_crop_params(settings)
+    if not enabled or rect is None:
+        return full
+
+    x0, y0, x1, y1 = distortion.source_footprint(rect, sensor_w, sensor_h, settings)
+    pad = max(0, int(cam.get("roi_pad", 16)))
+    return roi_geometry(x0 - pad, y0 - pad, x1 + pad, y1 + pad, sensor_w, sensor_h, b)
+
+
+def bin_image(img: np.ndarray, b: int) -> np.ndarray:
+    """Mean of b x b blocks as float32, trailing rows/columns that don't fill a block are dropped."""
+    if b <= 1:
+        return img
+    h = (img.shape[0] // b) * b
+    w = (img.shape[1] // b) * b
+    blocks = img[:h, :w].reshape(h // b, b, w // b, b)
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+
+def master_for_geometry(master: np.ndarray, master_bin: int, g: SensorGeometry):
+    """
+    Cuts a calibration master that covers the whole sensor at master_bin (a
+    full_geometry frame) down to the readout window of g, block averaging if g
+    is binned more coarsely. Returns None if the master is not from this sensor
+    or can't be binned to g.
+    """
+    mb = max(1, int(master_bin))
+    if master.shape != full_geometry(g.sensor_w, g.sensor_h, mb).frame_shape or g.bin % mb:
+        return None
+
+    f = g.bin // mb
+    fh, fw = g.frame_shape
+    x0, y0 = g.x // mb, g.y // mb
+    sub = master[y0:y0 + fh * f, x0:x0 + fw * f]
+    if sub.shape != (fh * f, fw * f):
+        return None
+    if f > 1:
+        sub = bin_image(sub, f).astype(master.dtype, copy=False)
+    return np.ascontiguousarray(sub)
@@ -1,5 +1,5 @@
 import numpy as np
-from PyQt5 import QtGui
+from PyQt5 import QtCore, QtGui
 
 
 def gray16_to_qimage_bytes(img16: np.ndarray):
@@ -36,3 +36,17 @@ def gray16_to_qimage_8bit_preview(img16: np.ndarray):
 
     qimg = QtGui.QImage(buf, w, h, w, QtGui.QImage.Format_Grayscale8)
     return qimg, buf
+
+
+def gray16_to_display_qimage(img16: np.ndarray, max_w: int, max_h: int) -> QtGui.QImage:
+    """
+    Scales a uint16 frame to fit max_w x max_h (keeping the aspect ratio) and converts
+    it to the screen format, so painting it is a plain blit. Safe off the GUI thread.
+    """
+    qimg, buf = gray16_to_qimage_bytes(img16)
+    if qimg is None:
+        qimg, buf = gray16_to_qimage_8bit_preview(img16)
+
+    # scaled() and convertToFormat() return images that own their pixels, buf may go
+    scaled = qimg.scaled(max(1, max_w), max(1, max_h), QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+    return scaled.convertToFormat(QtGui.QImage.Format_RGB32)
@@ -1,20 +1,26 @@
 import os
 import sys
-import numpy as np
-from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5 import QtCore, QtWidgets
 from server import ZmqServer
 from server_bridge import ServerBridge
 
-from settings_manager import SettingsManager
-from capture_worker import CaptureWorker
+from settings_manager import SettingsManager, CameraSettings
+from calibration_masters import library_entries
+from camera_channel import CameraChannel
+from map_cache import MapCache
 from video_label import VideoLabel
 from ui_distortion_crop_dialog import DistortionWindow
-from image_display import gray16_to_qimage_bytes, gray16_to_qimage_8bit_preview
 
-from distortion import DistortionCorrector
-from crop import apply_crop_if_enabled
+from snapshot import take_snapshots
+from stacking import STACKERS
 
-from snapshot import SnapshotManager
+STACK_METHOD_LABELS = {
+    "median": "Median",
+    "mean": "Mean",
+    "sigma_clip": "Sigma-clipped mean",
+    "winsorized": "Winsorized sigma clipping",
+    "minmax": "Min/max rejection mean",
+}
 
 
 class MainWindow(QtWidgets.QMainWindow):
@@ -25,12 +31,6 @@ class MainWindow(QtWidgets.QMainWindow):
         super().__init__()
         self.setWindowTitle("ASI Live View")
 
-        self._last_frame16 = None
-        self._qimg_buf = None
-
-        self.distortion = DistortionCorrector()
-
-        self._crop_selecting = False
         self._crop_points = []
 
         self._display = {
@@ -40,75 +40,166 @@ class MainWindow(QtWidgets.QMainWindow):
             "scaled_h": None,
             "offset_x": 0,
             "offset_y": 0,
+            "geometry": None,  # sensor window the displayed pixels map to
         }
 
-        self._frame_counter = 0
-
         self.settings_path = os.path.join(os.getcwd(), "settings.json")
         self.settings = SettingsManager(self.settings_path)
         self.settings.load()
 
-        if "crop" not in self.settings.data:
-            self.settings.set("crop", {"enabled": False, "rect": None})
-
-        if "dark" not in self.settings.data:
-            self.settings.set("dark", {"enabled": False, "path": None, "exposure_us": None, "gain": None})
-
-        if "flat" not in self.settings.data:
-            self.settings.set("flat", {"enabled": False, "path": None, "exposure_us": None, "gain": None})
+        self._ensure_camera_defaults(self.settings)
 
         if "snapshot" not in self.settings.data:
             self.settings.set("snapshot", {"stack_n": 1})
 
+        if "preview" not in self.settings.data:
+            self.settings.set("preview", {"max_fps": 15})
+
+        self.channels = self._create_channels()
+        self.channel = self.channels[0]
+
         self._build_ui()
 
         self._save_timer = QtCore.QTimer(self)
         self._save_timer.setSingleShot(True)
         self._save_timer.timeout.connect(self.settings.save)
 
-        self.thread = QtCore.QThread(self)
-        self.worker = CaptureWorker(self.settings)
-        self.worker.moveToThread(self.thread)
-
-        self.thread.started.connect(self.worker.start)
-        self.exposure_changed.connect(self.worker.set_exposure_us, QtCore.Qt.QueuedConnection)
-        self.gain_changed.connect(self.worker.set_gain, QtCore.Qt.QueuedConnection)
+        # The worker threads sit in their acquisition loops, so these run on the
+        # GUI thread and only enqueue a control command
+        self.exposure_changed.connect(lambda us: self.channel.worker.set_exposure_us(us))
+        self.gain_changed.connect(lambda gain: self.channel.worker.set_gain(gain))
 
-        self.worker.frame_ready.connect(self.on_frame_ready)
-        self.worker.error.connect(self.on_worker_error)
-        self.worker.status.connect(self.image_label.setText)
+        for ch in self.channels:
+            ch.preview_ready.connect(lambda ch=ch: self.on_preview_ready(ch))
+            ch.error.connect(lambda msg, ch=ch: self.on_channel_message(ch, msg))
+            ch.status.connect(lambda msg, ch=ch: self.on_channel_message(ch, msg))
+            ch.snapshot_manager.status.connect(self._set_status)
+            ch.start()
 
-        self.thread.start()
+            exposure_us = int(ch.settings.data.get("exposure_us", 5000))
+            exposure_ms = max(50, min(5000, exposure_us // 1000))
 
-        exposure_us = int(self.settings.data.get("exposure_us", 5000))
-        exposure_ms = max(50, min(5000, exposure_us // 1000))
-
-        gain = int(self.settings.data.get("gain", 50))
-        gain = max(0, min(600, gain))
+            gain = int(ch.settings.data.get("gain", 50))
+            gain = max(0, min(600, gain))
 
-        self.exposure_changed.emit(exposure_ms * 1000)
-        self.gain_changed.emit(gain)
+            ch.worker.set_exposure_us(exposure_ms * 1000)
+            ch.worker.set_gain(gain)
 
         self.distortion_window = None
+        self._chessboard = None  # collector busy calibrating
 
-        self.snapshot_manager = SnapshotManager(
-            settings=self.settings,
-            parent_widget=self,
-            get_last_frame_fn=lambda: self._last_frame16,
-            get_frame_counter_fn=lambda: self._frame_counter,
-        )
-        self.snapshot_manager.status.connect(self._set_status)
+        self.set_active_camera(0)
 
         self.server_bridge = ServerBridge(self)
         self.server = ZmqServer(self.server_bridge, bind_addr="tcp://127.0.0.1:5555")
         self.server.start()
 
+    def _ensure_camera_defaults(self, settings):
+        if "crop" not in settings.data or not settings.data["crop"]:
+            settings.set("crop", {"enabled": False, "rect": None})
+
+        if "dark" not in settings.data or not settings.data["dark"]:
+            settings.set("dark", {"enabled": False, "path": None, "exposure_us": None, "gain": None})
+
+        if "flat" not in settings.data or not settings.data["flat"]:
+            settings.set("flat", {"enabled": False, "path": None, "exposure_us": None, "gain": None})
+
+        if "defects" not in settings.data or not settings.data["defects"]:
+            settings.set("defects", {"enabled": True, "use_flat": True})
+
+        if "camera" not in settings.data:
+            settings.set("camera", {"backend": "asi"})
+
+    def _create_channels(self) -> list:
+        """
+        The primary camera uses the top-level settings. Each entry of the optional
+        "cameras" list adds one more camera with its own exposure, gain, crop,
+        distortion and masters. camera.index picks the device, by default the
+        position in that order.
+        """
+        specs = [(str(self.settings.data["camera"].get("id", "0")), self.settings)]
+        for i, scope in enumerate(self.settings.data.get("cameras", []) or []):
+            cam_settings = CameraSettings(self.settings, scope)
+            self._ensure_camera_defaults(cam_settings)
+            specs.append((str(scope.get("id", i + 1)), cam_settings))
+
+        map_cache = None
+        cache_cfg = self.settings.data.get("map_cache", {})
+        if bool(cache_cfg.get("enabled", True)):
+            map_cache = MapCache(
+                os.path.join(os.getcwd(), "calibration", "map_cache"),
+                max_entries=int(cache_cfg.get("max_entries", 16)),
+            )
+
+        channels = []
+        for position, (camera_id, settings) in enumerate(specs):
+            if any(ch.camera_id == camera_id for ch in channels):
+                raise RuntimeError(f"Duplicate camera id '{camera_id}' in settings")
+            index = int(settings.data.get("camera", {}).get("index", position))
+            channels.append(CameraChannel(
+                camera_id, settings, index, parent_widget=self, own_folders=position > 0, map_cache=map_cache
+            ))
+        return channels
+
+    def channel_by_id(self, camera_id=None):
+        """None means the primary camera. Returns None for unknown ids."""
+        if camera_id is None:
+            return self.channels[0]
+        for ch in self.channels:
+            if ch.camera_id == str(camera_id):
+                return ch
+        return None
+
+    def set_active_camera(self, i: int):
+        """Points the preview and all camera controls at self.channels[i]."""
+        self.channel.processor.previewing = False
+        self.channel.processor.selecting = False
+        collector = self.channel.stop_chessboard()
+        if collector is not None:
+            collector.cancel()
+        self._crop_points = []
+
+        self.channel = self.channels[i]
+        self.channel.processor.previewing = True
+        self.channel.processor.preview_size = (max(1, self.image_label.width()), max(1, self.image_label.height()))
+
+        if self.distortion_window is not None:
+            self.distortion_window.close()
+            self.distortion_window = None
+
+        self._load_camera_controls()
         self._refresh_calibration_ui_state()
 
-    def take_snapshot_and_return_path(self) -> str:
+        if self.camera_combo.currentIndex() != i:
+            self.camera_combo.blockSignals(True)
+            self.camera_combo.setCurrentIndex(i)
+            self.camera_combo.blockSignals(False)
+
+    def _stack_method(self, method=None) -> str:
+        method = method or self.settings.data.get("snapshot", {}).get("stack_method", "median")
+        return method if method in STACKERS else "median"
+
+    def take_snapshot_and_return_path(self, requested_at=None, channel=None, method=None) -> str:
+        channel = channel or self.channel
         snap = self.settings.data.get("snapshot", {})
         n = int(snap.get("stack_n", 1))
-        return self.snapshot_manager.take_snapshot(n)        
+        return channel.snapshot_manager.take_snapshot(n, requested_at=requested_at, method=self._stack_method(method))
+
+    def take_snapshot_all_and_return_paths(self, requested_at=None, method=None) -> dict:
+        """Snapshot on every camera at once, returns {camera_id: path or None}."""
+        snap = self.settings.data.get("snapshot", {})
+        n = int(snap.get("stack_n", 1))
+        results = take_snapshots(
+            [ch.snapshot_manager for ch in self.channels], n, parent_widget=self, requested_at=requested_at,
+            method=self._stack_method(method),
+        )
+
+        out = {}
+        for ch, r in zip(self.channels, results):
+            out[ch.camera_id] = r[0] if r is not None else None
+            if r is not None and ch is self.channel:
+                ch.snapshot_manager._show_preview(r[1])
+        return out
 
     def _set_status(self, txt: str):
         self.status_hint.setText(txt)
@@ -139,6 +230,12 @@ class MainWindow(QtWidgets.QMainWindow):
         title.setFont(font)
         right_layout.addWidget(title)
 
+        self.camera_combo = QtWidgets.QComboBox()
+        for ch in self.channels:
+            self.camera_combo.addItem(f"Camera {ch.camera_id}")
+        self.camera_combo.setVisible(len(self.channels) > 1)
+        right_layout.addWidget(self.camera_combo)
+
         self.exposure_label = QtWidgets.QLabel()
         right_layout.addWidget(self.exposure_label)
 
@@ -173,18 +270,29 @@ class MainWindow(QtWidgets.QMainWindow):
         calib_title.setFont(f2)
         right_layout.addWidget(calib_title)
 
-        self.dark_btn = QtWidgets.QPushButton("Capture Dark (10 frames)")
+        self.master_method_combo = self._stack_method_combo()
+        right_layout.addWidget(self.master_method_combo)
+
+        self.master_frames_spin = QtWidgets.QSpinBox()
+        self.master_frames_spin.setRange(1, 500)
+        self.master_frames_spin.setPrefix("Master frames: ")
+        right_layout.addWidget(self.master_frames_spin)
+
+        self.dark_btn = QtWidgets.QPushButton("Capture Dark")
         right_layout.addWidget(self.dark_btn)
 
         self.use_dark_cb = QtWidgets.QCheckBox("Use Dark")
         right_layout.addWidget(self.use_dark_cb)
 
-        self.flat_btn = QtWidgets.QPushButton("Capture Flat (10 frames)")
+        self.flat_btn = QtWidgets.QPushButton("Capture Flat")
         right_layout.addWidget(self.flat_btn)
 
         self.use_flat_cb = QtWidgets.QCheckBox("Use Flat")
         right_layout.addWidget(self.use_flat_cb)
 
+        self.fix_defects_cb = QtWidgets.QCheckBox("Fix Defect Pixels")
+        right_layout.addWidget(self.fix_defects_cb)
+
         line2 = QtWidgets.QFrame()
         line2.setFrameShape(QtWidgets.QFrame.HLine)
         line2.setFrameShadow(QtWidgets.QFrame.Sunken)
@@ -206,30 +314,23 @@ class MainWindow(QtWidgets.QMainWindow):
         self.stack_slider.setPageStep(5)
         right_layout.addWidget(self.stack_slider)
 
+        self.stack_method_combo = self._stack_method_combo()
+        right_layout.addWidget(self.stack_method_combo)
+
         self.snapshot_btn = QtWidgets.QPushButton("Take Snapshot")
         right_layout.addWidget(self.snapshot_btn)
 
+        self.snapshot_all_btn = QtWidgets.QPushButton("Take Snapshot (all cameras)")
+        self.snapshot_all_btn.setVisible(len(self.channels) > 1)
+        right_layout.addWidget(self.snapshot_all_btn)
+
         self.status_hint = QtWidgets.QLabel("")
         right_layout.addWidget(self.status_hint)
 
         right_layout.addStretch(1)
         main_layout.addWidget(right, stretch=0)
 
-        exposure_us = int(self.settings.data.get("exposure_us", 5000))
-        exposure_ms = max(50, min(5000, exposure_us // 1000))
-
-        gain = int(self.settings.data.get("gain", 50))
-        gain = max(0, min(600, gain))
-
-        self.exposure_slider.blockSignals(True)
-        self.gain_slider.blockSignals(True)
-        self.exposure_slider.setValue(exposure_ms)
-        self.gain_slider.setValue(gain)
-        self.exposure_slider.blockSignals(False)
-        self.gain_slider.blockSignals(False)
-
-        self._update_exposure_label(exposure_ms)
-        self._update_gain_label(gain)
+        self._load_camera_controls()
 
         stack_n = int(self.settings.data.get("snapshot", {}).get("stack_n", 1))
         stack_n = max(1, min(50, stack_n))
@@ -237,18 +338,71 @@ class MainWindow(QtWidgets.QMainWindow):
         self.stack_slider.setValue(stack_n)
         self.stack_slider.blockSignals(False)
         self._update_stack_label(stack_n)
+        self._select_stack_method(self.stack_method_combo, self._stack_method())
 
+        self.camera_combo.currentIndexChanged.connect(self.set_active_camera)
         self.exposure_slider.valueChanged.connect(self.on_exposure_changed)
         self.gain_slider.valueChanged.connect(self.on_gain_changed)
         self.distort_btn.clicked.connect(self.open_distortion_window)
 
-        self.dark_btn.clicked.connect(lambda: self.snapshot_manager.capture_dark(10))
-        self.flat_btn.clicked.connect(lambda: self.snapshot_manager.capture_flat(10))
+        self.dark_btn.clicked.connect(
+            lambda: self.channel.snapshot_manager.capture_dark(
+                self.master_frames_spin.value(), method=self.master_method_combo.currentData()
+            )
+        )
+        self.flat_btn.clicked.connect(
+            lambda: self.channel.snapshot_manager.capture_flat(
+                self.master_frames_spin.value(), method=self.master_method_combo.currentData()
+            )
+        )
         self.use_dark_cb.stateChanged.connect(self.on_use_dark_changed)
         self.use_flat_cb.stateChanged.connect(self.on_use_flat_changed)
+        self.fix_defects_cb.stateChanged.connect(self.on_fix_defects_changed)
         self.stack_slider.valueChanged.connect(self.on_stack_changed)
+        self.stack_method_combo.currentIndexChanged.connect(self.on_stack_method_changed)
 
         self.snapshot_btn.clicked.connect(self.take_snapshot)
+        self.snapshot_all_btn.clicked.connect(self.take_snapshot_all)
+
+    def _load_camera_controls(self):
+        settings = self.channel.settings
+        exposure_us = int(settings.data.get("exposure_us", 5000))
+        exposure_ms = max(50, min(5000, exposure_us // 1000))
+
+        gain = int(settings.data.get("gain", 50))
+        gain = max(0, min(600, gain))
+
+        self.exposure_slider.blockSignals(True)
+        self.gain_slider.blockSignals(True)
+        self.exposure_slider.setValue(exposure_ms)
+        self.gain_slider.setValue(gain)
+        self.exposure_slider.blockSignals(False)
+        self.gain_slider.blockSignals(False)
+
+        self._update_exposure_label(exposure_ms)
+        self._update_gain_label(gain)
+
+        # masters of this camera are recaptured the way the last dark was built
+        dark = settings.data.get("dark", {})
+        self._select_stack_method(self.master_method_combo, dark.get("stack_method", "median"))
+        self.master_frames_spin.setValue(int(dark.get("frames", 10)))
+
+        self.fix_defects_cb.blockSignals(True)
+        self.fix_defects_cb.setChecked(bool(settings.data.get("defects", {}).get("enabled", True)))
+        self.fix_defects_cb.blockSignals(False)
+
+    def _stack_method_combo(self) -> QtWidgets.QComboBox:
+        combo = QtWidgets.QComboBox()
+        for method in STACKERS:
+            combo.addItem(STACK_METHOD_LABELS.get(method, method), method)
+        return combo
+
+    @staticmethod
+    def _select_stack_method(combo: QtWidgets.QComboBox, method: str):
+        i = combo.findData(method)
+        combo.blockSignals(True)
+        combo.setCurrentIndex(max(0, i))
+        combo.blockSignals(False)
 
     def _update_exposure_label(self, exposure_ms: int):
         self.exposure_label.setText(f"Exposure: {exposure_ms} ms")
@@ -280,18 +434,24 @@ class MainWindow(QtWidgets.QMainWindow):
         self.settings.set("snapshot", snap)
         self._schedule_save()
 
+    def on_stack_method_changed(self, i: int):
+        snap = self.settings.data.get("snapshot", {})
+        snap["stack_method"] = self.stack_method_combo.itemData(i)
+        self.settings.set("snapshot", snap)
+        self._schedule_save()
+
     def take_snapshot(self):
         self.take_snapshot_and_return_path()
 
-    def _refresh_calibration_ui_state(self):
-        dark = self.settings.data.get("dark", {})
-        flat = self.settings.data.get("flat", {})
+    def take_snapshot_all(self):
+        self.take_snapshot_all_and_return_paths()
 
-        dark_path = dark.get("path", None)
-        has_dark = bool(dark_path and isinstance(dark_path, str) and len(dark_path) > 0 and os.path.exists(dark_path))
+    def _refresh_calibration_ui_state(self):
+        dark = self.channel.settings.data.get("dark", {})
+        flat = self.channel.settings.data.get("flat", {})
 
-        flat_path = flat.get("path", None)
-        has_flat = bool(flat_path and isinstance(flat_path, str) and len(flat_path) > 0 and os.path.exists(flat_path))
+        has_dark = any(os.path.exists(e["path"]) for e in library_entries(dark))
+        has_flat = any(os.path.exists(e["path"]) for e in library_entries(flat))
 
         self.use_dark_cb.blockSignals(True)
         self.use_flat_cb.blockSignals(True)
@@ -307,26 +467,35 @@ class MainWindow(QtWidgets.QMainWindow):
 
         if not has_flat:
             flat["enabled"] = False
-            self.settings.set("flat", flat)
+            self.channel.settings.set("flat", flat)
             self._schedule_save()
 
     def on_use_dark_changed(self, state: int):
-        dark = self.settings.data.get("dark", {})
+        dark = self.channel.settings.data.get("dark", {})
         dark["enabled"] = bool(state == QtCore.Qt.Checked)
-        self.settings.set("dark", dark)
+        self.channel.settings.set("dark", dark)
         self._schedule_save()
 
     def on_use_flat_changed(self, state: int):
-        flat = self.settings.data.get("flat", {})
+        flat = self.channel.settings.data.get("flat", {})
         flat["enabled"] = bool(state == QtCore.Qt.Checked)
-        self.settings.set("flat", flat)
+        self.channel.settings.set("flat", flat)
+        self._schedule_save()
+
+    def on_fix_defects_changed(self, state: int):
+        defects = self.channel.settings.data.get("defects", {})
+        defects["enabled"] = bool(state == QtCore.Qt.Checked)
+        self.channel.settings.set("defects", defects)
         self._schedule_save()
 
     def open_distortion_window(self):
         if self.distortion_window is None:
-            self.distortion_window = DistortionWindow(self.settings, parent=self)
+            self.distortion_window = DistortionWindow(self.channel.settings, parent=self)
             self.distortion_window.changed.connect(self.on_calibration_changed)
+            self.distortion_window.settled.connect(lambda: self.channel.pipeline.settings_changed())
             self.distortion_window.request_crop_selection.connect(self.begin_crop_selection)
+            self.distortion_window.request_chessboard_collect.connect(self.on_chessboard_collect)
+            self.distortion_window.request_chessboard_calibrate.connect(self.on_chessboard_calibrate)
 
         self.distortion_window.show()
         self.distortion_window.raise_()
@@ -336,15 +505,49 @@ class MainWindow(QtWidgets.QMainWindow):
     @QtCore.pyqtSlot()
     def on_calibration_changed(self):
         self._schedule_save()
-        self.distortion.invalidate()
+        adjusting = self.distortion_window is not None and self.distortion_window.adjusting()
+        self.channel.pipeline.settings_changed(adjusting=adjusting)
+
+    def on_chessboard_collect(self, on: bool):
+        if not on:
+            collector = self.channel.stop_chessboard()
+            if collector is not None:
+                collector.cancel()
+            return
+
+        collector = self.channel.start_chessboard()
+        collector.progress.connect(self.distortion_window.set_chessboard_progress)
+
+    def on_chessboard_calibrate(self):
+        collector = self.channel.stop_chessboard()
+        if collector is None:
+            return
+        channel = self.channel
+        collector.calibrated.connect(lambda calib: self.on_chessboard_calibrated(channel, calib))
+        collector.error.connect(self.on_chessboard_failed)
+        # nothing else holds on to it until the result comes back
+        self._chessboard = collector
+        collector.finish()
+
+    def on_chessboard_calibrated(self, channel, calib: dict):
+        channel.settings.set("distortion_calibration", calib)
+        self._schedule_save()
+        channel.pipeline.settings_changed()
+        if self.distortion_window is not None and channel is self.channel:
+            self.distortion_window.chessboard_finished()
+
+    def on_chessboard_failed(self, msg: str):
+        if self.distortion_window is not None:
+            self.distortion_window.chessboard_finished()
+        QtWidgets.QMessageBox.warning(self, "Calibration failed", msg)
 
     def begin_crop_selection(self):
-        crop = self.settings.data.get("crop", {})
+        crop = self.channel.settings.data.get("crop", {})
         crop["enabled"] = False
-        self.settings.set("crop", crop)
+        self.channel.settings.set("crop", crop)
         self._schedule_save()
 
-        self._crop_selecting = True
+        self.channel.processor.selecting = True
         self._crop_points = []
         self.status_hint.setText("Crop selection: click 4 points on the image")
 
@@ -361,8 +564,9 @@ class MainWindow(QtWidgets.QMainWindow):
         x0, x1 = xs[1], xs[2]
         y0, y1 = ys[1], ys[2]
 
-        if self._last_frame16 is not None:
-            h, w = self._last_frame16.shape
+        w = self._display["frame_w"]
+        h = self._display["frame_h"]
+        if w is not None and h is not None:
             x0 = max(0, min(w - 2, x0))
             x1 = max(1, min(w - 1, x1))
             y0 = max(0, min(h - 2, y0))
@@ -370,17 +574,24 @@ class MainWindow(QtWidgets.QMainWindow):
 
         if x1 <= x0 or y1 <= y0:
             self.status_hint.setText("Crop selection failed. Try again.")
-            self._crop_selecting = False
+            self.channel.processor.selecting = False
             self._crop_points = []
             return
 
-        crop = self.settings.data.get("crop", {})
+        # the crop rect is kept in unbinned full-sensor pixels
+        view = self._display["geometry"]
+        if view is not None:
+            x0, y0 = view.point_to_sensor(x0, y0)
+            x1, y1 = view.point_to_sensor(x1, y1)
+
+        crop = self.channel.settings.data.get("crop", {})
         crop["rect"] = [int(x0), int(y0), int(x1), int(y1)]
         crop["enabled"] = True
-        self.settings.set("crop", crop)
+        self.channel.settings.set("crop", crop)
         self._schedule_save()
+        self.channel.pipeline.settings_changed()
 
-        self._crop_selecting = False
+        self.channel.processor.selecting = False
         self._crop_points = []
         self.status_hint.setText("")
 
@@ -409,7 +620,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
     @QtCore.pyqtSlot(int, int)
     def on_video_clicked(self, lx: int, ly: int):
-        if not self._crop_selecting:
+        if not self.channel.processor.selecting:
             return
 
         pt = self._label_to_frame_coords(lx, ly)
@@ -422,59 +633,32 @@ class MainWindow(QtWidgets.QMainWindow):
         if len(self._crop_points) >= 4:
             self._finish_crop_selection()
 
-    @QtCore.pyqtSlot(object)
-    def on_frame_ready(self, frame):
-        try:
-            frame = frame if isinstance(frame, np.ndarray) else np.array(frame)
-
-            if frame.dtype != np.uint16:
-                frame = frame.astype(np.uint16, copy=False)
-
-            if frame.ndim == 3:
-                frame = frame[:, :, 0]
-
-            h, w = frame.shape
-            self.distortion.ensure_maps(w, h, self.settings)
-            frame = self.distortion.apply(frame)
-
-            frame = apply_crop_if_enabled(frame, self.settings, selecting=self._crop_selecting)
-
-            self._last_frame16 = frame
-            self._frame_counter += 1
-
-            qimg16, buf = gray16_to_qimage_bytes(frame)
-            if qimg16 is not None:
-                self._qimg_buf = buf
-                pix = QtGui.QPixmap.fromImage(qimg16)
-            else:
-                qimg8, buf8 = gray16_to_qimage_8bit_preview(frame)
-                self._qimg_buf = buf8
-                pix = QtGui.QPixmap.fromImage(qimg8)
-
-            label_w = max(1, self.image_label.width())
-            label_h = max(1, self.image_label.height())
-            pix_scaled = pix.scaled(label_w, label_h, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
-
-            sw = pix_scaled.width()
-            sh = pix_scaled.height()
-            ox = int((label_w - sw) / 2)
-            oy = int((label_h - sh) / 2)
+    def on_preview_ready(self, channel):
+        # only the newest preview is kept, older ones were dropped on the way
+        preview = channel.processor.preview_box.take()
+        if preview is None or channel is not self.channel:
+            return
+        image, frame_w, frame_h, view = preview
 
-            self._display["frame_w"] = frame.shape[1]
-            self._display["frame_h"] = frame.shape[0]
-            self._display["scaled_w"] = sw
-            self._display["scaled_h"] = sh
-            self._display["offset_x"] = ox
-            self._display["offset_y"] = oy
+        label_w = max(1, self.image_label.width())
+        label_h = max(1, self.image_label.height())
+        channel.processor.preview_size = (label_w, label_h)
 
-            self.image_label.setPixmap(pix_scaled)
+        self._display["frame_w"] = frame_w
+        self._display["frame_h"] = frame_h
+        self._display["scaled_w"] = image.width()
+        self._display["scaled_h"] = image.height()
+        self._display["offset_x"] = (label_w - image.width()) // 2
+        self._display["offset_y"] = (label_h - image.height()) // 2
+        self._display["geometry"] = view
 
-        except Exception as e:
-            self.image_label.setText(f"Display failed:\n{e}")
+        self.image_label.set_image(image)
 
-    @QtCore.pyqtSlot(str)
-    def on_worker_error(self, msg: str):
-        self.image_label.setText(msg)
+    def on_channel_message(self, channel, msg: str):
+        if channel is self.channel:
+            self.image_label.setText(msg)
+        else:
+            self.status_hint.setText(f"Camera {channel.camera_id}: {msg}")
 
     def closeEvent(self, event):
         try:
@@ -484,17 +668,16 @@ class MainWindow(QtWidgets.QMainWindow):
             except Exception:
                 pass
 
-            if self.worker:
-                QtCore.QMetaObject.invokeMethod(self.worker, "stop", QtCore.Qt.QueuedConnection)
+            for ch in self.channels:
+                ch.worker.stop()
 
             try:
                 self.server.stop()
             except Exception:
                 pass
 
-            if self.thread:
-                self.thread.quit()
-                self.thread.wait(2000)
+            for ch in self.channels:
+                ch.stop()
         finally:
             event.accept()
 
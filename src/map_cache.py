@@ -0,0 +1,72 @@
+import hashlib
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+
+
+class MapCache:
+    """
+    Bounded on-disk cache of remap maps, one pair of .npy files per key.
+
+    Entries are loaded memory-mapped, so a hit costs a few page faults instead
+    of a rebuild. The file modification time doubles as the LRU stamp: hits
+    touch it and the oldest entries beyond max_entries are deleted on store.
+    Files are written under a temporary name and renamed, so several cameras
+    (or app instances) can share one directory.
+    """
+
+    def __init__(self, directory: str, max_entries: int = 16):
+        self.directory = directory
+        self.max_entries = max(1, int(max_entries))
+        self._lock = threading.Lock()
+
+    def _paths(self, key):
+        stem = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:20]
+        base = os.path.join(self.directory, stem)
+        return base + "_1.npy", base + "_2.npy"
+
+    def load(self, key) -> Optional[tuple]:
+        p1, p2 = self._paths(key)
+        try:
+            map1 = np.load(p1, mmap_mode="r")
+            map2 = np.load(p2, mmap_mode="r")
+            os.utime(p1)
+            os.utime(p2)
+        except (OSError, ValueError):
+            return None
+        return map1, map2
+
+    def store(self, key, map1: np.ndarray, map2: np.ndarray) -> None:
+        p1, p2 = self._paths(key)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for path, arr in ((p1, map1), (p2, map2)):
+                tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp, "wb") as f:
+                    np.save(f, arr)
+                os.replace(tmp, path)
+        except OSError:
+            # a cache that can't be written is just a slower cache
+            return
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            try:
+                entries = {}
+                for name in os.listdir(self.directory):
+                    if name.endswith("_1.npy"):
+                        path = os.path.join(self.directory, name)
+                        entries[path[:-len("_1.npy")]] = os.path.getmtime(path)
+            except OSError:
+                return
+
+            stale = sorted(entries, key=entries.get)[:-self.max_entries]
+            for base in stale:
+                for suffix in ("_1.npy", "_2.npy"):
+                    try:
+                        os.remove(base + suffix)
+                    except OSError:
+                        pass
@@ -0,0 +1,130 @@
+import glob
+import os
+import time
+from typing import Optional
+
+import numpy as np
+import cv2
+
+from camera_backend import CameraBackend
+from frame_pool import FramePool
+from geometry import SensorGeometry, bin_image, full_geometry
+
+
+IMAGE_EXTS = (".tif", ".tiff", ".png")
+
+
+class ReplayCamera(CameraBackend):
+    """
+    Streams a recorded raw stack from disk as if it came from the camera.
+
+    path may be a .npy stack (N, H, W) which is memory mapped, a multi-page TIFF,
+    or a directory of single frame images replayed in name order. fps > 0 paces
+    the stream, fps == 0 replays as fast as the consumer pulls frames.
+    Exposure and gain are accepted and ignored, the recording is what it is.
+    A readout window and binning are emulated by slicing and block averaging.
+    """
+
+    def __init__(self, path: str, fps: float = 0.0, loop: bool = True, pool_size: int = 6):
+        if not path or not os.path.exists(path):
+            raise RuntimeError(f"Replay source not found: {path}")
+
+        self.path = path
+        self.fps = max(0.0, float(fps))
+        self.loop = bool(loop)
+
+        self._stack = None
+        self._files = []
+        self._open_source(path)
+
+        first = self._read(0)
+        self._pool_size = pool_size
+        self.set_geometry(full_geometry(first.shape[1], first.shape[0], 1))
+
+        self._pos = 0
+        self._last_frame_t = time.monotonic()
+
+    def _open_source(self, path: str) -> None:
+        if os.path.isdir(path):
+            files = sorted(
+                f for f in glob.glob(os.path.join(path, "*"))
+                if f.lower().endswith(IMAGE_EXTS)
+            )
+            if not files:
+                raise RuntimeError(f"No frames found in {path}")
+            self._files = files
+            return
+
+        if path.lower().endswith(".npy"):
+            stack = np.load(path, mmap_mode="r")
+        else:
+            ok, pages = cv2.imreadmulti(path, flags=cv2.IMREAD_UNCHANGED)
+            if not ok or not pages:
+                raise RuntimeError(f"Could not read replay stack {path}")
+            stack = np.stack([p[:, :, 0] if p.ndim == 3 else p for p in pages], axis=0)
+
+        if stack.ndim == 2:
+            stack = stack[None, :, :]
+        if stack.ndim != 3:
+            raise RuntimeError(f"Replay stack must be (N, H, W), got shape {stack.shape}")
+        self._stack = stack
+
+    def __len__(self) -> int:
+        return len(self._files) if self._files else int(self._stack.shape[0])
+
+    def set_geometry(self, geometry: SensorGeometry) -> None:
+        self.geometry = geometry
+        self.pool = FramePool(geometry.frame_shape, dtype=np.uint16, size=self._pool_size)
+
+    def set_exposure_us(self, exposure_us: int) -> None:
+        pass
+
+    def set_gain(self, gain: int) -> None:
+        pass
+
+    def abort_exposure(self) -> None:
+        self._last_frame_t = time.monotonic()
+
+    def _wait_for_slot(self, timeout_ms: Optional[int]) -> bool:
+        if self.fps <= 0.0:
+            return True
+        remaining = self._last_frame_t + 1.0 / self.fps - time.monotonic()
+        if timeout_ms is not None and remaining > timeout_ms / 1000.0:
+            time.sleep(timeout_ms / 1000.0)
+            return False
+        if remaining > 0:
+            time.sleep(remaining)
+        self._last_frame_t = time.monotonic()
+        return True
+
+    def _read(self, i: int) -> np.ndarray:
+        if self._files:
+            img = cv2.imread(self._files[i], cv2.IMREAD_UNCHANGED)
+            if img is None:
+                raise RuntimeError(f"Could not read {self._files[i]}")
+            if img.ndim == 3:
+                img = img[:, :, 0]
+            return img
+        return self._stack[i]
+
+    def get_frame(self, timeout_ms: Optional[int] = None) -> Optional[np.ndarray]:
+        if self._pos >= len(self):
+            if not self.loop:
+                raise RuntimeError("Replay finished")
+            self._pos = 0
+
+        if not self._wait_for_slot(timeout_ms):
+            return None
+
+        src = self._read(self._pos)
+        self._pos += 1
+
+        g = self.geometry
+        if src.shape != (g.sensor_h, g.sensor_w):
+            raise RuntimeError(f"Replay frame {self._pos - 1} has shape {src.shape}, expected {(g.sensor_h, g.sensor_w)}")
+        if src.shape != g.frame_shape:
+            src = bin_image(src[g.y:g.y + g.h, g.x:g.x + g.w], g.bin)
+
+        frame = self.pool.acquire()
+        np.copyto(frame, src, casting="unsafe")
+        return frame
@@ -16,20 +16,28 @@ class ControlAPI:
     """
     Implement these methods in main and pass an instance into ZmqServer.
     All methods should be blocking and return quickly unless explicitly expected.
+    camera is a camera id, None addresses the primary camera.
     """
-    def set_exposure_ms(self, exposure_ms: int) -> RpcResult:
+    def set_exposure_ms(self, exposure_ms: int, camera: str | None = None) -> RpcResult:
         raise NotImplementedError
 
-    def set_gain(self, gain: int) -> RpcResult:
+    def set_gain(self, gain: int, camera: str | None = None) -> RpcResult:
         raise NotImplementedError
 
     def set_stack_n(self, n: int) -> RpcResult:
         raise NotImplementedError
 
-    def take_snapshot(self) -> RpcResult:
+    def set_stack_method(self, method: str, master: str | None = None, camera: str | None = None) -> RpcResult:
+        """Default method for snapshots, or with master ("dark" or "flat") for that master of camera."""
         raise NotImplementedError
 
-    def get_state(self) -> RpcResult:
+    def take_snapshot(self, camera: str | None = None, method: str | None = None) -> RpcResult:
+        raise NotImplementedError
+
+    def take_snapshot_all(self, method: str | None = None) -> RpcResult:
+        raise NotImplementedError
+
+    def get_state(self, camera: str | None = None) -> RpcResult:
         raise NotImplementedError
 
 
@@ -101,25 +109,38 @@ class ZmqServer:
     def _handle(self, req: dict) -> dict:
         cmd = req.get("cmd", None)
         args = req.get("args", {}) or {}
+        camera = args.get("camera", None)
+        if camera is not None:
+            camera = str(camera)
+        method = args.get("method", None)
+        if method is not None:
+            method = str(method)
 
         try:
             if cmd == "set_exposure_ms":
                 exposure_ms = int(args.get("value"))
-                r = self.api.set_exposure_ms(exposure_ms)
+                r = self.api.set_exposure_ms(exposure_ms, camera=camera)
 
             elif cmd == "set_gain":
                 gain = int(args.get("value"))
-                r = self.api.set_gain(gain)
+                r = self.api.set_gain(gain, camera=camera)
 
             elif cmd == "set_stack_n":
                 n = int(args.get("value"))
                 r = self.api.set_stack_n(n)
 
+            elif cmd == "set_stack_method":
+                master = args.get("master", None)
+                r = self.api.set_stack_method(str(args.get("value")), master=master, camera=camera)
+
             elif cmd == "take_snapshot":
-                r = self.api.take_snapshot()
+                r = self.api.take_snapshot(camera=camera, method=method)
+
+            elif cmd == "take_snapshot_all":
+                r = self.api.take_snapshot_all(method=method)
 
             elif cmd == "get_state":
-                r = self.api.get_state()
+                r = self.api.get_state(camera=camera)
 
             else:
                 return {"ok": False, "error": "unknown cmd"}
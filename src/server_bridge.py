@@ -1,14 +1,20 @@
+import time
+
 from PyQt5 import QtCore
+from calibration_masters import library_entries
 from server import ControlAPI, RpcResult
+from stacking import STACKERS
 
 
 class ServerBridge(QtCore.QObject, ControlAPI):
-    _do_set_exposure = QtCore.pyqtSignal(int)
-    _do_set_gain = QtCore.pyqtSignal(int)
+    _do_set_exposure = QtCore.pyqtSignal(object, int)
+    _do_set_gain = QtCore.pyqtSignal(object, int)
     _do_set_stack = QtCore.pyqtSignal(int)
-    _do_snapshot = QtCore.pyqtSignal()
+    _do_set_stack_method = QtCore.pyqtSignal(object, object, str)
+    _do_snapshot = QtCore.pyqtSignal(object, float, object)
+    _do_snapshot_all = QtCore.pyqtSignal(float, object)
 
-    _snapshot_done = QtCore.pyqtSignal(bool, str)
+    _snapshot_done = QtCore.pyqtSignal(bool, object)
 
     def __init__(self, main_window):
         super().__init__(main_window)
@@ -17,68 +23,152 @@ class ServerBridge(QtCore.QObject, ControlAPI):
         self._do_set_exposure.connect(self._on_set_exposure)
         self._do_set_gain.connect(self._on_set_gain)
         self._do_set_stack.connect(self._on_set_stack)
+        self._do_set_stack_method.connect(self._on_set_stack_method)
         self._do_snapshot.connect(self._on_snapshot)
+        self._do_snapshot_all.connect(self._on_snapshot_all)
 
         self._last_snapshot_ok = False
-        self._last_snapshot_path = ""
+        self._last_snapshot_result = None
+
+    def _channel(self, camera):
+        ch = self.w.channel_by_id(camera)
+        if ch is None:
+            raise RuntimeError(f"unknown camera '{camera}'")
+        return ch
 
-    def set_exposure_ms(self, exposure_ms: int) -> RpcResult:
-        self._do_set_exposure.emit(int(exposure_ms))
+    def set_exposure_ms(self, exposure_ms: int, camera=None) -> RpcResult:
+        self._do_set_exposure.emit(self._channel(camera), int(exposure_ms))
         return RpcResult(ok=True, result={"exposure_ms": int(exposure_ms)})
 
-    def set_gain(self, gain: int) -> RpcResult:
-        self._do_set_gain.emit(int(gain))
+    def set_gain(self, gain: int, camera=None) -> RpcResult:
+        self._do_set_gain.emit(self._channel(camera), int(gain))
         return RpcResult(ok=True, result={"gain": int(gain)})
 
     def set_stack_n(self, n: int) -> RpcResult:
         self._do_set_stack.emit(int(n))
         return RpcResult(ok=True, result={"stack_n": int(n)})
 
-    def take_snapshot(self) -> RpcResult:
+    @staticmethod
+    def _check_method(method):
+        if method is not None and method not in STACKERS:
+            raise RuntimeError(f"unknown stack method '{method}', expected one of: {', '.join(STACKERS)}")
+
+    def set_stack_method(self, method: str, master=None, camera=None) -> RpcResult:
+        self._check_method(method)
+        if master not in (None, "dark", "flat"):
+            raise RuntimeError(f"unknown master '{master}', expected dark or flat")
+        ch = self._channel(camera) if master is not None else None
+        self._do_set_stack_method.emit(ch, master, method)
+        result = {"stack_method": method}
+        if master is not None:
+            result.update(master=master, camera=ch.camera_id)
+        return RpcResult(ok=True, result=result)
+
+    def _wait_for_snapshot(self, trigger):
+        """Runs trigger(requested_at) and blocks until the GUI thread reports back."""
         loop = QtCore.QEventLoop()
 
-        def done(ok, path):
+        def done(ok, result):
             self._last_snapshot_ok = bool(ok)
-            self._last_snapshot_path = path or ""
+            self._last_snapshot_result = result
             loop.quit()
 
         self._snapshot_done.connect(done)
-        self._do_snapshot.emit()
+        # stamp the request here, frames exposed after this point are usable
+        # even if the GUI thread picks the request up a little later
+        trigger(time.monotonic())
         loop.exec_()
         try:
             self._snapshot_done.disconnect(done)
         except Exception:
             pass
+        return self._last_snapshot_ok, self._last_snapshot_result
 
-        if not self._last_snapshot_ok:
+    def take_snapshot(self, camera=None, method=None) -> RpcResult:
+        ch = self._channel(camera)
+        self._check_method(method)
+        ok, path = self._wait_for_snapshot(lambda t: self._do_snapshot.emit(ch, t, method))
+        if not ok:
             return RpcResult(ok=False, error="snapshot failed")
-        return RpcResult(ok=True, result={"path": self._last_snapshot_path})
-
-    def get_state(self) -> RpcResult:
-        s = self.w.settings.data
+        return RpcResult(ok=True, result={"path": path})
+
+    def take_snapshot_all(self, method=None) -> RpcResult:
+        self._check_method(method)
+        ok, paths = self._wait_for_snapshot(lambda t: self._do_snapshot_all.emit(t, method))
+        if not ok:
+            failed = [cid for cid, p in (paths or {}).items() if not p]
+            return RpcResult(ok=False, error=f"snapshot failed for camera(s): {', '.join(failed)}")
+        return RpcResult(ok=True, result={"paths": paths})
+
+    def get_state(self, camera=None) -> RpcResult:
+        ch = self._channel(camera)
+        s = ch.settings.data
         return RpcResult(ok=True, result={
+            "camera": ch.camera_id,
+            "cameras": [c.camera_id for c in self.w.channels],
             "exposure_us": int(s.get("exposure_us", 0)),
             "gain": int(s.get("gain", 0)),
             "stack_n": int(s.get("snapshot", {}).get("stack_n", 1)),
+            "stack_method": self.w._stack_method(),
+            "dark_stack_method": s.get("dark", {}).get("stack_method", "median"),
+            "flat_stack_method": s.get("flat", {}).get("stack_method", "median"),
             "dark_enabled": bool(s.get("dark", {}).get("enabled", False)),
             "flat_enabled": bool(s.get("flat", {}).get("enabled", False)),
+            "dark_library": self._library(s.get("dark", {})),
+            "flat_library": self._library(s.get("flat", {})),
+            "frame_pool": ch.worker.pool_stats(),
+            "preview_dropped": ch.processor.dropped_preview_frames(),
         })
 
-    def _on_set_exposure(self, exposure_ms: int):
+    @staticmethod
+    def _library(cfg: dict) -> list:
+        return [
+            {"exposure_us": e.get("exposure_us"), "gain": e.get("gain"), "bin": int(e.get("bin", 1))}
+            for e in library_entries(cfg)
+        ]
+
+    def _on_set_exposure(self, channel, exposure_ms: int):
         exposure_ms = max(50, min(5000, int(exposure_ms)))
-        self.w.exposure_slider.setValue(exposure_ms)
+        if channel is self.w.channel:
+            self.w.exposure_slider.setValue(exposure_ms)
+        else:
+            channel.worker.set_exposure_us(exposure_ms * 1000)
+            self.w._schedule_save()
 
-    def _on_set_gain(self, gain: int):
+    def _on_set_gain(self, channel, gain: int):
         gain = max(0, min(600, int(gain)))
-        self.w.gain_slider.setValue(gain)
+        if channel is self.w.channel:
+            self.w.gain_slider.setValue(gain)
+        else:
+            channel.worker.set_gain(gain)
+            self.w._schedule_save()
 
     def _on_set_stack(self, n: int):
         n = max(1, min(50, int(n)))
         self.w.stack_slider.setValue(n)
 
-    def _on_snapshot(self):
+    def _on_set_stack_method(self, channel, master, method: str):
+        if master is None:
+            i = self.w.stack_method_combo.findData(method)
+            self.w.stack_method_combo.setCurrentIndex(i)
+            return
+        cfg = channel.settings.data.get(master, {})
+        cfg["stack_method"] = method
+        channel.settings.set(master, cfg)
+        if channel is self.w.channel and master == "dark":
+            self.w._select_stack_method(self.w.master_method_combo, method)
+        self.w._schedule_save()
+
+    def _on_snapshot(self, channel, requested_at: float, method):
         try:
-            path = self.w.take_snapshot_and_return_path()
-            self._snapshot_done.emit(True, path)
+            path = self.w.take_snapshot_and_return_path(requested_at=requested_at, channel=channel, method=method)
+            self._snapshot_done.emit(bool(path), path or "")
         except Exception:
             self._snapshot_done.emit(False, "")
+
+    def _on_snapshot_all(self, requested_at: float, method):
+        try:
+            paths = self.w.take_snapshot_all_and_return_paths(requested_at=requested_at, method=method)
+            self._snapshot_done.emit(all(paths.values()), paths)
+        except Exception:
+            self._snapshot_done.emit(False, {})
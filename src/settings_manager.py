@@ -1,5 +1,7 @@
+import copy
 import json
 import os
+from collections import ChainMap
 from typing import Any, Dict
 
 
@@ -8,6 +10,14 @@ DEFAULT_SETTINGS: Dict[str, Any] = {
     "gain": 50,
 }
 
+# Keys every camera keeps for itself, everything else is shared
+CAMERA_KEYS = (
+    "exposure_us", "gain", "camera", "crop", "distortion_manual", "distortion_calibration", "dark", "flat", "defects",
+)
+# Fields of the camera block that name one device. A camera's block takes the
+# rest (backend, binning, ...) from the shared one unless it sets them itself.
+DEVICE_KEYS = ("id", "index")
+
 
 class SettingsManager:
     def __init__(self, path: str):
@@ -39,3 +49,40 @@ class SettingsManager:
 
     def set(self, key: str, value: Any) -> None:
         self.data[key] = value
+
+
+class CameraSettings:
+    """
+    Settings as seen by an additional camera. Its own keys (CAMERA_KEYS) live in
+    one entry of settings["cameras"], the rest is read from and written to the
+    shared settings. Its camera block is seeded from the shared one, except for
+    DEVICE_KEYS. Has the same data/set/save interface as SettingsManager.
+    """
+
+    def __init__(self, root: SettingsManager, scope: Dict[str, Any]):
+        self.root = root
+        self.scope = scope
+        self.path = root.path
+
+        # Callers mutate the dicts they get and set() them back, so a camera
+        # must never be handed one that belongs to the shared settings
+        for key in CAMERA_KEYS:
+            if key not in scope and isinstance(root.data.get(key), dict):
+                scope[key] = {}
+
+        shared = root.data.get("camera")
+        if isinstance(shared, dict) and isinstance(scope.get("camera"), dict):
+            for key, value in shared.items():
+                if key not in DEVICE_KEYS:
+                    scope["camera"].setdefault(key, copy.deepcopy(value))
+
+        self.data = ChainMap(scope, root.data)
+
+    def save(self) -> None:
+        self.root.save()
+
+    def set(self, key: str, value: Any) -> None:
+        if key in CAMERA_KEYS:
+            self.scope[key] = value
+        else:
+            self.root.set(key, value)
@@ -0,0 +1,178 @@
+import time
+from typing import Optional
+
+import numpy as np
+
+from camera_backend import CameraBackend
+from frame_pool import FramePool
+from geometry import SensorGeometry, bin_image, full_geometry
+
+
+class SimulatedCamera(CameraBackend):
+    """
+    Synthetic X-ray detector for headless runs and pipeline throughput tests.
+
+    Frames are 12-bit values stored in uint16: a cone-beam field with a simple
+    phantom, shot and read noise, a bias offset and a fixed set of hot pixels.
+    With realtime=True get_frame paces itself to the exposure like video mode on
+    the real camera, with realtime=False frames are produced as fast as possible.
+    """
+
+    MAX_ADU = 4095
+
+    def __init__(
+        self,
+        width: int = 4144,
+        height: int = 2822,
+        realtime: bool = True,
+        flux_e_per_s: float = 300.0,
+        read_noise_e: float = 2.5,
+        bias_adu: float = 64.0,
+        hot_pixel_fraction: float = 2e-4,
+        hot_pixel_e_per_s: float = 2000.0,
+        seed: Optional[int] = None,
+        pool_size: int = 6,
+        fresh_noise: bool = False,
+    ):
+        self.width = int(width)
+        self.height = int(height)
+        self.realtime = bool(realtime)
+        self.flux_e_per_s = float(flux_e_per_s)
+        self.read_noise_e = float(read_noise_e)
+        self.bias_adu = float(bias_adu)
+        self.hot_pixel_e_per_s = float(hot_pixel_e_per_s)
+        self.fresh_noise = bool(fresh_noise)
+
+        self._rng = np.random.default_rng(seed)
+        self._exposure_us = 5000
+        self._gain = 0
+
+        shape = (self.height, self.width)
+        n_hot = int(round(shape[0] * shape[1] * max(0.0, float(hot_pixel_fraction))))
+        hot_idx = self._rng.choice(shape[0] * shape[1], size=n_hot, replace=False)
+        self._hot_rows, self._hot_cols = np.unravel_index(hot_idx, shape)
+
+        self._transmission = self._build_transmission()
+
+        # Drawing fresh normals for a full sensor costs several times the rest of
+        # the frame, so unless fresh_noise is set frames read a window of one
+        # larger noise bank. The window offsets walk a fixed permutation, so a
+        # pixel gets a new sample each frame and the same one again only after
+        # _noise_pad frames. The noise of different frames is still shifted
+        # copies of the bank, correlated between pixels: fine for stacking, not
+        # for measuring noise across the frame.
+        self._noise_pad = 1 << 16
+        self._noise_bank = None
+        if not self.fresh_noise:
+            self._noise_bank = self._rng.standard_normal(shape[0] * shape[1] + self._noise_pad, dtype=np.float32)
+            self._noise_offsets = self._rng.permutation(self._noise_pad)
+        self._noise_frame = 0
+
+        self._pool_size = pool_size
+        self.set_geometry(full_geometry(self.width, self.height, 1))
+
+        self._next_frame_t = time.monotonic() + self._exposure_us / 1e6
+
+    def _build_transmission(self) -> np.ndarray:
+        h, w = self.height, self.width
+        y, x = np.ogrid[-1.0:1.0:complex(0, h), -1.0:1.0:complex(0, w)]
+        y = y.astype(np.float32) * (h / float(max(w, h)))
+        x = x.astype(np.float32) * (w / float(max(w, h)))
+        r2 = x * x + y * y
+
+        # Cone beam falloff with a slight anode heel along x
+        field = (1.0 - 0.35 * r2) * (1.0 - 0.08 * x)
+
+        # Phantom: a disk with a few drilled holes and a dense bar
+        t = np.ones((h, w), dtype=np.float32)
+        t[r2 < 0.30 ** 2] = 0.55
+        for cx, cy, rr in ((-0.12, -0.10, 0.03), (0.10, -0.08, 0.045), (0.0, 0.12, 0.06)):
+            t[(x - cx) ** 2 + (y - cy) ** 2 < rr ** 2] = 0.85
+        t[(np.abs(x - 0.55) < 0.04) & (np.abs(y) < 0.35)] = 0.2
+
+        # Collimator edge
+        t[r2 > 0.95 ** 2] = 0.0
+
+        t *= field
+        return np.clip(t, 0.0, None).astype(np.float32, copy=False)
+
+    def set_geometry(self, geometry: SensorGeometry) -> None:
+        g = geometry
+        b = g.bin
+        window = self._transmission[g.y:g.y + g.h, g.x:g.x + g.w]
+        self._window_t = np.ascontiguousarray(bin_image(window, b), dtype=np.float32)
+
+        shape = self._window_t.shape
+        inside = (
+            (self._hot_rows >= g.y) & (self._hot_rows < g.y + shape[0] * b)
+            & (self._hot_cols >= g.x) & (self._hot_cols < g.x + shape[1] * b)
+        )
+        self._window_hot = ((self._hot_rows[inside] - g.y) // b, (self._hot_cols[inside] - g.x) // b)
+
+        self._mean = np.empty(shape, dtype=np.float32)
+        self._sigma = np.empty(shape, dtype=np.float32)
+        self._scratch = np.empty(shape, dtype=np.float32)
+        self.geometry = g
+        self._rebuild_model()
+
+        self.pool = FramePool(shape, dtype=np.uint16, size=self._pool_size)
+
+    def _rebuild_model(self) -> None:
+        t_s = self._exposure_us / 1e6
+        adu_per_e = 0.1 * (10.0 ** (self._gain / 200.0))
+        b = self.geometry.bin
+
+        # binned pixels report the block mean, so hot pixels are diluted by b*b
+        electrons = self._window_t * np.float32(self.flux_e_per_s * t_s)
+        np.add.at(electrons, self._window_hot, np.float32(self.hot_pixel_e_per_s * t_s / (b * b)))
+
+        np.multiply(electrons, np.float32(adu_per_e), out=self._mean)
+        self._mean += np.float32(self.bias_adu)
+
+        electrons += np.float32(self.read_noise_e ** 2)
+        np.sqrt(electrons, out=self._sigma)
+        self._sigma *= np.float32(adu_per_e / b)
+
+    def set_exposure_us(self, exposure_us: int) -> None:
+        self._exposure_us = max(1, int(exposure_us))
+        self._rebuild_model()
+
+    def set_gain(self, gain: int) -> None:
+        self._gain = max(0, int(gain))
+        self._rebuild_model()
+
+    def abort_exposure(self) -> None:
+        self._next_frame_t = time.monotonic() + self._exposure_us / 1e6
+
+    def _wait_for_exposure(self, timeout_ms: Optional[int]) -> bool:
+        if not self.realtime:
+            return True
+        remaining = self._next_frame_t - time.monotonic()
+        if timeout_ms is not None and remaining > timeout_ms / 1000.0:
+            time.sleep(timeout_ms / 1000.0)
+            return False
+        if remaining > 0:
+            time.sleep(remaining)
+        # video mode: the next exposure starts as soon as this one is read out
+        self._next_frame_t = max(self._next_frame_t, time.monotonic()) + self._exposure_us / 1e6
+        return True
+
+    def get_frame(self, timeout_ms: Optional[int] = None) -> Optional[np.ndarray]:
+        if not self._wait_for_exposure(timeout_ms):
+            return None
+
+        img = self._scratch
+        if self._noise_bank is None:
+            self._rng.standard_normal(dtype=np.float32, out=img)
+            img *= self._sigma
+        else:
+            off = int(self._noise_offsets[self._noise_frame % self._noise_pad])
+            self._noise_frame += 1
+            noise = self._noise_bank[off:off + img.size].reshape(img.shape)
+            np.multiply(noise, self._sigma, out=img)
+        np.add(img, self._mean, out=img)
+        np.clip(img, 0, self.MAX_ADU, out=img)
+
+        frame = self.pool.acquire()
+        np.copyto(frame, img, casting="unsafe")
+        return frame
@@ -1,16 +1,23 @@
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from PyQt5 import QtCore, QtGui, QtWidgets
 
+from calibration_masters import add_to_library, library_entries, library_path
+from defects import DefectMap, defects_path
 from calibration_frames import (
+    CALIBRATE_AFTER_STACKING,
     save_tiff16,
     save_flat_float,
-    make_master_dark,
-    make_master_flat,
+    normalize_flat,
 )
 
 from image_display import gray16_to_qimage_bytes, gray16_to_qimage_8bit_preview
+from frame_ring import FrameRing
+from geometry import SensorGeometry
+from stacking import CUBE_BUDGET_BYTES, SPILL_BUDGET_BYTES, Stacker, make_stacker
 
 
 class SnapshotPreviewDialog(QtWidgets.QDialog):
@@ -65,30 +72,170 @@ class SnapshotPreviewDialog(QtWidgets.QDialog):
         super().resizeEvent(event)
 
 
+class FrameCollector(QtCore.QThread):
+    """
+    Stacks the next n usable frames from a FrameRing on its own thread, so the
+    GUI thread keeps running the event loop (and producing frames) meanwhile.
+    Each frame goes into the stacker as soon as it arrives and its buffer goes
+    straight back, so the work overlaps the next exposure and image is ready
+    when the thread finishes.
+
+    A frame is usable when it was exposed under settings epoch min_epoch or later
+    and its exposure started at or after not_before. Everything else is skipped,
+    which is the minimum wait after a settings change or an HV switch-on.
+
+    With raw the collector asks for unprocessed whole-sensor frames, for
+    building masters. Either way all frames share the readout geometry of the
+    first one. With deferred the pipeline may leave the dark and flat to the
+    stacker.
+    """
+    progress = QtCore.pyqtSignal(int)
+
+    def __init__(self, ring: FrameRing, stacker: Stacker, timeout_s: float = 60.0,
+                 min_epoch: int = 0, not_before: float = 0.0, raw: bool = False, deferred: bool = False,
+                 parent=None):
+        super().__init__(parent)
+        self.ring = ring
+        self.stacker = stacker
+        self.n = stacker.n
+        self.timeout_s = float(timeout_s)
+        self.min_epoch = int(min_epoch)
+        self.not_before = float(not_before)
+        self.raw = bool(raw)
+        self.deferred = bool(deferred) and not self.raw
+        self.count = 0
+        self.skipped = 0
+        self.geometry = None  # readout geometry of the collected frames
+        self.exposure_us = self.gain = None  # and what they were exposed with
+        self.image = None  # uint16 stack, once all n frames are in
+        self.error = None  # why stacking failed, if it did
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _usable(self, f) -> bool:
+        if f.epoch < self.min_epoch or f.exposure_start < self.not_before or f.raw != self.raw:
+            return False
+        if self.raw and f.geometry is not None and not f.geometry.is_full:
+            return False
+        return self.count == 0 or f.geometry == self.geometry
+
+    def start(self, *args):
+        # registered before the thread runs so no frame after the request is skipped
+        self.ring.add_consumer(raw=self.raw, deferred=self.deferred, need=self.n)
+        super().start(*args)
+
+    def run(self):
+        try:
+            self._collect()
+            if self.count == self.n and not self._cancel.is_set():
+                self.image = self.stacker.result()
+        except (OSError, RuntimeError) as e:
+            self.error = str(e)
+        finally:
+            self.ring.remove_consumer(raw=self.raw, deferred=self.deferred, need=self.n - self.count)
+            self.stacker.close()
+
+    def _collect(self):
+        # start from whatever is buffered, frames that qualify already count
+        last_seq = 0
+        deadline = time.monotonic() + self.timeout_s
+
+        while self.count < self.n and not self._cancel.is_set():
+            if time.monotonic() >= deadline:
+                break
+
+            # short slices only so cancel is noticed, frames wake us immediately
+            got = self.ring.wait_for_frames(last_seq, 1, timeout_s=0.25)
+            if not got:
+                continue
+
+            f = got[0]
+            last_seq = f.seq
+            if not self._usable(f):
+                self.ring.release(got)
+                self.skipped += 1
+                continue
+
+            try:
+                self.stacker.add(f.data, f.calibration)
+            finally:
+                self.ring.release(got)
+            self.count += 1
+            self.ring.consumed()
+            self.geometry = f.geometry
+            self.exposure_us, self.gain = f.exposure_us, f.gain
+            deadline = time.monotonic() + self.timeout_s
+            self.progress.emit(self.count)
+
+
 class SnapshotManager(QtCore.QObject):
+    """
+    Snapshots and master captures of one camera. Every capture takes a stack
+    method from stacking.STACKERS, masters default to the one stored with
+    them in the dark/flat settings.
+    """
     status = QtCore.pyqtSignal(str)
 
-    def __init__(self, settings, parent_widget: QtWidgets.QWidget, get_last_frame_fn, get_frame_counter_fn):
+    def __init__(self, settings, parent_widget: QtWidgets.QWidget, frame_ring: FrameRing, settings_epoch_fn,
+                 masters, camera_id: str = "0", own_folders: bool = False):
         super().__init__(parent_widget)
         self.settings = settings
+        self.camera_id = camera_id
+        # additional cameras write into calibration/<id>/ and snapshots/<id>/
+        self.own_folders = own_folders
         self.parent_widget = parent_widget
-
-        self.get_last_frame = get_last_frame_fn
-        self.get_counter = get_frame_counter_fn
+        self.ring = frame_ring
+        self.get_settings_epoch = settings_epoch_fn
+        # CalibrationMasters, also applied by the frame pipeline
+        self.masters = masters
 
         self._preview = None
+        self._capture_geometry = None  # readout geometry of the frames from the last capture
+        self._capture_exposure = (None, None)  # and their (exposure_us, gain)
 
-    def _wait_for_new_frame(self, start_counter: int, timeout_s: float = 20.0) -> bool:
-        t0 = time.time()
-        while self.get_counter() <= start_counter:
-            QtWidgets.QApplication.processEvents()
-            time.sleep(0.01)
-            if (time.time() - t0) >= timeout_s:
-                return False
-        return True
-
-    def _capture_n_frames(self, n: int, title: str):
-        if self.get_last_frame() is None:
+    def _out_dir(self, kind: str) -> str:
+        out_dir = os.path.join(os.getcwd(), kind)
+        if self.own_folders:
+            out_dir = os.path.join(out_dir, str(self.camera_id))
+        os.makedirs(out_dir, exist_ok=True)
+        return out_dir
+
+    def new_collector(self, n: int, requested_at=None, raw: bool = False, method: str = "median") -> FrameCollector:
+        """
+        Collector for the next n frames. Stacks that keep every frame spill to
+        calibration/scratch rather than give up exactness: raw ones, for masters
+        of hundreds of frames, beyond SPILL_BUDGET_BYTES, snapshots only beyond
+        CUBE_BUDGET_BYTES.
+        """
+        if requested_at is None:
+            requested_at = time.monotonic()
+        scratch_dir = os.path.join(self._out_dir("calibration"), "scratch")
+        budget = SPILL_BUDGET_BYTES
+        if not raw:
+            budget = CUBE_BUDGET_BYTES
+            # picks up masters replaced on disk, the frames themselves never read files
+            self.masters.refresh()
+        return FrameCollector(
+            self.ring, make_stacker(method, n, scratch_dir=scratch_dir, budget_bytes=budget), timeout_s=60.0,
+            min_epoch=self.get_settings_epoch(),
+            not_before=requested_at,
+            raw=raw,
+            deferred=method in CALIBRATE_AFTER_STACKING,
+        )
+
+    def collected(self, collector: FrameCollector):
+        """Stacked image of a finished collector, None if it came up short."""
+        self._capture_geometry = collector.geometry
+        self._capture_exposure = (collector.exposure_us, collector.gain)
+        if not collector.raw and collector.geometry is not None:
+            for note in self.masters.notes(collector.geometry, collector.exposure_us, collector.gain):
+                self.status.emit(note)
+        return collector.image
+
+    def _capture_stack(self, n: int, title: str, requested_at=None, raw: bool = False, method: str = "median"):
+        if self.ring.latest_seq() == 0:
             QtWidgets.QMessageBox.warning(self.parent_widget, "No frames", "No camera frames yet.")
             return None
 
@@ -96,170 +243,125 @@ class SnapshotManager(QtCore.QObject):
         progress.setWindowModality(QtCore.Qt.WindowModal)
         progress.setMinimumDuration(0)
 
-        frames = []
-        last_counter = self.get_counter()
-
-        for i in range(n):
-            if progress.wasCanceled():
-                break
+        collector = self.new_collector(n, requested_at, raw=raw, method=method)
+        loop = QtCore.QEventLoop()
+        collector.progress.connect(progress.setValue)
+        collector.finished.connect(loop.quit)
+        progress.canceled.connect(collector.cancel)
 
-            ok = self._wait_for_new_frame(last_counter, timeout_s=60.0)
-            if not ok:
-                break
-
-            last_counter = self.get_counter()
-            fr = self.get_last_frame()
-            if fr is not None:
-                frames.append(fr.copy())
-
-            progress.setValue(i + 1)
+        collector.start()
+        loop.exec_()
+        collector.wait()
 
         progress.close()
+        image = self.collected(collector)
 
-        if len(frames) != n:
+        if image is None:
             QtWidgets.QMessageBox.warning(
                 self.parent_widget,
                 "Capture incomplete",
-                f"Captured {len(frames)} of {n} frames.",
+                collector.error or f"Captured {collector.count} of {n} frames.",
             )
             return None
 
-        return frames
-
-    def _stack_median_uint16(self, frames_u16: list[np.ndarray]) -> np.ndarray:
-        stack = np.stack(frames_u16, axis=0).astype(np.float32)
-        out = np.median(stack, axis=0)
-        return np.clip(out, 0, 65535).astype(np.uint16)
-
-    def _load_master_dark(self):
-        dark = self.settings.data.get("dark", {})
-        if not bool(dark.get("enabled", False)):
-            return None
-
-        path = dark.get("path", None)
-        if not path or not os.path.exists(path):
-            return None
-
-        import cv2
-        img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
-        if img is None:
-            return None
-        if img.ndim == 3:
-            img = img[:, :, 0]
-        if img.dtype != np.uint16:
-            img = img.astype(np.uint16, copy=False)
-        return img
-
-    def _load_master_flat(self):
-        flat = self.settings.data.get("flat", {})
-        if not bool(flat.get("enabled", False)):
-            return None
-
-        path = flat.get("path", None)
-        if not path or not os.path.exists(path):
-            return None
-
-        import cv2
-        img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
-        if img is None:
-            return None
-        if img.ndim == 3:
-            img = img[:, :, 0]
-        if img.dtype != np.float32:
-            img = img.astype(np.float32, copy=False)
-        return img
-
-    def capture_dark(self, n=10):
-        frames = self._capture_n_frames(n, f"Capturing dark frames ({n})")
-        if frames is None:
+        return image
+
+    def _capture_bin(self) -> int:
+        g = self._capture_geometry
+        return int(g.bin) if g is not None else 1
+
+    def _master_method(self, kind: str, method=None) -> str:
+        return method or self.settings.data.get(kind, {}).get("stack_method", "median")
+
+    def _master_path(self, kind: str) -> str:
+        exposure_us, gain = self._capture_exposure
+        path = library_path(self._out_dir("calibration"), kind, exposure_us, gain, self._capture_bin())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _add_master(self, kind: str, path: str, master: np.ndarray, method: str, n: int) -> str:
+        """
+        Files the master just saved at path in the kind library, stores its
+        defect map next to it and switches the kind on. Returns a status line.
+        """
+        defects = DefectMap.find(master, kind)
+        defects.save(defects_path(path))
+
+        exposure_us, gain = self._capture_exposure
+        cfg = self.settings.data.get(kind, {})
+        add_to_library(cfg, {
+            "path": path,
+            "exposure_us": int(exposure_us),
+            "gain": int(gain),
+            "bin": self._capture_bin(),
+            "stack_method": method,
+            "frames": int(n),
+        })
+        cfg["enabled"] = True
+        self.settings.set(kind, cfg)
+        # a master replaced at the same exposure and gain has a new mtime
+        self.masters.refresh()
+        if len(defects) < defects.flagged:
+            return f"Master {kind} saved, {defects.flagged} pixels stand out, too many for a defect map"
+        return f"Master {kind} saved, {len(defects)} defect pixels"
+
+    def capture_dark(self, n=10, method=None):
+        method = self._master_method("dark", method)
+        master_dark = self._capture_stack(n, f"Capturing dark frames ({n})", raw=True, method=method)
+        if master_dark is None:
             return
 
-        master_dark = make_master_dark(frames, method="median")
-
-        out_dir = os.path.join(os.getcwd(), "calibration")
-        os.makedirs(out_dir, exist_ok=True)
-        dark_path = os.path.join(out_dir, "master_dark.tiff")
-
+        dark_path = self._master_path("dark")
         save_tiff16(dark_path, master_dark)
+        self.status.emit(self._add_master("dark", dark_path, master_dark, method, n))
 
+    def capture_flat(self, n=10, method=None):
         dark = self.settings.data.get("dark", {})
-        dark["path"] = dark_path
-        dark["enabled"] = True
-        dark["exposure_us"] = int(self.settings.data.get("exposure_us", 0))
-        dark["gain"] = int(self.settings.data.get("gain", 0))
-        self.settings.set("dark", dark)
-
-        flat = self.settings.data.get("flat", {})
-        flat["enabled"] = False
-        self.settings.set("flat", flat)
-
-        self.status.emit("Master dark saved")
-
-    def capture_flat(self, n=10):
-        dark = self.settings.data.get("dark", {})
-        dark_path = dark.get("path", None)
-        if not dark_path or not os.path.exists(dark_path):
+        if not any(os.path.exists(e["path"]) for e in library_entries(dark)):
             QtWidgets.QMessageBox.warning(self.parent_widget, "No dark", "Capture a dark frame first.")
             return
 
-        frames = self._capture_n_frames(n, f"Capturing flat frames ({n})")
-        if frames is None:
+        method = self._master_method("flat", method)
+        flat16 = self._capture_stack(n, f"Capturing flat frames ({n})", raw=True, method=method)
+        if flat16 is None:
             return
 
-        master_dark = self._load_master_dark()
+        h, w = flat16.shape
+        master_dark = self.masters.view(
+            "dark", self._capture_geometry or SensorGeometry(w, h, 0, 0, w, h, 1), *self._capture_exposure
+        )
         if master_dark is None:
-            QtWidgets.QMessageBox.warning(self.parent_widget, "Dark missing", "Could not load master dark.")
+            QtWidgets.QMessageBox.warning(
+                self.parent_widget, "Dark missing", "No master dark fits this exposure and gain, capture one first."
+            )
             return
 
-        master_flat_norm = make_master_flat(frames, master_dark, method="median")
-
-        out_dir = os.path.join(os.getcwd(), "calibration")
-        os.makedirs(out_dir, exist_ok=True)
-        flat_path = os.path.join(out_dir, "master_flat.tiff")
+        master_flat_norm = normalize_flat(flat16, master_dark)
 
+        flat_path = self._master_path("flat")
         save_flat_float(flat_path, master_flat_norm)
+        self.status.emit(self._add_master("flat", flat_path, master_flat_norm, method, n))
+
+    def make_snapshot(self, out16: np.ndarray):
+        """
+        Saves a stacked snapshot, returns (path, image). Touches no widgets, so
+        several cameras can run this in parallel.
+        """
+        out_dir = self._out_dir("snapshots")
+        ts = time.strftime("%Y%m%d_%H%M%S")
+        out_path = os.path.join(out_dir, f"snapshot_{ts}.tiff")
 
-        flat = self.settings.data.get("flat", {})
-        flat["path"] = flat_path
-        flat["enabled"] = True
-        flat["exposure_us"] = int(self.settings.data.get("exposure_us", 0))
-        flat["gain"] = int(self.settings.data.get("gain", 0))
-        self.settings.set("flat", flat)
-
-        self.status.emit("Master flat saved")
+        save_tiff16(out_path, out16)
+        return out_path, out16
 
-    def take_snapshot(self, n: int):
+    def take_snapshot(self, n: int, requested_at=None, method: str = "median"):
         n = max(1, min(200, int(n)))
 
-        frames = self._capture_n_frames(n, f"Capturing snapshot ({n} frames)")
-        if frames is None:
+        out16 = self._capture_stack(n, f"Capturing snapshot ({n} frames)", requested_at=requested_at, method=method)
+        if out16 is None:
             return
 
-        master_dark = self._load_master_dark()
-        master_flat = self._load_master_flat()
-
-        calibrated = []
-        for f in frames:
-            img = f.astype(np.float32)
-
-            if master_dark is not None and master_dark.shape == f.shape:
-                img = img - master_dark.astype(np.float32)
-
-            if master_flat is not None and master_flat.shape == f.shape:
-                denom = np.clip(master_flat, 1e-6, None)
-                img = img / denom
-
-            img = np.clip(img, 0, 65535).astype(np.uint16)
-            calibrated.append(img)
-
-        out16 = self._stack_median_uint16(calibrated)
-
-        out_dir = os.path.join(os.getcwd(), "snapshots")
-        os.makedirs(out_dir, exist_ok=True)
-        ts = time.strftime("%Y%m%d_%H%M%S")
-        out_path = os.path.join(out_dir, f"snapshot_{ts}.tiff")
-
-        save_tiff16(out_path, out16)
+        out_path, out16 = self.make_snapshot(out16)
 
         self.status.emit(f"Snapshot saved: {os.path.basename(out_path)}")
         self._show_preview(out16)
@@ -274,3 +376,69 @@ class SnapshotManager(QtCore.QObject):
         self._preview.show()
         self._preview.raise_()
         self._preview.activateWindow()
+
+
+def take_snapshots(managers: list[SnapshotManager], n: int, parent_widget: QtWidgets.QWidget, requested_at=None,
+                   method: str = "median"):
+    """
+    Snapshot on several cameras at once. Frames are collected and stacked on
+    every camera's collector thread concurrently and saved in parallel, so the
+    wall time is about that of the slowest camera rather than the sum.
+    Returns one (path, image) per manager, None where capture came up short.
+    """
+    n = max(1, min(200, int(n)))
+    if requested_at is None:
+        requested_at = time.monotonic()
+
+    if any(m.ring.latest_seq() == 0 for m in managers):
+        QtWidgets.QMessageBox.warning(parent_widget, "No frames", "No camera frames yet.")
+        return [None] * len(managers)
+
+    progress = QtWidgets.QProgressDialog(
+        f"Capturing snapshot ({n} frames, {len(managers)} cameras)", "Cancel", 0, n * len(managers), parent_widget
+    )
+    progress.setWindowModality(QtCore.Qt.WindowModal)
+    progress.setMinimumDuration(0)
+
+    collectors = [m.new_collector(n, requested_at, method=method) for m in managers]
+    loop = QtCore.QEventLoop()
+    running = [len(collectors)]
+
+    def on_progress(_):
+        progress.setValue(sum(c.count for c in collectors))
+
+    def on_finished():
+        running[0] -= 1
+        if running[0] == 0:
+            loop.quit()
+
+    for c in collectors:
+        c.progress.connect(on_progress)
+        c.finished.connect(on_finished)
+        progress.canceled.connect(c.cancel)
+
+    for c in collectors:
+        c.start()
+    loop.exec_()
+    for c in collectors:
+        c.wait()
+    progress.close()
+
+    captured = [m.collected(c) for m, c in zip(managers, collectors)]
+    short = [m.camera_id for m, out16 in zip(managers, captured) if out16 is None]
+    if short:
+        QtWidgets.QMessageBox.warning(
+            parent_widget, "Capture incomplete", f"Capture incomplete for camera(s): {', '.join(short)}"
+        )
+
+    with ThreadPoolExecutor(max_workers=len(managers)) as pool:
+        futures = [
+            pool.submit(m.make_snapshot, out16) if out16 is not None else None
+            for m, out16 in zip(managers, captured)
+        ]
+        results = [f.result() if f is not None else None for f in futures]
+
+    for m, r in zip(managers, results):
+        if r is not None:
+            m.status.emit(f"Snapshot saved: {os.path.basename(r[0])}")
+    return results
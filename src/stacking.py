@@ -0,0 +1,452 @@
+import math
+import mmap
+import os
+import tempfile
+
+import numpy as np
+
+from calibration_frames import CalibrationKernel, median_stack, winsorized_stack
+
+
+# beyond this median and winsorized stacks are reduced block by block
+CUBE_BUDGET_BYTES = 1 << 30
+# stacks given a scratch directory keep this much in memory and spill the rest
+SPILL_BUDGET_BYTES = 128 << 20
+# rows of a spilled stack are read back in bands of about this size
+SCRATCH_BAND_BYTES = 64 << 20
+
+
+def same_masters(a, b) -> bool:
+    """
+    True if two (dark, flat_inv, defects) calibrations show the same masters.
+    Frames get their own views of them, and the same DefectIndex.
+    """
+    for x, y in zip(a, b):
+        if (x is None) != (y is None):
+            return False
+        if x is not None and not isinstance(x, np.ndarray):
+            if x is not y:
+                return False
+        elif x is not None and (x.shape != y.shape or x.strides != y.strides
+                              or x.__array_interface__["data"][0] != y.__array_interface__["data"][0]):
+            return False
+    return True
+
+
+class ScratchCube:
+    """
+    A uint16 (n, h, w) frame cube in a file in directory. Frames are written
+    through a memory map of it, release() drops the mapped pages from the
+    process's memory (where the OS allows it) while the data stays in the
+    file. Bands of rows are read back with plain reads: faulting them in
+    through the map would bring whole large pages of every frame along. So
+    resident memory doesn't grow with n.
+
+    The space is reserved up front, a full disk fails here with a
+    RuntimeError rather than on a later write. On POSIX the file is unlinked
+    as soon as it is mapped and can't outlive the process, elsewhere close()
+    deletes it.
+    """
+
+    def __init__(self, shape, directory: str):
+        self.shape = tuple(int(x) for x in shape)
+        self.nbytes = math.prod(self.shape) * 2
+        os.makedirs(directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix="stack-", suffix=".tmp", dir=directory)
+        try:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(fd, 0, self.nbytes)
+            else:
+                os.ftruncate(fd, self.nbytes)
+            self._mmap = mmap.mmap(fd, self.nbytes)
+        except OSError as e:
+            os.close(fd)
+            os.remove(path)
+            raise RuntimeError(f"No room for a {self.nbytes >> 20} MiB scratch stack in {directory}: {e}") from e
+        self._file = os.fdopen(fd, "r+b", buffering=0)
+        self.path = path
+        if os.name == "posix":
+            os.remove(path)
+            self.path = None
+        self.array = np.ndarray(self.shape, dtype=np.uint16, buffer=self._mmap)
+
+    def release(self, start: int = 0, stop: int = None):
+        """Drops the pages of bytes start:stop from memory."""
+        if self._mmap is None or not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        stop = self.nbytes if stop is None else min(stop, self.nbytes)
+        start -= start % mmap.PAGESIZE
+        if stop > start:
+            self._mmap.madvise(mmap.MADV_DONTNEED, start, stop - start)
+
+    def release_frame(self, i: int):
+        size = self.nbytes // self.shape[0]
+        self.release(i * size, (i + 1) * size)
+
+    def read_rows(self, rows: slice, out: np.ndarray = None) -> np.ndarray:
+        """Rows of the first len(out) frames (all without out) as an (n, rows, w) array."""
+        n, h, w = self.shape
+        y0, y1, _ = rows.indices(h)
+        if out is None:
+            out = np.empty((n, y1 - y0, w), dtype=np.uint16)
+        for i in range(len(out)):
+            self._file.seek((i * h + y0) * w * 2)
+            self._file.readinto(memoryview(out[i]).cast("B"))
+        return out
+
+    def close(self):
+        self.array = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+            self._file.close()
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+
+class Stacker:
+    """
+    Stacks frames one at a time as they arrive, result() returns the uint16
+    stack. Frames are copied into the stacker's own storage, so the caller can
+    hand the buffer back right after add().
+
+    calibration is a frame's pending (dark, flat_inv, defects) from
+    Frame.calibration. It is only left to the stacks that commute with it
+    (CALIBRATE_AFTER_STACKING), so the first frame's is applied once to the
+    result. A frame that waits for other masters (or none) is calibrated with
+    its own and mapped back to the first frame's raw values.
+    """
+
+    def __init__(self, n: int):
+        self.n = max(1, int(n))
+        self.count = 0
+        self._calibration = None
+        self._kernel = None
+
+    def add(self, data: np.ndarray, calibration=None, weight: float = 1.0):
+        if self.count == 0:
+            self._calibration = calibration
+        elif not self._matches(calibration):
+            data = self._to_reference(data, calibration)
+        self._add(data, float(weight))
+        self.count += 1
+
+    def _matches(self, calibration) -> bool:
+        if calibration is None or self._calibration is None:
+            return calibration is None and self._calibration is None
+        return same_masters(calibration, self._calibration)
+
+    def result(self) -> np.ndarray:
+        out = self._result()
+        if self._calibration is not None:
+            return self._apply(out, *self._calibration)
+        return np.clip(out, 0, 65535).astype(np.uint16)
+
+    def _apply(self, img, dark, flat_inv, defects=None) -> np.ndarray:
+        if self._kernel is None:
+            self._kernel = CalibrationKernel(workers=1)
+        out = self._kernel.apply(img, dark, flat_inv)
+        if defects is not None:
+            defects.apply(out)
+        return out
+
+    def _to_reference(self, data, calibration):
+        img = data.astype(np.float32)
+        if calibration is not None:
+            img = self._apply(img, *calibration).astype(np.float32)
+        if self._calibration is not None:
+            dark, flat_inv = self._calibration[:2]
+            if flat_inv is not None:
+                img /= flat_inv
+            if dark is not None:
+                img += dark
+        return img
+
+    def close(self):
+        """Frees what the stacker holds besides memory, call once result() is taken or not needed."""
+
+    def _add(self, data: np.ndarray, weight: float):
+        raise NotImplementedError
+
+    def _result(self) -> np.ndarray:
+        raise NotImplementedError
+
+
+class MeanStacker(Stacker):
+    """Running (weighted) sum, one float64 frame of memory."""
+
+    def __init__(self, n: int):
+        super().__init__(n)
+        self._sum = None
+        self._weight = 0.0
+
+    def _add(self, data, weight):
+        if self._sum is None:
+            self._sum = np.zeros(data.shape, dtype=np.float64)
+        if weight == 1.0:
+            self._sum += data
+        else:
+            self._sum += weight * data.astype(np.float64)
+        self._weight += weight
+
+    def _result(self):
+        return self._sum / max(self._weight, 1e-12)
+
+
+class SigmaClipStacker(Stacker):
+    """
+    One-pass sigma-clipped mean. The first min_frames frames are held back and
+    seed the statistics robustly, from their median and median absolute
+    deviation. From then on each frame's pixels are judged against the running
+    mean and standard deviation of the frames before it and only summed when
+    within kappa sigma. Rejected values still enter the statistics, clamped to
+    the kappa sigma bounds, so an outlier can't widen them but a real change
+    can't lock a pixel out either. Sigma is at least half the seed's typical
+    one (and 1 ADU), as a few frames can agree by chance. Where most values of
+    a pixel were rejected the seed was off (outliers in most of it), the
+    rejected ones are averaged instead. Weights are ignored.
+    """
+
+    def __init__(self, n: int, kappa: float = 3.0, min_frames: int = 5):
+        super().__init__(n)
+        self.kappa = float(kappa)
+        self.min_frames = max(3, int(min_frames))
+        self._seed = None
+        self._floor = 1.0
+        self._mean = None
+        self._m2 = None
+        self._sum = None  # of kept values
+        self._total = None  # of all values
+        self._kept = None
+        self._x = self._d = self._t = self._keep = None  # per-frame scratch
+
+    def _add(self, data, weight):
+        k = self.count
+        if k < self.min_frames:
+            if self._seed is None:
+                self._seed = np.empty((self.min_frames,) + data.shape, dtype=np.float32)
+            np.copyto(self._seed[k], data, casting="unsafe")
+            if k + 1 == self.min_frames:
+                self._start()
+            return
+
+        x, d, t, keep = self._x, self._d, self._t, self._keep
+        np.copyto(x, data, casting="unsafe")
+        np.subtract(x, self._mean, out=d)
+
+        # t = kappa sigma
+        kk = self.kappa * self.kappa
+        np.multiply(self._m2, kk / (k - 1), out=t)
+        np.maximum(t, kk * self._floor * self._floor, out=t)
+        np.sqrt(t, out=t)
+        np.less_equal(np.abs(d, out=x), t, out=keep)
+        np.copyto(x, data, casting="unsafe")
+        self._total += x
+        np.add(self._sum, x, out=self._sum, where=keep)
+        self._kept += keep
+        np.minimum(d, t, out=d)
+        np.negative(t, out=t)
+        np.maximum(d, t, out=d)
+        self._welford(d, k)
+
+    def _start(self):
+        seed = self._seed
+        self._seed = None
+        centre = median_stack(seed)
+        dev = np.abs(seed - centre)
+        t = median_stack(dev)
+        t *= 1.4826
+        self._floor = max(1.0, 0.5 * float(np.median(t)))
+        np.maximum(t, self._floor, out=t)
+        t *= self.kappa
+
+        keep = dev <= t
+        self._total = seed.sum(axis=0, dtype=np.float32)
+        self._sum = np.where(keep, seed, 0.0).sum(axis=0, dtype=np.float32)
+        self._kept = keep.sum(axis=0, dtype=np.uint16)
+        np.clip(seed, centre - t, centre + t, out=seed)
+        self._mean = seed.mean(axis=0, dtype=np.float32)
+        self._m2 = ((seed - self._mean) ** 2).sum(axis=0, dtype=np.float32)
+
+        shape = self._mean.shape
+        self._x, self._d, self._t = (np.empty(shape, dtype=np.float32) for _ in range(3))
+        self._keep = np.empty(shape, dtype=bool)
+
+    def _welford(self, d, k):
+        # d is the clamped deviation from the mean of the k values before it
+        np.multiply(d, 1.0 / (k + 1), out=self._t)
+        self._mean += self._t
+        np.multiply(d, d, out=d)
+        d *= k / (k + 1)
+        self._m2 += d
+
+    def _result(self):
+        if self._seed is not None:
+            # fewer frames than the seed needs
+            return self._seed[:self.count].mean(axis=0)
+        kept = self._kept.astype(np.float32)
+        rejected = self.count - kept
+        return np.where(kept >= rejected, self._sum / np.maximum(kept, 1),
+                        (self._total - self._sum) / np.maximum(rejected, 1))
+
+
+class MinMaxStacker(Stacker):
+    """
+    Mean without each pixel's lowest and highest value, from a running sum,
+    minimum and maximum. With fewer than three frames it is the plain mean.
+    Weights are ignored.
+    """
+
+    def __init__(self, n: int):
+        super().__init__(n)
+        self._sum = None
+        self._lo = None
+        self._hi = None
+
+    def _add(self, data, weight):
+        if self._sum is None:
+            self._sum = np.zeros(data.shape, dtype=np.float32)
+            self._lo = np.array(data, dtype=np.float32)
+            self._hi = np.array(data, dtype=np.float32)
+        else:
+            np.minimum(self._lo, data, out=self._lo, casting="unsafe")
+            np.maximum(self._hi, data, out=self._hi, casting="unsafe")
+        np.add(self._sum, data, out=self._sum, casting="unsafe")
+
+    def _result(self):
+        if self.count < 3:
+            return self._sum / max(self.count, 1)
+        return (self._sum - self._lo - self._hi) / (self.count - 2)
+
+
+class CubeStacker(Stacker):
+    """
+    Stacks that need every value of a pixel. Frames go into a preallocated
+    uint16 (n, h, w) cube, so up to budget_bytes worth of frames are stacked
+    exactly. Larger stacks are split into equal blocks that are reduced as
+    soon as they fill and combined at the end. With a scratch_dir they are
+    spilled to a ScratchCube there instead and reduced exactly, band of rows
+    by band of rows, so memory stays at about budget_bytes whatever n is.
+    Weights are ignored.
+    """
+
+    def __init__(self, n: int, budget_bytes: int = CUBE_BUDGET_BYTES, scratch_dir: str = None):
+        super().__init__(n)
+        self.budget_bytes = int(budget_bytes)
+        self.scratch_dir = scratch_dir
+        self._scratch = None
+        self._cube = None
+        self._filled = 0
+        self._blocks = []
+
+    def _block_size(self, shape) -> int:
+        per_frame = shape[0] * shape[1] * 2
+        fit = max(1, self.budget_bytes // max(1, per_frame))
+        if self.n <= fit or self.scratch_dir is not None:
+            return self.n
+        return math.ceil(self.n / math.ceil(self.n / fit))
+
+    def _allocate(self, shape):
+        shape = (self._block_size(shape),) + tuple(shape)
+        if self.scratch_dir is not None and math.prod(shape) * 2 > self.budget_bytes:
+            self._scratch = ScratchCube(shape, self.scratch_dir)
+            return self._scratch.array
+        return np.empty(shape, dtype=np.uint16)
+
+    def _add(self, data, weight):
+        if self._cube is None:
+            self._cube = self._allocate(data.shape)
+        if data.dtype == np.uint16:
+            self._cube[self._filled] = data
+        else:
+            np.copyto(self._cube[self._filled], np.clip(np.rint(data), 0, 65535), casting="unsafe")
+        if self._scratch is not None:
+            self._scratch.release_frame(self._filled)
+        self._filled += 1
+        if self._filled == len(self._cube) and self.count + 1 < self.n:
+            self._blocks.append((self._reduce(self._cube), self._filled))
+            self._filled = 0
+
+    def _result(self):
+        if self._scratch is not None:
+            return self._reduce_scratch(self._filled)
+        blocks = list(self._blocks)
+        if self._filled:
+            blocks.append((self._reduce(self._cube[:self._filled]), self._filled))
+        if len(blocks) == 1:
+            return blocks[0][0]
+        return self._combine(blocks)
+
+    def _reduce_scratch(self, n):
+        _, h, w = self._scratch.shape
+        out = np.empty((h, w), dtype=np.float32)
+        rows = max(1, SCRATCH_BAND_BYTES // (n * w * 2))
+        band = np.empty((n, rows, w), dtype=np.uint16)
+        for y in range(0, h, rows):
+            r = slice(y, min(y + rows, h))
+            part = band[:, :r.stop - r.start]
+            out[r] = self._reduce(self._scratch.read_rows(r, part))
+        return out
+
+    def close(self):
+        self._cube = None
+        self._blocks = []
+        if self._scratch is not None:
+            self._scratch.close()
+            self._scratch = None
+
+    def _reduce(self, cube: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def _combine(self, blocks: list) -> np.ndarray:
+        """(result, frames) of every block."""
+        total = sum(k for _, k in blocks)
+        return sum(img * (k / total) for img, k in blocks)
+
+
+class MedianStacker(CubeStacker):
+    """Exact median up to the budget, beyond it when spilling, else the median of the block medians."""
+
+    def _reduce(self, cube):
+        return median_stack(cube)
+
+    def _combine(self, blocks):
+        return np.median(np.stack([img for img, _ in blocks], axis=0), axis=0)
+
+
+class WinsorizedStacker(CubeStacker):
+    """Winsorized sigma clipping, blocks beyond the budget are averaged."""
+
+    def __init__(self, n: int, kappa: float = 3.0, budget_bytes: int = CUBE_BUDGET_BYTES, scratch_dir: str = None):
+        super().__init__(n, budget_bytes, scratch_dir)
+        self.kappa = float(kappa)
+
+    def _reduce(self, cube):
+        return winsorized_stack(cube, self.kappa)
+
+
+STACKERS = {
+    "median": MedianStacker,
+    "mean": MeanStacker,
+    "sigma_clip": SigmaClipStacker,
+    "winsorized": WinsorizedStacker,
+    "minmax": MinMaxStacker,
+}
+
+
+def make_stacker(method: str, n: int, scratch_dir: str = None, budget_bytes: int = SPILL_BUDGET_BYTES,
+                 **kwargs) -> Stacker:
+    """
+    Stacker for method, KeyError for an unknown one. With scratch_dir, stacks
+    that keep every frame spill to a file there beyond budget_bytes and stay
+    exact at any n.
+    """
+    cls = STACKERS[method]
+    if scratch_dir is not None and issubclass(cls, CubeStacker):
+        kwargs["budget_bytes"] = budget_bytes
+        kwargs["scratch_dir"] = scratch_dir
+    return cls(n, **kwargs)
@@ -5,13 +5,16 @@ from settings_manager import SettingsManager
 
 class DistortionWindow(QtWidgets.QDialog):
     changed = QtCore.pyqtSignal()
+    settled = QtCore.pyqtSignal()  # a dragged slider was let go
     request_crop_selection = QtCore.pyqtSignal()
+    request_chessboard_collect = QtCore.pyqtSignal(bool)
+    request_chessboard_calibrate = QtCore.pyqtSignal()
 
     def __init__(self, settings: SettingsManager, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Distortion calibration")
         self.setWindowModality(QtCore.Qt.NonModal)
-        self.resize(560, 420)
+        self.resize(560, 560)
         self.settings = settings
 
         self._build_ui()
@@ -75,6 +78,26 @@ class DistortionWindow(QtWidgets.QDialog):
         crop_layout.addWidget(self.crop_select_btn)
 
         layout.addWidget(crop_group)
+
+        chess_group = QtWidgets.QGroupBox("Chessboard calibration")
+        chess_layout = QtWidgets.QVBoxLayout(chess_group)
+
+        self.chess_enabled = QtWidgets.QCheckBox("Use chessboard calibration instead of k1/k2/k3")
+        chess_layout.addWidget(self.chess_enabled)
+
+        self.chess_info = QtWidgets.QLabel("Not calibrated")
+        chess_layout.addWidget(self.chess_info)
+
+        chess_buttons = QtWidgets.QHBoxLayout()
+        self.chess_collect_btn = QtWidgets.QPushButton("Collect chessboard views")
+        self.chess_collect_btn.setCheckable(True)
+        self.chess_calibrate_btn = QtWidgets.QPushButton("Calibrate")
+        self.chess_calibrate_btn.setEnabled(False)
+        chess_buttons.addWidget(self.chess_collect_btn)
+        chess_buttons.addWidget(self.chess_calibrate_btn)
+        chess_layout.addLayout(chess_buttons)
+
+        layout.addWidget(chess_group)
         layout.addStretch(1)
 
         self.enabled.stateChanged.connect(self._on_any_change)
@@ -83,9 +106,23 @@ class DistortionWindow(QtWidgets.QDialog):
         self.k3_slider.valueChanged.connect(self._on_any_change)
         self.zoom_slider.valueChanged.connect(self._on_any_change)
 
+        for slider in self._sliders():
+            slider.sliderReleased.connect(self.settled.emit)
+
         self.crop_enabled.stateChanged.connect(self._on_crop_toggle)
         self.crop_select_btn.clicked.connect(self.request_crop_selection.emit)
 
+        self.chess_enabled.stateChanged.connect(self._on_chessboard_toggle)
+        self.chess_collect_btn.toggled.connect(self._on_chessboard_collect)
+        self.chess_calibrate_btn.clicked.connect(self._on_chessboard_calibrate)
+
+    def _sliders(self):
+        return self.k1_slider, self.k2_slider, self.k3_slider, self.zoom_slider
+
+    def adjusting(self) -> bool:
+        """True while a slider is being dragged, more changes are on the way."""
+        return any(slider.isSliderDown() for slider in self._sliders())
+
     def _load_from_settings(self):
         d = self.settings.data.get("distortion_manual", {})
         enabled = bool(d.get("enabled", False))
@@ -98,12 +135,15 @@ class DistortionWindow(QtWidgets.QDialog):
         crop_enabled = bool(crop.get("enabled", False))
         rect = crop.get("rect", None)
 
+        calib = self.settings.data.get("distortion_calibration", {})
+
         self.enabled.blockSignals(True)
         self.k1_slider.blockSignals(True)
         self.k2_slider.blockSignals(True)
         self.k3_slider.blockSignals(True)
         self.zoom_slider.blockSignals(True)
         self.crop_enabled.blockSignals(True)
+        self.chess_enabled.blockSignals(True)
 
         self.enabled.setChecked(enabled)
         self.k1_slider.setValue(int(np.clip(round(k1 * 1000.0), -1000, 1000)))
@@ -111,6 +151,8 @@ class DistortionWindow(QtWidgets.QDialog):
         self.k3_slider.setValue(int(np.clip(round(k3 * 1000.0), -1000, 1000)))
         self.zoom_slider.setValue(int(np.clip(round(zoom * 100.0), 50, 200)))
         self.crop_enabled.setChecked(crop_enabled)
+        self.chess_enabled.setChecked(bool(calib.get("distortion_enabled", False)))
+        self.chess_enabled.setEnabled(bool(calib.get("camera_matrix")))
 
         self.enabled.blockSignals(False)
         self.k1_slider.blockSignals(False)
@@ -118,9 +160,11 @@ class DistortionWindow(QtWidgets.QDialog):
         self.k3_slider.blockSignals(False)
         self.zoom_slider.blockSignals(False)
         self.crop_enabled.blockSignals(False)
+        self.chess_enabled.blockSignals(False)
 
         self._refresh_labels()
         self._refresh_crop_info(rect)
+        self._refresh_chessboard_info(calib)
 
     def _refresh_labels(self):
         k1 = self.k1_slider.value() / 1000.0
@@ -140,6 +184,49 @@ class DistortionWindow(QtWidgets.QDialog):
         x0, y0, x1, y1 = rect
         self.crop_info.setText(f"Crop rect: x {x0} to {x1}, y {y0} to {y1}")
 
+    def _refresh_chessboard_info(self, calib):
+        if not calib.get("camera_matrix"):
+            self.chess_info.setText("Not calibrated")
+            return
+        boards = calib.get("boards", None)
+        err = float(calib.get("reprojection_error", 0.0))
+        src = f"{boards} boards, " if boards else ""
+        self.chess_info.setText(f"Calibrated from {src}reprojection error {err:.3f} px")
+
+    def set_chessboard_progress(self, found: int, tried: int):
+        self.chess_info.setText(f"Collecting: chessboard found in {found} of {tried} frames")
+        self.chess_calibrate_btn.setEnabled(found >= 8)
+
+    def chessboard_finished(self):
+        """Collection is over, successful or not. Shows the stored calibration again."""
+        self.chess_collect_btn.blockSignals(True)
+        self.chess_collect_btn.setChecked(False)
+        self.chess_collect_btn.blockSignals(False)
+        self.chess_collect_btn.setEnabled(True)
+        self.chess_calibrate_btn.setEnabled(False)
+        self._load_from_settings()
+
+    def _on_chessboard_collect(self, on: bool):
+        if on:
+            self.chess_info.setText("Collecting: move the chessboard around the field of view")
+            self.chess_calibrate_btn.setEnabled(False)
+        else:
+            self.chess_calibrate_btn.setEnabled(False)
+            self._refresh_chessboard_info(self.settings.data.get("distortion_calibration", {}))
+        self.request_chessboard_collect.emit(on)
+
+    def _on_chessboard_calibrate(self):
+        self.chess_collect_btn.setEnabled(False)
+        self.chess_calibrate_btn.setEnabled(False)
+        self.chess_info.setText("Calibrating...")
+        self.request_chessboard_calibrate.emit()
+
+    def _on_chessboard_toggle(self):
+        calib = self.settings.data.get("distortion_calibration", {})
+        calib["distortion_enabled"] = bool(self.chess_enabled.isChecked())
+        self.settings.set("distortion_calibration", calib)
+        self.changed.emit()
+
     def _on_any_change(self):
         self._refresh_labels()
 
@@ -1,9 +1,33 @@
-from PyQt5 import QtCore, QtWidgets
+from PyQt5 import QtCore, QtGui, QtWidgets
 
 
 class VideoLabel(QtWidgets.QLabel):
     clicked = QtCore.pyqtSignal(int, int)
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._image = None
+
+    def set_image(self, image: QtGui.QImage):
+        """Shows a display-ready image centred in the label, painted as is."""
+        self._image = image
+        self.update()
+
+    def setText(self, text: str):
+        self._image = None
+        super().setText(text)
+
+    def paintEvent(self, event):
+        if self._image is None:
+            super().paintEvent(event)
+            return
+
+        painter = QtGui.QPainter(self)
+        x = (self.width() - self._image.width()) // 2
+        y = (self.height() - self._image.height()) // 2
+        painter.drawImage(x, y, self._image)
+        painter.end()
+
     def mousePressEvent(self, event):
         if event.button() == QtCore.Qt.LeftButton:
             self.clicked.emit(event.x(), event.y())
@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from calibration_frames import save_flat_float, save_tiff16
+from calibration_masters import CalibrationMasters, library_path
+from geometry import full_geometry
+
+
+def _masters(tmp_path, dark: np.ndarray, bin: int):
+    path = library_path(str(tmp_path), "dark", 1000, 100, bin)
+    save_tiff16(path, dark)
+    settings = SimpleNamespace(data={
+        "dark": {"enabled": True, "library": [{"path": path, "exposure_us": 1000, "gain": 100, "bin": bin}]},
+        "defects": {"enabled": False},
+    })
+    return CalibrationMasters(settings)
+
+
+def test_binned_master_of_odd_binned_sensor_fits(tmp_path):
+    g = full_geometry(800, 602, 2)
+    dark = np.full(g.frame_shape, 50, dtype=np.uint16)
+    view = _masters(tmp_path, dark, 2).view("dark", g, 1000, 100)
+    assert view is not None and view.shape == (300, 400)
+
+
+def test_unbinned_master_serves_binned_frames(tmp_path):
+    dark = np.full(full_geometry(800, 602, 1).frame_shape, 50, dtype=np.uint16)
+    masters = _masters(tmp_path, dark, 1)
+    view = masters.view("dark", full_geometry(800, 602, 2), 1000, 100)
+    assert view is not None and view.shape == (300, 400)
+    assert np.all(view == 50)
+
+
+def _library(tmp_path, kind, masters):
+    """Settings with a kind library of masters, {(exposure_us, gain): image}; None keys for legacy settings."""
+    entries = []
+    for (exposure_us, gain), img in masters.items():
+        path = str(tmp_path / f"{kind}_{exposure_us}_{gain}.tiff")
+        if kind == "dark":
+            save_tiff16(path, img)
+        else:
+            save_flat_float(path, img)
+        entries.append({"path": path, "exposure_us": exposure_us, "gain": gain, "bin": 1})
+    return {kind: {"enabled": True, "library": entries}, "defects": {"enabled": False}}
+
+
+G = full_geometry(64, 48, 1)
+BIAS = np.linspace(60.0, 90.0, 64 * 48, dtype=np.float32).reshape(48, 64)
+RATE = np.linspace(0.0, 0.4, 64 * 48, dtype=np.float32).reshape(48, 64)[::-1]  # ADU per ms
+
+
+def _dark(ms):
+    return np.rint(BIAS + RATE * ms).astype(np.uint16)
+
+
+def test_exact_dark_is_used_as_it_is(tmp_path):
+    masters = CalibrationMasters(SimpleNamespace(data=_library(tmp_path, "dark", {
+        (100000, 100): _dark(100), (500000, 100): _dark(500), (500000, 200): _dark(900),
+    })))
+    assert np.array_equal(masters.view("dark", G, 500000, 100), _dark(500))
+    assert masters.notes(G, 500000, 100) == []
+
+
+def test_two_darks_model_bias_plus_dark_current(tmp_path):
+    masters = CalibrationMasters(SimpleNamespace(data=_library(tmp_path, "dark", {
+        (100000, 100): _dark(100), (500000, 100): _dark(500), (300000, 200): _dark(0),
+    })))
+    # rounding the darks to whole ADU is amplified by the extrapolation weights (-1.25, 2.25)
+    for ms, tolerance in ((300, 1.0), (1000, 2.5)):
+        expected = BIAS + RATE * ms
+        view = masters.view("dark", G, ms * 1000, 100)
+        assert np.abs(view - expected).max() <= tolerance
+        assert masters.notes(G, ms * 1000, 100) == ["Master dark scaled from the darks at 100, 500 ms"]
+
+
+def test_single_dark_of_the_gain_is_used_unscaled(tmp_path):
+    masters = CalibrationMasters(SimpleNamespace(data=_library(tmp_path, "dark", {
+        (100000, 100): _dark(100), (500000, 200): _dark(500),
+    })))
+    assert np.array_equal(masters.view("dark", G, 300000, 100), _dark(100))
+    assert "unscaled" in masters.notes(G, 300000, 100)[0]
+    # no dark of the gain at all
+    assert masters.view("dark", G, 300000, 300) is None
+
+
+def test_legacy_dark_without_exposure_and_gain_is_used(tmp_path):
+    masters = CalibrationMasters(SimpleNamespace(data=_library(tmp_path, "dark", {(None, None): _dark(200)})))
+    assert np.array_equal(masters.view("dark", G, 300000, 100), _dark(200))
+
+
+def test_closest_flat_prefers_the_same_gain(tmp_path):
+    flat = np.full(G.frame_shape, 1.0, dtype=np.float32)
+    masters = CalibrationMasters(SimpleNamespace(data=_library(tmp_path, "flat", {
+        (100000, 100): flat * 0.9, (1000000, 100): flat * 1.1, (300000, 200): flat,
+    })))
+    assert np.allclose(masters.view("flat", G, 400000, 100), 1.1)
+    assert np.allclose(masters.view("flat", G, 300000, 200), 1.0)
@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+from capture_worker import CaptureWorker
+
+
+class Camera:
+    pool = None
+
+    def __init__(self, fail_gain: bool = False):
+        self.fail_gain = fail_gain
+        self.exposure_us = self.gain = None
+        self.aborted = 0
+
+    def set_exposure_us(self, exposure_us):
+        self.exposure_us = exposure_us
+
+    def set_gain(self, gain):
+        if self.fail_gain:
+            raise RuntimeError("gain out of range")
+        self.gain = gain
+
+    def abort_exposure(self):
+        self.aborted += 1
+
+
+def _worker(camera):
+    worker = CaptureWorker(SimpleNamespace(data={"exposure_us": 1000, "gain": 50}))
+    worker.camera = camera
+    errors = []
+    worker.error.connect(errors.append)
+    return worker, errors
+
+
+def test_applied_settings_advance_the_epoch():
+    worker, errors = _worker(Camera())
+    worker._request("exposure_us", 2000)
+    worker._request("gain", 100)
+    assert worker._service_control()
+    assert errors == []
+    assert worker._applied_epoch == worker.settings_epoch() == 2
+    assert (worker._exposure_us, worker._gain) == (2000, 100)
+
+
+def test_failed_settings_are_reported_and_keep_the_epoch():
+    camera = Camera(fail_gain=True)
+    worker, errors = _worker(camera)
+    worker._request("gain", 9999)
+    assert worker._service_control()
+    assert len(errors) == 1 and "gain out of range" in errors[0]
+    assert worker._applied_epoch == 0
+    assert worker._gain == 50
+    assert camera.aborted == 0
@@ -0,0 +1,91 @@
+import numpy as np
+
+from defects import DefectIndex, DefectMap
+from geometry import SensorGeometry, full_geometry
+
+H, W = 96, 128
+# isolated pixels, at least 3 apart and 3 from the edges
+HOT = [(10, 12), (40, 70), (80, 33)]
+COLD = [(25, 100), (60, 8)]
+
+
+def _dark():
+    rng = np.random.default_rng(0)
+    dark = np.rint(rng.normal(100.0, 3.0, (H, W))).astype(np.uint16)
+    for y, x in HOT:
+        dark[y, x] = 900
+    for y, x in COLD:
+        dark[y, x] = 0
+    return dark
+
+
+def _flat():
+    rng = np.random.default_rng(1)
+    yy, xx = np.mgrid[0:H, 0:W]
+    # vignetting, which the local median follows
+    flat = (1.0 - 0.3 * (((yy - H / 2) / H) ** 2 + ((xx - W / 2) / W) ** 2)).astype(np.float32)
+    flat *= rng.normal(1.0, 0.005, (H, W)).astype(np.float32)
+    for y, x in HOT:
+        flat[y, x] *= 1.5
+    for y, x in COLD:
+        flat[y, x] *= 0.4
+    return flat
+
+
+def _flagged(dmap):
+    return sorted(zip(dmap.ys.tolist(), dmap.xs.tolist()))
+
+
+def _index(dmap, g):
+    return DefectIndex.merge(g.frame_shape, [dmap.in_frame(1, g)])
+
+
+def test_find_flags_exactly_the_planted_pixels():
+    expected = sorted(HOT + COLD)
+    assert _flagged(DefectMap.find(_dark(), "dark")) == expected
+    assert _flagged(DefectMap.find(_flat(), "flat")) == expected
+
+
+def test_apply_replaces_defects_with_their_neighbours():
+    dmap = DefectMap.find(_dark(), "dark")
+    g = full_geometry(W, H, 1)
+    yy, xx = np.mgrid[0:H, 0:W]
+    # a plane, the four nearest neighbours average to it exactly
+    plane = (1000 + 3 * xx + 5 * yy).astype(np.uint16)
+    img = plane.copy()
+    for y, x in HOT + COLD:
+        img[y, x] = 60000
+    _index(dmap, g).apply(img)
+    assert np.array_equal(img, plane)
+
+
+def test_crop_of_the_index_fixes_cropped_frames():
+    dmap = DefectMap.find(_dark(), "dark")
+    index = _index(dmap, full_geometry(W, H, 1))
+    rect = (5, 20, 110, 90)  # holds (25, 100), (40, 70), (60, 8), (80, 33)
+    yy, xx = np.mgrid[0:H, 0:W]
+    plane = (1000 + 3 * xx + 5 * yy).astype(np.uint16)
+    img = plane.copy()
+    for y, x in HOT + COLD:
+        img[y, x] = 60000
+    x0, y0, x1, y1 = rect
+    cropped = np.ascontiguousarray(img[y0:y1, x0:x1])
+    cropped_index = index.crop(rect)
+    assert len(cropped_index) == 4
+    assert index.crop(rect) is cropped_index
+    cropped_index.apply(cropped)
+    assert np.array_equal(cropped, plane[y0:y1, x0:x1])
+
+
+def test_binned_roi_frames_get_the_defects_of_their_window():
+    dmap = DefectMap.find(_dark(), "dark")
+    # 2x2 binned window over rows 8..71 and columns 8..103
+    g = SensorGeometry(W, H, 8, 8, 96, 64, 2)
+    inside = [(y, x) for y, x in HOT + COLD if 8 <= y < 72 and 8 <= x < 104]
+    frame = np.full(g.frame_shape, 500, dtype=np.uint16)
+    for y, x in inside:
+        frame[(y - 8) // 2, (x - 8) // 2] = 60000
+    index = _index(dmap, g)
+    assert len(index) == len(inside) == 4
+    index.apply(frame)
+    assert np.all(frame == 500)
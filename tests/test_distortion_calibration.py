@@ -0,0 +1,16 @@
+import numpy as np
+
+from distortion_calibration import ChessboardCollector
+from geometry import SensorGeometry, full_geometry
+
+
+def test_offer_takes_binned_full_frames():
+    collector = ChessboardCollector(workers=1, min_interval_s=0.0)
+    try:
+        # 602 / 2 = 301 rows, binned full frames have 300
+        g = full_geometry(800, 602, 2)
+        window = SensorGeometry(800, 602, 96, 0, 400, 600, 2)
+        assert not collector.offer(np.zeros(window.frame_shape, dtype=np.uint16), window)
+        assert collector.offer(np.zeros(g.frame_shape, dtype=np.uint16), g)
+    finally:
+        collector.cancel()
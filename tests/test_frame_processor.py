@@ -0,0 +1,110 @@
+import dataclasses
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from frame_pool import FramePool
+from frame_processor import FrameProcessor
+from frame_ring import FrameRing
+from frames import Frame
+
+
+class PoolWorker:
+    """The part of CaptureWorker the processor and ring use."""
+
+    def __init__(self, pool: FramePool):
+        self.pool = pool
+
+    def retain_frame(self, frame):
+        self.pool.retain(frame)
+
+    def release_frame(self, frame):
+        self.pool.release(frame)
+
+
+def test_slow_processing_keeps_every_frame_a_capture_needs():
+    pool = FramePool((8, 8), size=6)
+    worker = PoolWorker(pool)
+    ring = FrameRing(capacity=32, retain_fn=worker.retain_frame, release_fn=worker.release_frame)
+    processor = FrameProcessor({}, worker, ring, pipeline=None)
+    # the processing thread only gets to drain after every tenth frame
+    processor._wake.disconnect()
+
+    ring.add_consumer(raw=True, need=12)  # a 12 frame master capture
+    seq = 0
+    for kept in (10, 2, 0):
+        for _ in range(10):
+            seq += 1
+            data = pool.acquire()
+            processor.submit(Frame(data, seq, time.monotonic(), 1000, 100, buffer=data))
+        processor._drain()
+        # the capture stacks what reached the ring
+        ring.consumed(kept)
+
+    got = ring.wait_for_frames(0, 32, timeout_s=0)
+    ring.release(got)
+    assert [f.seq for f in got] == list(range(1, 13))
+    assert ring.frames_needed() == 0
+    # frames past the capture's need went to the preview, only the newest waits there
+    assert pool.stats()["in_use"] <= 12 + 1
+
+
+class PoisoningWorker:
+    """Counts references to its buffers and scribbles over one as soon as it is free."""
+
+    def __init__(self):
+        self.refs = {}
+
+    def acquire(self, value: int) -> np.ndarray:
+        data = np.full((8, 8), value, dtype=np.uint16)
+        self.refs[id(data)] = 1
+        return data
+
+    def retain_frame(self, frame):
+        self.refs[id(frame)] += 1
+
+    def release_frame(self, frame):
+        self.refs[id(frame)] -= 1
+        if self.refs[id(frame)] == 0:
+            frame.fill(0)
+
+
+class Pipeline:
+    def __init__(self, remap: bool):
+        self.remap = remap
+        self.previewed = None
+
+    def science(self, frame, selecting=False, defer_calibration=False):
+        if self.remap:
+            # a remap writes into memory of its own
+            return dataclasses.replace(frame, data=frame.data.copy(), buffer=None)
+        return frame
+
+    def preview(self, frame, target_w, target_h, selecting=False):
+        self.previewed = frame.data.copy()
+        return frame.data, None
+
+
+@pytest.mark.parametrize("remap", (True, False))
+@pytest.mark.parametrize("consumer", (True, False))
+def test_preview_reads_the_frame_before_its_buffer_is_released(remap, consumer):
+    worker = PoisoningWorker()
+    ring = FrameRing(capacity=1, retain_fn=worker.retain_frame, release_fn=worker.release_frame)
+    pipeline = Pipeline(remap)
+    processor = FrameProcessor(SimpleNamespace(data={"preview": {"max_fps": 0}}), worker, ring, pipeline)
+    processor.previewing = True
+    if consumer:
+        ring.add_consumer()
+
+    data = worker.acquire(1234)
+    processor.process(Frame(data, 1, time.monotonic(), 1000, 100, buffer=data), science=True)
+
+    assert np.all(pipeline.previewed == 1234)
+    if consumer:
+        # the ring still holds the frame, then gives it back when it moves on
+        assert np.all(ring.latest().data == 1234)
+        other = worker.acquire(5678)
+        processor.process(Frame(other, 2, time.monotonic(), 1000, 100, buffer=other), science=True)
+    assert worker.refs[id(data)] == 0
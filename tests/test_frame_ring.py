@@ -0,0 +1,135 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from camera_factory import POOL_SIZE, SCIENCE_QUEUED
+from frame_pool import FramePool
+from frame_processor import FrameProcessor
+from frame_ring import RING_CAPACITY, FrameRing
+from frames import Frame
+
+
+def _ring(pool: FramePool) -> FrameRing:
+    return FrameRing(capacity=RING_CAPACITY, retain_fn=pool.retain, release_fn=pool.release)
+
+
+def _push(ring: FrameRing, pool: FramePool, seq: int):
+    data = pool.acquire()
+    ring.push(Frame(data, seq, time.monotonic(), 1000, 100, buffer=data))
+
+
+def test_wait_returns_frames_after_seq_oldest_first():
+    pool = FramePool((8, 8), size=POOL_SIZE)
+    ring = _ring(pool)
+    ring.add_consumer()
+    for seq in range(1, 7):
+        _push(ring, pool, seq)
+
+    # 1 and 2 were evicted, the rest come back in order, at most n of them
+    held = ring.wait_for_frames(0, n=2, timeout_s=0)
+    assert [f.seq for f in held] == [3, 4]
+    rest = ring.wait_for_frames(4, n=3, timeout_s=0.05)
+    assert [f.seq for f in rest] == [5, 6]
+    ring.release(rest)
+    assert ring.wait_for_frames(6, timeout_s=0) == []
+
+    # retained frames outlive their eviction until released
+    _push(ring, pool, 7)
+    _push(ring, pool, 8)
+    assert pool.stats()["in_use"] == RING_CAPACITY + 2
+    ring.release(held)
+    assert pool.stats()["in_use"] == RING_CAPACITY
+
+    ring.remove_consumer()
+    assert pool.stats()["in_use"] == 0
+
+
+def test_wait_blocks_until_enough_frames_arrive():
+    pool = FramePool((8, 8), size=POOL_SIZE)
+    ring = _ring(pool)
+    ring.add_consumer()
+    _push(ring, pool, 1)
+
+    def produce():
+        for seq in (2, 3):
+            time.sleep(0.05)
+            _push(ring, pool, seq)
+
+    t = threading.Thread(target=produce)
+    t.start()
+    frames = ring.wait_for_frames(1, n=2, timeout_s=5.0)
+    t.join()
+    assert [f.seq for f in frames] == [2, 3]
+    ring.release(frames)
+    ring.remove_consumer()
+    assert pool.stats()["in_use"] == 0
+
+
+def test_frames_held_by_a_leaving_consumer_stay_valid():
+    pool = FramePool((8, 8), size=POOL_SIZE)
+    ring = _ring(pool)
+    ring.add_consumer(need=3)
+    for seq in range(1, 4):
+        _push(ring, pool, seq)
+    held = ring.wait_for_frames(0, n=3, timeout_s=0)
+    held[0].data[:] = 7
+
+    ring.remove_consumer(need=3)
+    assert ring.frames_needed() == 0
+    assert pool.stats()["in_use"] == 3
+    kept = ring.detach(held[0])
+    ring.release(held[1:])
+    assert pool.stats()["in_use"] == 0
+    # the buffer is back in the pool, the detached copy is not
+    pool.acquire()[:] = 0
+    assert (kept == 7).all()
+
+
+def test_last_consumer_leaving_frees_the_ring():
+    pool = FramePool((8, 8), size=POOL_SIZE)
+    ring = _ring(pool)
+    ring.add_consumer()
+    ring.add_consumer(raw=True)
+    for seq in range(1, 8):
+        _push(ring, pool, seq)
+    assert pool.stats()["in_use"] == RING_CAPACITY
+
+    ring.remove_consumer(raw=True)
+    assert pool.stats()["in_use"] == RING_CAPACITY
+    ring.remove_consumer()
+    assert pool.stats()["in_use"] == 0
+    assert ring.latest() is None
+
+    # a frame that was still being processed when the consumer left
+    _push(ring, pool, 8)
+    assert pool.stats()["in_use"] == 0
+    assert ring.latest_seq() == 8
+
+
+def test_default_pool_holds_a_full_ring_and_queue():
+    pool = FramePool((8, 8), size=POOL_SIZE)
+    worker = SimpleNamespace(retain_frame=pool.retain, release_frame=pool.release)
+    ring = _ring(pool)
+    processor = FrameProcessor({}, worker, ring, pipeline=None)
+    # processing only gets to run after SCIENCE_QUEUED frames
+    processor._wake.disconnect()
+
+    ring.add_consumer(raw=True, need=1000)
+    seq = 0
+    held = []
+    for _ in range(50):
+        for _ in range(SCIENCE_QUEUED):
+            seq += 1
+            data = pool.acquire()
+            processor.submit(Frame(data, seq, time.monotonic(), 1000, 100, buffer=data))
+        processor._drain()
+        # the collector works on the newest frame while the ring stays full
+        ring.release(held)
+        held = ring.wait_for_frames(seq - 1, timeout_s=0)
+        ring.consumed(SCIENCE_QUEUED)
+    assert pool.stats()["in_use"] == RING_CAPACITY
+    assert pool.stats()["misses"] == 0
+
+    ring.release(held)
+    ring.remove_consumer(raw=True, need=ring.frames_needed())
+    assert pool.stats()["in_use"] == 0
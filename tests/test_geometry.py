@@ -0,0 +1,29 @@
+import numpy as np
+
+from geometry import SensorGeometry, full_geometry, master_for_geometry
+
+
+def test_binned_full_frame_with_odd_binned_height_is_full():
+    # 2822 / 2 = 1411 rows, the camera reads out 1410
+    g = full_geometry(4144, 2822, 2)
+    assert g.frame_shape == (1410, 2072)
+    assert g.is_full
+    assert full_geometry(800, 602, 2).is_full
+    assert not SensorGeometry(800, 602, 0, 0, 800, 602, 2).is_full
+    assert not SensorGeometry(800, 602, 8, 0, 784, 600, 2).is_full
+
+
+def test_master_for_geometry_takes_aligned_masters():
+    g = full_geometry(800, 602, 2)
+
+    binned = np.arange(300 * 400, dtype=np.uint16).reshape(300, 400)
+    assert np.array_equal(master_for_geometry(binned, 2, g), binned)
+
+    unbinned = np.full((602, 800), 100, dtype=np.uint16)
+    unbinned[:2, :2] = 200
+    view = master_for_geometry(unbinned, 1, g)
+    assert view.shape == g.frame_shape
+    assert view[0, 0] == 200 and view[1, 1] == 100
+
+    # a master of the unaligned binned size is not one of this camera's frames
+    assert master_for_geometry(np.zeros((301, 400), dtype=np.uint16), 2, g) is None
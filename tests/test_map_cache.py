@@ -0,0 +1,104 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+
+from distortion import DistortionCorrector
+from geometry import SensorGeometry, full_geometry
+from map_cache import MapCache
+
+
+def _maps(v):
+    return np.full((4, 6, 2), v, dtype=np.int16), np.full((4, 6), v, dtype=np.uint16)
+
+
+def _settings(k1=-0.1):
+    return SimpleNamespace(data={"distortion_manual": {"enabled": True, "k1": k1, "k2": 0.0, "k3": 0.0, "zoom": 1.0}})
+
+
+def _age(cache, key, seconds_ago):
+    t = os.path.getmtime(cache._paths(key)[0]) - seconds_ago
+    for path in cache._paths(key):
+        os.utime(path, (t, t))
+
+
+def test_eviction_drops_the_least_recently_used(tmp_path):
+    cache = MapCache(str(tmp_path), max_entries=2)
+    cache.store("a", *_maps(1))
+    cache.store("b", *_maps(2))
+    _age(cache, "a", 200)
+    _age(cache, "b", 100)
+
+    # a hit makes "a" the most recent, so "b" goes when "c" arrives
+    assert cache.load("a") is not None
+    cache.store("c", *_maps(3))
+
+    assert cache.load("b") is None
+    assert int(cache.load("a")[0][0, 0, 0]) == 1
+    assert int(cache.load("c")[0][0, 0, 0]) == 3
+    assert len(os.listdir(tmp_path)) == 4
+
+
+def test_key_follows_geometry_and_coefficients():
+    dc = DistortionCorrector()
+    g = full_geometry(640, 480, 1)
+    key = dc.plan_maps(*g.frame_shape[::-1], _settings(), geometry=g)[0]
+
+    binned = full_geometry(640, 480, 2)
+    roi = SensorGeometry(640, 480, 64, 32, 320, 240, 1)
+    others = [
+        dc.plan_maps(*binned.frame_shape[::-1], _settings(), geometry=binned)[0],
+        dc.plan_maps(*roi.frame_shape[::-1], _settings(), geometry=roi)[0],
+        dc.plan_maps(*g.frame_shape[::-1], _settings(k1=-0.2), geometry=g)[0],
+        dc.plan_maps(*g.frame_shape[::-1], _settings(), geometry=g, region=(0, 0, 320, 240))[0],
+    ]
+    assert len({key, *others}) == 5
+    assert dc.plan_maps(*g.frame_shape[::-1], _settings(), geometry=g)[0] == key
+
+
+def test_changed_coefficients_build_new_maps(tmp_path):
+    cache = MapCache(str(tmp_path))
+    dc = DistortionCorrector(cache=cache)
+    g = full_geometry(160, 120, 1)
+    w, h = g.frame_shape[::-1]
+
+    plan_a = dc.plan_maps(w, h, _settings(-0.1), geometry=g)
+    plan_b = dc.plan_maps(w, h, _settings(-0.3), geometry=g)
+    a = dc.load_or_build(plan_a)
+    b = dc.load_or_build(plan_b)
+
+    assert not np.array_equal(a[0], b[0])
+    assert np.array_equal(cache.load(plan_a[0])[0], a[0])
+    assert np.array_equal(cache.load(plan_b[0])[0], b[0])
+
+
+def test_corrupt_or_partial_entries_are_rebuilt(tmp_path):
+    cache = MapCache(str(tmp_path))
+    dc = DistortionCorrector(cache=cache)
+    g = full_geometry(160, 120, 1)
+    plan = dc.plan_maps(*g.frame_shape[::-1], _settings(), geometry=g)
+    key = plan[0]
+    built = dc._build_maps(*plan[1])
+    p1, p2 = cache._paths(key)
+
+    # a truncated write
+    dc.load_or_build(plan)
+    with open(p1, "r+b") as f:
+        f.truncate(os.path.getsize(p1) // 2)
+    assert cache.load(key) is None
+    maps = dc.load_or_build(plan)
+    assert np.array_equal(maps[0], built[0]) and np.array_equal(maps[1], built[1])
+    assert np.array_equal(cache.load(key)[0], built[0])
+
+    # not a .npy at all
+    with open(p2, "wb") as f:
+        f.write(b"garbage")
+    assert cache.load(key) is None
+    dc.load_or_build(plan)
+    assert np.array_equal(cache.load(key)[1], built[1])
+
+    # half of the pair missing
+    os.remove(p2)
+    assert cache.load(key) is None
+    dc.load_or_build(plan)
+    assert np.array_equal(cache.load(key)[1], built[1])
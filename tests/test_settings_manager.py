@@ -0,0 +1,30 @@
+from camera_factory import get_backend_name
+from settings_manager import CameraSettings, SettingsManager
+
+
+def _settings(tmp_path, cameras):
+    settings = SettingsManager(str(tmp_path / "settings.json"))
+    settings.data.update({
+        "camera": {"backend": "sim", "id": "front", "index": 0, "bin": 2, "sim": {"width": 800, "height": 602}},
+        "cameras": cameras,
+    })
+    return settings
+
+
+def test_second_camera_uses_the_shared_backend(tmp_path):
+    settings = _settings(tmp_path, [{"id": "rear"}, {"id": "side", "camera": {"index": 3, "bin": 1}}])
+    rear = CameraSettings(settings, settings.data["cameras"][0])
+    side = CameraSettings(settings, settings.data["cameras"][1])
+
+    assert get_backend_name(rear) == "sim"
+    assert get_backend_name(side) == "sim"
+    assert "index" not in rear.data["camera"] and "id" not in rear.data["camera"]
+    assert side.data["camera"]["index"] == 3
+    assert side.data["camera"]["bin"] == 1
+    assert rear.data["camera"]["bin"] == 2
+
+    # a camera's block is its own
+    cam = rear.data["camera"]
+    cam["sim"]["width"] = 640
+    rear.set("camera", cam)
+    assert settings.data["camera"]["sim"]["width"] == 800
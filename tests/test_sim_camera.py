@@ -0,0 +1,29 @@
+import numpy as np
+
+from sim_camera import SimulatedCamera
+
+
+def _noise(camera: SimulatedCamera, n: int) -> np.ndarray:
+    frames = [camera.get_frame().astype(np.float32) for _ in range(n)]
+    for f in frames:
+        camera.release_frame(f)
+    stack = np.stack(frames)
+    return stack - stack.mean(axis=0)
+
+
+def test_noise_offsets_do_not_repeat():
+    camera = SimulatedCamera(width=64, height=48, realtime=False, seed=1)
+    offsets = [int(camera._noise_offsets[i]) for i in range(camera._noise_pad)]
+    assert len(set(offsets)) == camera._noise_pad
+
+
+def test_pixel_noise_is_independent_between_frames():
+    for fresh in (False, True):
+        camera = SimulatedCamera(width=64, height=48, realtime=False, seed=2, fresh_noise=fresh)
+        camera.set_exposure_us(1000000)
+        noise = _noise(camera, 64)
+        # correlation of each pixel's noise in consecutive frames, over all pixels
+        a, b = noise[:-1].ravel(), noise[1:].ravel()
+        r = float(np.dot(a, b) / np.sqrt(np.dot(a, a) * np.dot(b, b)))
+        # the mean subtracted from 64 frames leaves -1/63 on its own
+        assert abs(r + 1 / 63) < 0.02
@@ -0,0 +1,51 @@
+import time
+
+import numpy as np
+
+from frame_ring import FrameRing
+from frames import Frame
+from geometry import full_geometry
+from snapshot import FrameCollector
+from stacking import make_stacker
+
+
+def test_raw_collector_takes_binned_full_frames():
+    # 602 / 2 = 301 rows, binned full frames have 300
+    g = full_geometry(800, 602, 2)
+    ring = FrameRing(capacity=4)
+    collector = FrameCollector(ring, make_stacker("mean", 3), timeout_s=5.0, raw=True)
+    collector.start()
+    for seq in range(1, 4):
+        ring.push(Frame(np.full(g.frame_shape, seq, dtype=np.uint16), seq, time.monotonic(), 1000, 100, geometry=g))
+    assert collector.wait(10000)
+    assert collector.error is None
+    assert collector.count == 3
+    assert collector.image.shape == g.frame_shape
+
+
+def test_collector_skips_frames_from_before_the_request():
+    g = full_geometry(64, 48, 1)
+    ring = FrameRing(capacity=8)
+    requested_at = time.monotonic()
+    collector = FrameCollector(
+        ring, make_stacker("mean", 2), timeout_s=5.0, min_epoch=3, not_before=requested_at, raw=False
+    )
+    collector.start()
+
+    def push(seq, value, epoch, exposure_start):
+        ring.push(Frame(np.full(g.frame_shape, value, dtype=np.uint16), seq, time.monotonic(), 1000, 100,
+                        epoch=epoch, exposure_start=exposure_start, geometry=g, raw=False))
+
+    # taken with the old settings
+    push(1, 1000, 2, requested_at + 1.0)
+    # exposure started before the request
+    push(2, 1000, 3, requested_at - 0.5)
+    push(3, 5, 3, requested_at + 0.1)
+    push(4, 5, 4, requested_at + 0.2)
+
+    assert collector.wait(10000)
+    assert collector.error is None
+    assert collector.count == 2
+    assert collector.skipped == 2
+    assert np.array_equal(collector.image, np.full(g.frame_shape, 5))
+    assert not ring.wanted()
@@ -0,0 +1,147 @@
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from calibration_frames import CALIBRATE_AFTER_STACKING, CalibrationKernel, build_master_stack, median_stack
+from frame_pipeline import FramePipeline
+from frame_ring import FrameRing
+from frames import Frame
+import stacking
+from snapshot import FrameCollector
+from stacking import ScratchCube, make_stacker
+
+
+def _frames(n=7, shape=(120, 160), seed=1):
+    rng = np.random.default_rng(seed)
+    h, w = shape
+    dark = rng.normal(300.0, 20.0, shape).astype(np.float32)
+    dark[rng.integers(0, h, 40), rng.integers(0, w, 40)] += 2000.0
+    # vignetting down to half at the corners
+    yy, xx = np.mgrid[0:h, 0:w]
+    r2 = ((yy - h / 2) / h) ** 2 + ((xx - w / 2) / w) ** 2
+    flat_inv = (1.0 / (1.0 - r2)).astype(np.float32)
+    scene = 1500.0 + 1000.0 * np.sin(xx / 9.0) * np.cos(yy / 13.0)
+    frames = []
+    for _ in range(n):
+        img = dark + scene / flat_inv + rng.normal(0.0, 30.0, shape)
+        hits = rng.random(shape) < 0.01
+        img[hits] += 5000.0
+        frames.append(np.clip(np.rint(img), 0, 65535).astype(np.uint16))
+    return frames, dark, flat_inv
+
+
+def _stack(method, frames, calibration=None):
+    stacker = make_stacker(method, len(frames))
+    try:
+        for f in frames:
+            stacker.add(f, calibration)
+        return stacker.result().astype(np.int64)
+    finally:
+        stacker.close()
+
+
+@pytest.mark.parametrize("method", CALIBRATE_AFTER_STACKING)
+def test_deferred_calibration_matches_per_frame(method):
+    frames, dark, flat_inv = _frames()
+    kernel = CalibrationKernel(workers=1)
+    per_frame = _stack(method, [kernel.apply(f, dark, flat_inv) for f in frames])
+    deferred = _stack(method, frames, (dark, flat_inv, None))
+    assert np.abs(per_frame - deferred).max() <= 1
+
+
+class Masters:
+    """The part of CalibrationMasters the pipeline uses, one dark and flat for every frame."""
+
+    def __init__(self, dark, flat_inv):
+        self.dark, self.flat_inv = dark, flat_inv
+
+    def operands(self, geometry, exposure_us=None, gain=None):
+        return self.dark, self.flat_inv
+
+    def defects(self, geometry, exposure_us=None, gain=None):
+        return None
+
+
+@pytest.mark.parametrize("method", ("sigma_clip", "winsorized"))
+def test_clipping_stack_snapshots_are_calibrated_per_frame(method):
+    # their sigma floor is in raw ADU, the flat scales the values it is compared with
+    frames, dark, flat_inv = _frames()
+    pipeline = FramePipeline(SimpleNamespace(data={}), masters=Masters(dark, flat_inv))
+    ring = FrameRing(capacity=len(frames))
+    collector = FrameCollector(ring, make_stacker(method, len(frames)), timeout_s=5.0,
+                               deferred=method in CALIBRATE_AFTER_STACKING)
+    collector.start()
+    try:
+        for seq, raw in enumerate(frames, 1):
+            frame = Frame(raw, seq, time.monotonic(), 1000, 100)
+            ring.push(pipeline.science(frame, defer_calibration=ring.defers_calibration()))
+        assert collector.wait(10000)
+    finally:
+        pipeline.close()
+
+    kernel = CalibrationKernel(workers=1)
+    per_frame = _stack(method, [kernel.apply(f, dark, flat_inv) for f in frames])
+    assert collector.error is None
+    assert np.array_equal(collector.image.astype(np.int64), per_frame)
+
+
+@pytest.mark.parametrize("n", (1, 2, 7, 8, 300, 301))
+def test_median_stack_matches_numpy(n):
+    # up to 256 frames go through the sorting network, beyond that partitioning
+    rng = np.random.default_rng(n)
+    frames = [rng.integers(0, 4096, (9, 13), dtype=np.uint16) for _ in range(n)]
+    expected = np.median(np.stack(frames), axis=0)
+    assert np.array_equal(median_stack(np.stack(frames)), expected)
+    assert np.array_equal(build_master_stack(frames), np.clip(expected, 0, 65535).astype(np.uint16))
+
+
+@pytest.mark.parametrize("n", (9, 10))
+def test_median_past_the_budget_stays_exact_when_spilling(n, tmp_path):
+    rng = np.random.default_rng(n)
+    frames = [rng.integers(0, 4096, (16, 24), dtype=np.uint16) for _ in range(n)]
+    # room for three frames in memory
+    stacker = make_stacker("median", n, scratch_dir=str(tmp_path), budget_bytes=3 * 16 * 24 * 2)
+    try:
+        for f in frames:
+            stacker.add(f)
+        result = stacker.result()
+    finally:
+        stacker.close()
+    expected = np.median(np.stack(frames), axis=0)
+    assert np.array_equal(result, np.clip(expected, 0, 65535).astype(np.uint16))
+
+
+@pytest.mark.parametrize("method", ("median", "winsorized"))
+def test_spilled_stack_equals_in_memory_and_leaves_no_file(method, tmp_path, monkeypatch):
+    rng = np.random.default_rng(3)
+    frames = [rng.integers(0, 4096, (40, 24), dtype=np.uint16) for _ in range(12)]
+    frames[5][3, 4] = 4095  # an outlier for the clipping to drop
+
+    in_memory = _stack(method, frames)
+
+    stacker = make_stacker(method, len(frames), scratch_dir=str(tmp_path), budget_bytes=2 * 40 * 24 * 2)
+    for f in frames:
+        stacker.add(f)
+    assert stacker._scratch is not None
+    # bands of 7 rows, so the reduction runs band by band
+    monkeypatch.setattr(stacking, "SCRATCH_BAND_BYTES", 12 * 7 * 24 * 2)
+    try:
+        spilled = stacker.result().astype(np.int64)
+    finally:
+        stacker.close()
+
+    assert np.array_equal(spilled, in_memory)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_scratch_file_is_deleted_on_close_where_it_cant_be_unlinked_early(tmp_path, monkeypatch):
+    monkeypatch.setattr(stacking.os, "name", "nt")
+    cube = ScratchCube((3, 4, 8), str(tmp_path))
+    monkeypatch.undo()
+    assert cube.path is not None and len(list(tmp_path.iterdir())) == 1
+    cube.array[1] = 7
+    assert np.all(cube.read_rows(slice(0, 4))[1] == 7)
+    cube.close()
+    assert list(tmp_path.iterdir()) == []